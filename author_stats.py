@@ -0,0 +1,73 @@
+import random
+
+from fuzzy import TrigramIndex
+
+
+# Статистика по авторам, обновляемая при каждой записи: число записей и время последнего
+# добавления. Авторы лежат в массиве с картой позиций, поэтому случайная выборка и удаление — O(1)
+class AuthorStats:
+    def __init__(self):
+        self.stats = {}  # автор в нижнем регистре -> [написание, число записей, время последнего добавления]
+        self._keys = []  # Массив авторов для случайной выборки
+        self._positions = {}  # автор в нижнем регистре -> позиция в self._keys
+        self._fuzzy = TrigramIndex()  # Поиск авторов с опечатками
+
+    def __len__(self):
+        return len(self._keys)
+
+    def clear(self):
+        self.stats.clear()
+        self._keys.clear()
+        self._positions.clear()
+        self._fuzzy.clear()
+
+    @staticmethod
+    def _authors(entry):
+        return {author.lower(): author for author in entry['authors'] if author}
+
+    def add(self, entry):
+        added_at = entry.get('added_at')
+        for key, name in self._authors(entry).items():
+            stats = self.stats.get(key)
+            if stats is None:
+                self.stats[key] = [name, 1, added_at]
+                self._positions[key] = len(self._keys)
+                self._keys.append(key)
+                self._fuzzy.add(key)
+                continue
+            stats[1] += 1
+            if added_at and (stats[2] is None or added_at > stats[2]):
+                stats[2] = added_at
+
+    def remove(self, entry):
+        # Время последнего добавления не пересчитываем: записи из каталога не удаляются,
+        # remove вызывается только перед повторным add при обновлении записи
+        for key in self._authors(entry):
+            stats = self.stats.get(key)
+            if stats is None:
+                continue
+            stats[1] -= 1
+            if stats[1] > 0:
+                continue
+            del self.stats[key]
+            self._fuzzy.remove(key)
+            # Переносим последний элемент массива на место удалённого
+            position = self._positions.pop(key)
+            last = self._keys.pop()
+            if last != key:
+                self._keys[position] = last
+                self._positions[last] = position
+
+    def get(self, author):
+        return self.stats.get(author.lower())
+
+    # Похожие авторы: [(написание, число записей)], ближайшие и самые частые первыми
+    def suggest(self, query, k=5):
+        matches = self._fuzzy.search(query)
+        matches.sort(key=lambda match: (match[0], -self.stats[match[1]][1]))
+        return [(self.stats[key][0], self.stats[key][1]) for _, key in matches[:k]]
+
+    # k случайных авторов без повторов: [(ключ, написание, число записей, время последнего добавления)]
+    def sample(self, k):
+        positions = random.sample(range(len(self._keys)), min(k, len(self._keys)))
+        return [(self._keys[i], *self.stats[self._keys[i]]) for i in positions]
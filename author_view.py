@@ -0,0 +1,85 @@
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Папки photos_by_author/<автор> как представление каталога: вместо копий —
+# жёсткие ссылки на файлы из photos (символические, если жёсткие недоступны)
+class AuthorView:
+    def __init__(self, root='photos_by_author', workers=8):
+        self.root = root
+        self.workers = workers
+
+    def _target(self, root, author, file_path):
+        return os.path.join(root, author, os.path.basename(file_path))
+
+    def _link(self, file_path, target):
+        if os.path.lexists(target):
+            try:
+                if os.path.samefile(file_path, target):
+                    return
+            except OSError:
+                pass
+            os.remove(target)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.link(file_path, target)
+        except FileExistsError:
+            # Ту же ссылку только что создал другой поток
+            pass
+        except OSError:
+            # Другая файловая система или ФС без жёстких ссылок
+            os.symlink(os.path.abspath(file_path), target)
+
+    def add(self, file_path, authors, root=None):
+        for author in authors:
+            if author:
+                self._link(file_path, self._target(root or self.root, author, file_path))
+
+    def remove(self, file_path, authors):
+        for author in authors:
+            if not author:
+                continue
+            target = self._target(self.root, author, file_path)
+            if os.path.lexists(target):
+                os.remove(target)
+            folder = os.path.dirname(target)
+            if os.path.isdir(folder) and not os.listdir(folder):
+                os.rmdir(folder)
+
+    def sync(self, file_path, old_authors, new_authors):
+        self.remove(file_path, set(old_authors) - set(new_authors))
+        self.add(file_path, new_authors)
+
+    # Слушатель изменений каталога (PhotoDatabase.add_listener)
+    def on_change(self, op, entry, previous):
+        if not os.path.exists(entry['file_path']):
+            return
+        if op == 'add' or previous is None:
+            self.add(entry['file_path'], entry['authors'])
+        else:
+            self.sync(entry['file_path'], previous['authors'], entry['authors'])
+
+    def rebuild(self, entries):
+        # Собираем дерево заново во временной папке и подменяем им старое
+        tmp_root = self.root + '.rebuild'
+        if os.path.exists(tmp_root):
+            shutil.rmtree(tmp_root)
+        os.makedirs(tmp_root)
+
+        def link_entry(entry):
+            if not os.path.exists(entry['file_path']):
+                return 0
+            self.add(entry['file_path'], entry['authors'], root=tmp_root)
+            return len(entry['authors'])
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            links = sum(executor.map(link_entry, entries))
+
+        old_root = self.root + '.old'
+        if os.path.exists(self.root):
+            os.replace(self.root, old_root)
+        os.replace(tmp_root, self.root)
+        if os.path.exists(old_root):
+            shutil.rmtree(old_root)
+        return links
@@ -0,0 +1,178 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+HASH_CHUNK = 1024 * 1024
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Инкрементальная резервная копия с адресацией по содержимому:
+# файлы лежат в objects/<2 символа хэша>/<хэш>, каждая версия — манифест в snapshots/
+class BackupStore:
+    def __init__(self, source='photos', root='photos_backup', keep=30, workers=4):
+        self.source = source
+        self.root = root
+        self.objects_dir = os.path.join(root, 'objects')
+        self.snapshots_dir = os.path.join(root, 'snapshots')
+        self.keep = keep
+        self.workers = workers
+        self.dirty = True  # Есть изменения, не попавшие в резервную копию
+        self._lock = threading.Lock()
+
+    def mark_dirty(self):
+        self.dirty = True
+
+    def _object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def list_snapshots(self):
+        if not os.path.isdir(self.snapshots_dir):
+            return []
+        return sorted(name[:-len('.json')] for name in os.listdir(self.snapshots_dir) if name.endswith('.json'))
+
+    def load_manifest(self, snapshot=None):
+        snapshots = self.list_snapshots()
+        if snapshot is None:
+            if not snapshots:
+                return None
+            snapshot = snapshots[-1]
+        with open(os.path.join(self.snapshots_dir, snapshot + '.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    # Временные файлы незаконченных загрузок пропускаем: их переименуют или удалят
+    def _scan_source(self):
+        files = {}
+        for dirpath, _, filenames in os.walk(self.source):
+            for filename in filenames:
+                if filename.endswith('.tmp'):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue  # Файл удалили во время обхода
+                rel_path = os.path.relpath(path, self.source).replace(os.sep, '/')
+                files[rel_path] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+        return files
+
+    def _store_object(self, path, digest):
+        object_path = self._object_path(digest)
+        if os.path.exists(object_path):
+            return False
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        tmp_path = f'{object_path}.{threading.get_ident()}.tmp'
+        shutil.copy2(path, tmp_path)
+        os.replace(tmp_path, object_path)
+        return True
+
+    def run(self):
+        # Возвращает (имя снапшота или None, число скопированных файлов).
+        # dirty сбрасывается в начале, чтобы изменения во время копирования попали в следующий проход,
+        # и возвращается, если проход не удался
+        with self._lock:
+            self.dirty = False
+            try:
+                return self._run()
+            except BaseException:
+                self.dirty = True
+                raise
+
+    def _run(self):
+        previous = self.load_manifest()
+        previous_files = previous['files'] if previous else {}
+        files = self._scan_source()
+
+        # Хэшируем только новые и изменившиеся (по размеру и mtime) файлы
+        changed = []
+        for rel_path, info in files.items():
+            old = previous_files.get(rel_path)
+            if old and old['size'] == info['size'] and old['mtime'] == info['mtime'] \
+                    and os.path.exists(self._object_path(old['hash'])):
+                info['hash'] = old['hash']
+            else:
+                changed.append(rel_path)
+
+        def backup_file(rel_path):
+            path = os.path.join(self.source, rel_path)
+            try:
+                digest = file_hash(path)
+                return rel_path, digest, self._store_object(path, digest)
+            except FileNotFoundError:
+                return rel_path, None, False  # Удалён после обхода
+
+        copied = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for rel_path, digest, stored in executor.map(backup_file, changed):
+                if digest is None:
+                    del files[rel_path]
+                    continue
+                files[rel_path]['hash'] = digest
+                copied += stored
+
+        if previous is not None and files == previous_files:
+            return None, 0
+        os.makedirs(self.snapshots_dir, exist_ok=True)
+        name = time.strftime('%Y%m%d-%H%M%S')
+        while os.path.exists(os.path.join(self.snapshots_dir, name + '.json')):
+            name += '_'
+        manifest = {'created': time.time(), 'files': files}
+        tmp_path = os.path.join(self.snapshots_dir, name + '.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, os.path.join(self.snapshots_dir, name + '.json'))
+        self._prune()
+        return name, copied
+
+    def _prune(self):
+        expired = self.list_snapshots()[:-self.keep] if self.keep else []
+        if not expired:
+            return
+        for name in expired:
+            os.remove(os.path.join(self.snapshots_dir, name + '.json'))
+        # Удаляем объекты, на которые не ссылается ни один оставшийся снапшот
+        referenced = set()
+        for name in self.list_snapshots():
+            referenced.update(info['hash'] for info in self.load_manifest(name)['files'].values())
+        for dirpath, _, filenames in os.walk(self.objects_dir):
+            for filename in filenames:
+                if filename not in referenced:
+                    os.remove(os.path.join(dirpath, filename))
+
+    def verify(self, snapshot=None):
+        # Возвращает список проблем: (путь, описание)
+        manifest = self.load_manifest(snapshot)
+        if manifest is None:
+            return [('', "нет ни одного снапшота")]
+
+        def check(item):
+            rel_path, info = item
+            object_path = self._object_path(info['hash'])
+            if not os.path.exists(object_path):
+                return rel_path, "объект отсутствует"
+            if file_hash(object_path) != info['hash']:
+                return rel_path, "контрольная сумма не совпадает"
+            return None
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return [problem for problem in executor.map(check, manifest['files'].items()) if problem]
+
+    def restore(self, target, snapshot=None):
+        manifest = self.load_manifest(snapshot)
+        if manifest is None:
+            raise ValueError("нет ни одного снапшота")
+        for rel_path, info in manifest['files'].items():
+            path = os.path.join(target, rel_path)
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            shutil.copy2(self._object_path(info['hash']), path)
+        return len(manifest['files'])
@@ -0,0 +1,53 @@
+import argparse
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from .suite import STORAGES, compare, run_size
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description="Замеры PhotoDatabase на синтетическом каталоге")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000], help="Размеры каталога (10000 100000 1000000)")
+    parser.add_argument('--storage', choices=STORAGES, default='json')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', default=BASELINE, help="Файл с базовыми замерами этой машины (в репозиторий не входит)")
+    parser.add_argument('--save-baseline', action='store_true', help="Записать результаты как новую базу")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Допустимый рост времени, доля")
+    args = parser.parse_args()
+
+    results = {}
+    # Каждый размер — в новом процессе: пиковый RSS не наследуется от предыдущего замера
+    context = multiprocessing.get_context('spawn')
+    for size in args.sizes:
+        key = f"{args.storage}/{size}"
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            results[key] = pool.submit(run_size, size, args.storage, args.seed).result()
+        print(f"\n{key}")
+        for metric, value in results[key].items():
+            print(f"  {metric:<24} {value:12.3f}")
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+    if args.save_baseline:
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=4, sort_keys=True)
+        print(f"\n✅ Базовые замеры сохранены в {args.baseline}")
+        return
+
+    regressions = compare(results, baseline, args.tolerance)
+    for key, metric, previous, value in regressions:
+        print(f"❌ {key} {metric}: {previous:.3f} -> {value:.3f}")
+    if regressions:
+        parser.exit(1)
+    print("\n✅ Регрессий относительно базы нет." if baseline else "\nБазовых замеров нет (--save-baseline).")
+
+
+if __name__ == '__main__':
+    main()
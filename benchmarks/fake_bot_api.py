@@ -0,0 +1,106 @@
+import json
+import re
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'PICASo', 'username': 'picaso_load_bot'}
+# Методы, которые отвечают сообщением; answerCallbackQuery и прочие служебные возвращают True
+MESSAGE_METHODS = {'sendMessage', 'sendPhoto', 'sendMediaGroup', 'editMessageMedia', 'editMessageText',
+                   'editMessageReplyMarkup'}
+PHOTO_METHODS = {'sendPhoto', 'sendMediaGroup', 'editMessageMedia'}
+CAPTION_ID_PATTERN = re.compile(r'ID:</b> (\d+)')
+
+
+# Параметры запроса: обычная форма или multipart (при загрузке файлов); сами файлы пропускаются
+def _fields(content_type, body):
+    if not content_type.startswith('multipart/'):
+        return {key: values[0] for key, values in parse_qs(body.decode('utf-8')).items()}
+    message = BytesParser(policy=HTTP).parsebytes(f'Content-Type: {content_type}\r\n\r\n'.encode('utf-8') + body)
+    return {part.get_param('name', header='content-disposition'): part.get_content()
+            for part in message.iter_parts() if part.get_filename() is None}
+
+
+# Заглушка Bot API: отвечает правдоподобными объектами с задержкой latency и запоминает,
+# что и когда отправлено в каждый чат. flood_every > 0 — каждый такой запрос с сообщением
+# получает 429 «Too Many Requests» с retry_after, как при превышении лимитов Telegram
+class FakeBotAPI:
+    def __init__(self, latency=0.0, flood_every=0, retry_after=1):
+        self.latency = latency
+        self.flood_every = flood_every
+        self.retry_after = retry_after
+        self.calls = {}  # chat_id -> [(метод, время)]
+        self.photos = {}  # chat_id -> [ID записей из подписей отправленных фото]
+        self.sends = []  # (время, chat_id, число фото) успешных отправок фото
+        self.replies = 0
+        self.floods = 0
+        self._requests = 0
+        self._lock = threading.Lock()
+        self._message_id = 0
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                status, response = api.handle(self.path.rsplit('/', 1)[-1], self.headers.get('Content-Type', ''), body)
+                time.sleep(api.latency)
+                data = json.dumps(response).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self._server.server_address[1]}'
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def handle(self, method, content_type, body):
+        fields = _fields(content_type, body)
+        chat_id = int(json.loads(fields['chat_id'])) if 'chat_id' in fields else None
+        if method == 'getMe':
+            return 200, {'ok': True, 'result': BOT_USER}
+        if method not in MESSAGE_METHODS:
+            return 200, {'ok': True, 'result': True}
+        if method == 'sendMediaGroup':
+            captions = [item.get('caption', '') for item in json.loads(fields['media'])]
+        else:
+            captions = [fields.get('caption', '')]
+        with self._lock:
+            self._requests += 1
+            if self.flood_every and self._requests % self.flood_every == 0:
+                self.floods += 1
+                return 429, {'ok': False, 'error_code': 429,
+                             'description': f'Too Many Requests: retry after {self.retry_after}',
+                             'parameters': {'retry_after': self.retry_after}}
+            now = time.perf_counter()
+            self.calls.setdefault(chat_id, []).append((method, now))
+            self.replies += 1
+            if method in PHOTO_METHODS:
+                self.sends.append((now, chat_id, len(captions)))
+                self.photos.setdefault(chat_id, []).extend(
+                    int(match.group(1)) for match in map(CAPTION_ID_PATTERN.search, captions) if match)
+            first_id = self._message_id + 1
+            self._message_id += len(captions)
+        messages = []
+        for message_id in range(first_id, first_id + len(captions)):
+            message = {'message_id': message_id, 'date': int(time.time()), 'from': BOT_USER,
+                       'chat': {'id': chat_id, 'type': 'private'}}
+            if method in PHOTO_METHODS:
+                message['photo'] = [{'file_id': f'photo{message_id}', 'file_unique_id': f'u{message_id}',
+                                     'width': 1280, 'height': 853}]
+            messages.append(message)
+        return 200, {'ok': True, 'result': messages if method == 'sendMediaGroup' else messages[0]}
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
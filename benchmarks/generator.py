@@ -0,0 +1,50 @@
+import bisect
+import itertools
+import random
+
+SYLLABLES = ('ka', 'ri', 'mo', 'na', 'shi', 'to', 'yu', 'ze', 'ha', 'ru', 'mi', 'ko', 'sa', 'ne', 'lo', 'vi')
+
+
+# Частоты по закону Ципфа: значение ранга k встречается пропорционально 1 / k^s
+class Zipf:
+    def __init__(self, values, s=1.1):
+        self.values = values
+        self.cum_weights = list(itertools.accumulate(1.0 / (rank ** s) for rank in range(1, len(values) + 1)))
+
+    def sample(self, rng, k):
+        # k различных значений; популярные выпадают чаще
+        total = self.cum_weights[-1]
+        chosen = {}
+        for _ in range(k * 4):
+            if len(chosen) == k:
+                break
+            value = self.values[bisect.bisect(self.cum_weights, rng.random() * total)]
+            chosen[value] = None
+        return list(chosen)
+
+
+def _names(rng, prefix, count):
+    # Уникальные «живые» имена: 2–3 слога и номер, чтобы имена не совпадали
+    return [f"{prefix}{''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))).capitalize()}{i}"
+            for i in range(count)]
+
+
+# Детерминированный синтетический каталог: один и тот же seed даёт одни и те же записи
+def generate_catalog(size, seed=0):
+    rng = random.Random(seed)
+    authors = Zipf(_names(rng, '', max(100, size // 20)))
+    tags = Zipf(_names(rng, 'tag_', max(200, min(size // 10, 5000))))
+    characters = Zipf(_names(rng, 'char_', max(100, size // 10)))
+    entries = []
+    for entry_id in range(1, size + 1):
+        entries.append({
+            'id': entry_id,
+            'file_path': f"photos/{entry_id:08d}.jpg",
+            'authors': sorted(authors.sample(rng, rng.choice((1, 1, 1, 2))), key=lambda x: x.lower()),
+            'tags': sorted(tags.sample(rng, rng.randint(3, 8)), key=lambda x: x.lower()),
+            'characters': sorted(characters.sample(rng, rng.randint(0, 3)), key=lambda x: x.lower()),
+            'file_id': None,
+            'phash': f'{rng.getrandbits(64):016x}',
+            'added_at': f'2024-01-01T00:00:{entry_id % 60:02d}',
+        })
+    return entries, {'authors': authors, 'tags': tags, 'characters': characters}
@@ -0,0 +1,111 @@
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from .generator import generate_catalog
+from .suite import REPO_ROOT
+
+
+# Каталог без самих файлов: inline-ответ использует только file_id, он есть у доли file_id_share записей
+def _write_catalog(size, file_id_share, seed):
+    entries, pools = generate_catalog(size, seed)
+    rng = random.Random(seed + 2)
+    for entry in entries:
+        if rng.random() < file_id_share:
+            entry['file_id'] = f"AgACAgIAAxkBAAI{entry['id']:012d}"
+    with open('photos.json', 'w') as f:
+        json.dump(entries, f)
+    return pools
+
+
+# Набор запроса по буквам, как в поле ввода: каждое нажатие — отдельный inline-запрос.
+# Поле вводится целиком, значение — по символу
+def _keystrokes(query):
+    field, _, value = query.rpartition(':')
+    prefix = field + ':' if field else ''
+    return [prefix + value[:i] for i in range(1, len(value) + 1)]
+
+
+def _queries(pools, rng, sessions):
+    templates = (
+        lambda: f"tag:{pools['tags'].sample(rng, 1)[0]}",
+        lambda: f"a:{pools['authors'].sample(rng, 1)[0]}",
+        lambda: f"char:{pools['characters'].sample(rng, 1)[0]}",
+        lambda: pools['tags'].sample(rng, 1)[0][4:],  # Слово без поля ищется во всех полях
+        lambda: f"tag:{pools['tags'].sample(rng, 1)[0]} -tag:{pools['tags'].sample(rng, 1)[0]}",
+    )
+    return [rng.choice(templates)() for _ in range(sessions)]
+
+
+def _quantile(values, q):
+    return values[min(len(values) - 1, int(q * len(values)))] * 1000 if values else 0.0
+
+
+# Время построения ответа (запрос, кэш, страница, объекты результатов) на потоке нажатий
+def run_inline(size, sessions, pages, file_id_share, seed):
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        pools = _write_catalog(size, file_id_share, seed)
+        import main
+        rng = random.Random(seed + 3)
+        timings = []
+        results = 0
+        try:
+            for query in _queries(pools, rng, sessions):
+                for text in _keystrokes(query) + [query] * pages:
+                    offset = 0 if text != query else rng.randrange(pages) * main.INLINE_PAGE_SIZE
+                    started = time.perf_counter()
+                    answer, _, _ = main.build_inline_answer(text, offset)
+                    timings.append(time.perf_counter() - started)
+                    results += len(answer)
+        finally:
+            main.io_executor.shutdown()
+            main.variant_cache.close()
+            main.db.close()
+        timings.sort()
+        hits = main.metrics.counter('inline_cache_total', result='hit')
+        misses = main.metrics.counter('inline_cache_total', result='miss')
+        return {
+            'answers': len(timings),
+            'results_per_answer': results / max(len(timings), 1),
+            'cache_hit_rate': hits / max(hits + misses, 1),
+            'p50_ms': _quantile(timings, 0.5),
+            'p95_ms': _quantile(timings, 0.95),
+            'p99_ms': _quantile(timings, 0.99),
+            'max_ms': timings[-1] * 1000 if timings else 0.0,
+        }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.inline_load',
+                                     description="Время построения inline-ответов на синтетическом каталоге")
+    parser.add_argument('--size', type=int, default=100000, help="Размер каталога")
+    parser.add_argument('--sessions', type=int, default=300, help="Сколько запросов набрать по буквам")
+    parser.add_argument('--pages', type=int, default=3, help="Сколько раз пролистать результат каждого запроса")
+    parser.add_argument('--file-id-share', type=float, default=0.8, help="Доля записей с file_id")
+    parser.add_argument('--target', type=float, default=50, help="Допустимый p99, мс")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        result = pool.submit(run_inline, args.size, args.sessions, args.pages, args.file_id_share,
+                             args.seed).result()
+    for metric, value in result.items():
+        print(f"  {metric:<20} {value:12.3f}" if isinstance(value, float) else f"  {metric:<20} {value:12d}")
+    if result['p99_ms'] > args.target:
+        print(f"\n❌ p99 {result['p99_ms']:.1f} мс больше {args.target:.0f} мс.")
+        parser.exit(1)
+    print(f"\n✅ p99 построения ответа не больше {args.target:.0f} мс.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from .fake_bot_api import FakeBotAPI
+from .suite import REPO_ROOT
+from .webhook_load import TOKEN, write_catalog
+
+
+async def _wait(condition, timeout):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        await asyncio.sleep(0.05)
+    return True
+
+
+# Наибольшее число фото, отправленных за любую секунду
+def _peak_rate(sends):
+    times = sorted((moment, count) for moment, _, count in sends)
+    peak = total = start = 0
+    for moment, count in times:
+        total += count
+        while times[start][0] <= moment - 1.0:
+            total -= times[start][1]
+            start += 1
+        peak = max(peak, total)
+    return peak
+
+
+# Наименьший промежуток между отправками в один чат, секунд
+def _min_chat_gap(sends):
+    last = {}
+    gap = float('inf')
+    for moment, chat_id, _ in sorted(sends):
+        if chat_id in last:
+            gap = min(gap, moment - last[chat_id])
+        last[chat_id] = moment
+    return gap
+
+
+# Рассылка подписчикам одного автора в два этапа: первая пачка фото, остановка посреди рассылки,
+# ещё фото, пока бот «лежит», и новый Notifier на том же файле очереди
+def run_notify(subscribers, photos, rate, chat_interval, latency, flood_every, timeout, seed):
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        authors = write_catalog(200, seed)
+        import main
+        from subscriptions import Notifier, SubscriptionStore
+        from telegram import Bot
+        from telegram.request import HTTPXRequest
+
+        main.open_subscriptions()
+        author = authors[0]
+        for chat_id in range(1, subscribers + 1):
+            main.subscriptions.subscribe(chat_id, author)
+        api = FakeBotAPI(latency, flood_every)
+        first, second = photos - photos // 3, photos // 3
+        options = dict(batch_delay=0.5, global_rate=rate, chat_interval=chat_interval, workers=main.NOTIFY_WORKERS)
+
+        def add(count):
+            before = main.subscriptions.pending_count()
+            entries = main.db.add_entries([{'file_path': f'photos/{i % 200 + 1:08d}.jpg', 'authors': [author],
+                                            'tags': ['new'], 'characters': []} for i in range(count)])
+            return entries, before + subscribers * count
+
+        async def run():
+            bot = Bot(TOKEN, base_url=f'{api.url}/bot', request=HTTPXRequest(connection_pool_size=64))
+            async with bot:
+                main.catalog_writer.start()
+                notifier = Notifier(main.subscriptions, main.deliver_notification, main.io_executor, **options)
+                started = time.perf_counter()
+                entries, queued = add(first)
+                await _wait(lambda: main.subscriptions.pending_count() >= queued, timeout)
+                notifier.start(bot)
+                await _wait(lambda: sum(map(len, api.photos.values())) >= subscribers * first // 2, timeout)
+                await notifier.stop()
+                delivered_before_restart = sum(map(len, api.photos.values()))
+
+                # Пока рассылка остановлена, в каталог добавляются ещё фото; затем — новый Notifier
+                more, queued = add(second)
+                entries += more
+                await _wait(lambda: main.subscriptions.pending_count() >= queued - delivered_before_restart, timeout)
+                await asyncio.sleep(chat_interval)  # Перезапуск не мгновенный: лимит чата не нарушается
+                store = SubscriptionStore(main.SUBSCRIPTIONS_PATH)
+                notifier = Notifier(store, main.deliver_notification, main.io_executor, **options)
+                notifier.start(bot)
+                finished = await _wait(lambda: store.pending_count() == 0, timeout)
+                elapsed = time.perf_counter() - started
+                await notifier.stop()
+                await main.catalog_writer.stop()
+                store.close()
+            return entries, delivered_before_restart, finished, elapsed
+
+        try:
+            entries, delivered_before_restart, finished, elapsed = asyncio.run(run())
+        finally:
+            api.close()
+            main.io_executor.shutdown()
+            main.variant_cache.close()
+            main.db.close()
+
+        expected = {entry['id'] for entry in entries}
+        duplicates = missing = 0
+        for chat_id in range(1, subscribers + 1):
+            received = api.photos.get(chat_id, [])
+            duplicates += len(received) - len(set(received))
+            missing += len(expected - set(received))
+        photos_sent = sum(count for _, _, count in api.sends)
+        return {
+            'finished': int(finished),
+            'seconds': elapsed,
+            'photos_sent': photos_sent,
+            'messages_sent': len(api.sends),
+            'photos_per_message': photos_sent / max(len(api.sends), 1),
+            'sent_before_restart': delivered_before_restart,
+            'flood_responses': api.floods,
+            'peak_photos_per_s': float(_peak_rate(api.sends)),
+            'min_chat_gap_s': _min_chat_gap(api.sends),
+            'duplicates': duplicates,
+            'missing': missing,
+        }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.notify_load',
+                                     description="Нагрузочный тест рассылки уведомлений с заглушкой Bot API")
+    parser.add_argument('--subscribers', type=int, default=100, help="Подписчиков у автора")
+    parser.add_argument('--photos', type=int, default=12, help="Сколько новых фото добавить (в два этапа)")
+    parser.add_argument('--rate', type=float, default=50, help="Глобальный лимит, фото в секунду")
+    parser.add_argument('--chat-interval', type=float, default=1.0, help="Секунд между альбомами в один чат")
+    parser.add_argument('--latency', type=float, default=0.05, help="Задержка ответа Bot API, секунд")
+    parser.add_argument('--flood-every', type=int, default=25, help="Каждый N-й запрос получает 429 (0 — никогда)")
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        result = pool.submit(run_notify, args.subscribers, args.photos, args.rate, args.chat_interval,
+                             args.latency, args.flood_every, args.timeout, args.seed).result()
+    for metric, value in result.items():
+        print(f"  {metric:<20} {value:12.3f}" if isinstance(value, float) else f"  {metric:<20} {value:12d}")
+
+    # Корзина допускает всплеск в один альбом сверх среднего темпа
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    from subscriptions import MEDIA_GROUP_SIZE
+    problems = []
+    if not result['finished'] or result['missing']:
+        problems.append(f"не доставлено фото: {result['missing']}")
+    if result['duplicates']:
+        problems.append(f"повторных фото: {result['duplicates']}")
+    if result['peak_photos_per_s'] > args.rate + MEDIA_GROUP_SIZE:
+        problems.append(f"превышен глобальный лимит: {result['peak_photos_per_s']:.0f} фото/с")
+    if result['min_chat_gap_s'] < args.chat_interval * 0.9:
+        problems.append(f"в один чат чаще лимита: {result['min_chat_gap_s']:.2f} с")
+    for problem in problems:
+        print(f"❌ {problem}")
+    if problems:
+        parser.exit(1)
+    print("\n✅ Каждый подписчик получил каждое фото ровно один раз, лимиты соблюдены.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+import gc
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from .generator import generate_catalog
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STORAGES = ('json', 'journal', 'sqlite')
+ADDS = 200  # Сколько записей добавить при замере add_entry
+UPDATES = 200
+QUERIES = 200  # Сколько поисковых запросов каждого вида
+PAGES = 50  # Сколько записей пролистать курсором
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS — байты
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def _timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return (time.perf_counter() - started) * 1000, result
+
+
+# Лучшее из нескольких повторений: одиночные быстрые замеры сильно шумят
+def _best(func, repeat=5):
+    best = None
+    for _ in range(repeat):
+        elapsed, result = _timed(func)
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def _per_op(func, items):
+    # Среднее время одной операции, мс
+    started = time.perf_counter()
+    for item in items:
+        func(item)
+    return (time.perf_counter() - started) * 1000 / max(len(items), 1)
+
+
+def _open_db(storage, workdir):
+    from main import PhotoDatabase
+    from journal import JournalStore
+    from sqlite_db import SQLitePhotoDatabase
+    if storage == 'sqlite':
+        return SQLitePhotoDatabase(os.path.join(workdir, 'photos.db'))
+    if storage == 'journal':
+        return PhotoDatabase(os.path.join(workdir, 'photos.json'),
+                             journal=JournalStore(os.path.join(workdir, 'photos'), fsync='never'))
+    return PhotoDatabase(os.path.join(workdir, 'photos.json'))
+
+
+# Память каталога в куче Python на одну запись: сами записи, индексы и строки словаря значений.
+# Должно быть первой загрузкой каталога в процессе, иначе строки уже лежат в словаре и не попадут в замер.
+# Отдельное открытие базы: под tracemalloc загрузка в разы медленнее
+def _bytes_per_entry(storage, workdir, size):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        db = _open_db(storage, workdir)
+        gc.collect()
+        used = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    db.close()
+    return used / max(size, 1)
+
+
+# Замеры одного размера каталога; выполняется в отдельном процессе, чтобы пиковый RSS был честным
+def run_size(size, storage='json', seed=0):
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        # main при импорте открывает свою базу в текущей папке: пока папка пуста, эта база пустая
+        # и не попадает ни в пиковый RSS, ни во время загрузки
+        os.chdir(workdir)
+        import main
+        from journal import JournalStore
+        results['generate_ms'], (entries, pools) = _timed(generate_catalog, size, seed)
+        with open(os.path.join(workdir, 'photos.json'), 'w') as f:
+            json.dump(entries, f)
+        if storage == 'journal':
+            # Снапшот пишется из словарей напрямую, без загрузки каталога в этом процессе
+            JournalStore(os.path.join(workdir, 'photos')).import_entries(entries)
+        del entries
+        if storage == 'sqlite':
+            from sqlite_db import migrate_from_json
+            migrate_from_json(os.path.join(workdir, 'photos.json'), os.path.join(workdir, 'photos.db'))
+        if storage != 'sqlite':
+            results['bytes_per_entry'] = _bytes_per_entry(storage, workdir, size)
+
+        results['load_data_ms'], db = _timed(_open_db, storage, workdir)
+        results['save_data_ms'], _ = _timed(db.save_data, os.path.join(workdir, 'export.json'))
+
+        rng = random.Random(seed + 1)
+        queries = {field: [pool.values[0]] + pool.sample(rng, QUERIES - 1) for field, pool in pools.items()}
+
+        results['search_by_author_ms'] = _per_op(db.search_by_author, queries['authors'])
+        results['search_by_tag_ms'] = _per_op(db.search_by_tag, queries['tags'])
+        results['search_by_character_ms'] = _per_op(db.search_by_character, queries['characters'])
+        results['get_all_authors_ms'], _ = _best(db.get_all_authors)
+        results['sample_authors_ms'] = _per_op(lambda _: db.sample_authors(3), range(QUERIES))
+
+        # Пагинация: курсор по самому популярному тегу и по всему каталогу
+        from cursors import Cursor
+        results['cursor_open_ms'], cursor = _best(
+            lambda: Cursor('tag', queries['tags'][0], db.find_ids('tag', queries['tags'][0])))
+        results['cursor_page_ms'] = _per_op(lambda i: cursor.entry(db, i), range(min(PAGES, cursor.total(db))))
+        catalog = Cursor('all')
+        results['catalog_page_ms'] = _per_op(lambda i: catalog.entry(db, i),
+                                             [rng.randrange(catalog.total(db)) for _ in range(PAGES)])
+
+        # Запись: изменения копятся в памяти, как при работе бота с CatalogWriter
+        db.autosave = False
+        results['add_entry_ms'] = _per_op(
+            lambda i: db.add_entry(f"photos/new{i}.jpg", pools['authors'].sample(rng, 1),
+                                   pools['tags'].sample(rng, 4), pools['characters'].sample(rng, 1)),
+            range(ADDS))
+        ids = [rng.randint(1, size) for _ in range(UPDATES)]
+        results['update_entry_ms'] = _per_op(
+            lambda entry_id: db.update_entry(entry_id, new_tags=pools['tags'].sample(rng, 1)), ids)
+        results['flush_ms'], _ = _timed(db.flush)
+        db.close()
+        os.chdir(REPO_ROOT)
+    results['peak_rss_mb'] = _peak_rss_mb()
+    return results
+
+
+# Сравнение с базовыми замерами: [(ключ, метрика, было, стало)] для метрик, выросших больше допуска
+def compare(results, baseline, tolerance=0.25):
+    regressions = []
+    for key, metrics in results.items():
+        for metric, value in metrics.items():
+            previous = baseline.get(key, {}).get(metric)
+            if previous is None or metric == 'generate_ms':
+                continue
+            # Доли миллисекунды шумят сильнее, чем сами операции
+            if value > previous * (1 + tolerance) and value - previous > 0.05:
+                regressions.append((key, metric, previous, value))
+    return regressions
@@ -0,0 +1,189 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from .fake_bot_api import BOT_USER, FakeBotAPI
+from .generator import generate_catalog
+from .suite import REPO_ROOT
+
+TOKEN = '123456:LOADTEST'
+SECRET = 'loadtest'
+
+
+# Сценарий пользователя: что он присылает и каким методом бот должен ответить.
+# Третий и четвёртый шаги работают, только если предыдущие обработаны раньше них
+def scenario(author):
+    return [
+        ('message', '/start', 'sendMessage'),
+        ('message', '/search_author', 'sendMessage'),
+        ('message', author, 'sendPhoto'),
+        ('callback', 'authornext_0', 'editMessageMedia'),
+        ('message', '/help', 'sendMessage'),
+    ]
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _user(user_id):
+    return {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'}
+
+
+def _update(update_id, user_id, kind, text):
+    chat = {'id': user_id, 'type': 'private'}
+    if kind == 'callback':
+        return {'update_id': update_id, 'callback_query': {
+            'id': str(update_id), 'from': _user(user_id), 'chat_instance': str(user_id), 'data': text,
+            'message': {'message_id': update_id, 'date': int(time.time()), 'chat': chat, 'from': BOT_USER},
+        }}
+    message = {'message_id': update_id, 'date': int(time.time()), 'chat': chat, 'from': _user(user_id), 'text': text}
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+    return {'update_id': update_id, 'message': message}
+
+
+def write_catalog(size, seed):
+    from PIL import Image
+    entries, pools = generate_catalog(size, seed)
+    with open('photos.json', 'w') as f:
+        json.dump(entries, f)
+    # Одна и та же картинка под всеми именами: уменьшенная копия строится один раз
+    os.makedirs('photos', exist_ok=True)
+    Image.new('RGB', (1600, 1200), (120, 90, 60)).save('photo.jpg', quality=90)
+    with open('photo.jpg', 'rb') as f:
+        data = f.read()
+    for entry in entries:
+        with open(entry['file_path'], 'wb') as f:
+            f.write(data)
+    return pools['authors'].values
+
+
+# Отправка сценариев всех пользователей на вебхук; сообщения одного пользователя — подряд,
+# пользователи — одновременно (не больше connections соединений, как у Telegram)
+async def _replay(webhook_url, api, users, authors, connections, timeout):
+    import httpx
+    sent = {}  # (chat_id, шаг) -> время отправки
+    expected = {}
+    update_ids = iter(range(1, 10 ** 9))
+    limit = asyncio.Semaphore(connections)
+    headers = {'X-Telegram-Bot-Api-Secret-Token': SECRET}
+    async with httpx.AsyncClient(timeout=timeout, limits=httpx.Limits(max_connections=connections)) as client:
+        async def run_user(user_id):
+            steps = scenario(authors[user_id % min(len(authors), 20)])
+            expected[user_id] = [method for _, _, method in steps]
+            for step, (kind, text, _) in enumerate(steps):
+                async with limit:
+                    sent[(user_id, step)] = time.perf_counter()
+                    response = await client.post(webhook_url, json=_update(next(update_ids), user_id, kind, text),
+                                                 headers=headers)
+                    response.raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(run_user(user_id) for user_id in range(1, users + 1)))
+    total = sum(len(methods) for methods in expected.values())
+    deadline = started + timeout
+    while api.replies < total and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+
+    latencies = []
+    out_of_order = 0
+    for user_id, methods in expected.items():
+        calls = api.calls.get(user_id, [])
+        if [method for method, _ in calls] != methods:
+            out_of_order += 1
+        for step, (_, replied) in enumerate(calls[:len(methods)]):
+            latencies.append(replied - sent[(user_id, step)])
+    latencies.sort()
+
+    def quantile(q):
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000 if latencies else 0.0
+    return {
+        'updates': total,
+        'answered': api.replies,
+        'seconds': elapsed,
+        'updates_per_s': api.replies / elapsed,
+        'p50_ms': quantile(0.5),
+        'p95_ms': quantile(0.95),
+        'max_ms': latencies[-1] * 1000 if latencies else 0.0,
+        'broken_users': out_of_order,
+    }
+
+
+# Один прогон в отдельном процессе: main создаёт базу из текущей папки при импорте
+def run_load(concurrency, users, size, latency, connections, seed, timeout):
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        authors = write_catalog(size, seed)
+        import main
+        main.METRICS_PORT = None
+        main.CONCURRENT_UPDATES = concurrency
+        api = FakeBotAPI(latency)
+        port = _free_port()
+        webhook_url = f'http://127.0.0.1:{port}/{main.WEBHOOK_PATH}'
+
+        async def run():
+            application = main.build_application(TOKEN, base_url=f'{api.url}/bot')
+            async with application:
+                await main.post_init(application)
+                await application.updater.start_webhook(listen='127.0.0.1', port=port, url_path=main.WEBHOOK_PATH,
+                                                        webhook_url=webhook_url, secret_token=SECRET)
+                await application.start()
+                try:
+                    return await _replay(webhook_url, api, users, authors, connections, timeout)
+                finally:
+                    await application.updater.stop()
+                    await application.stop()
+                    await main.post_shutdown(application)
+
+        try:
+            return asyncio.run(run())
+        finally:
+            api.close()
+            main.io_executor.shutdown()
+            main.db.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.webhook_load',
+                                     description="Нагрузочный тест вебхука с заглушкой Bot API")
+    parser.add_argument('--users', type=int, default=200, help="Сколько пользователей одновременно")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 64],
+                        help="Значения CONCURRENT_UPDATES для сравнения (1 — последовательная обработка)")
+    parser.add_argument('--size', type=int, default=2000, help="Размер каталога")
+    parser.add_argument('--latency', type=float, default=0.05, help="Задержка ответа Bot API, секунд")
+    parser.add_argument('--connections', type=int, default=40, help="Одновременных соединений с вебхуком")
+    parser.add_argument('--timeout', type=float, default=300, help="Сколько ждать всех ответов, секунд")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    broken = False
+    context = multiprocessing.get_context('spawn')
+    for concurrency in args.concurrency:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            result = pool.submit(run_load, concurrency, args.users, args.size, args.latency,
+                                 args.connections, args.seed, args.timeout).result()
+        print(f"\nCONCURRENT_UPDATES = {concurrency}")
+        for metric, value in result.items():
+            print(f"  {metric:<16} {value:12.3f}" if isinstance(value, float) else f"  {metric:<16} {value:12d}")
+        broken = broken or result['broken_users'] > 0 or result['answered'] < result['updates']
+    if broken:
+        print("\n❌ Часть пользователей получила ответы не по порядку или не получила их вовсе.")
+        parser.exit(1)
+    print("\n✅ Все пользователи получили ответы в порядке своих сообщений.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+import csv
+import hashlib
+import io
+import json
+import os
+import posixpath
+import shutil
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from phash import BKTree, dhash
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.gif', '.bmp')
+METADATA_CSV = 'metadata.csv'  # Общий файл метаданных папки: file,authors,tags,characters
+FIELDS = ('authors', 'tags', 'characters')
+PROGRESS_INTERVAL = 1.0  # Как часто печатать прогресс, секунд
+HASH_BATCH_SIZE = 32  # Файлов на одно задание пула процессов
+
+
+def _read(source, archives):
+    # source — (путь к файлу, None) или (путь к архиву, имя файла в архиве);
+    # archives — открытые в этой пачке ZIP-архивы
+    path, member = source
+    if member is None:
+        with open(path, 'rb') as f:
+            return f.read()
+    archive = archives.get(path)
+    if archive is None:
+        archive = archives[path] = zipfile.ZipFile(path)
+    return archive.read(member)
+
+
+# Хэши пачки файлов для пула процессов; архивы открываются на пачку и закрываются после неё
+def hash_batch(sources):
+    archives = {}
+    try:
+        return [hash_source(source, archives) for source in sources]
+    finally:
+        for archive in archives.values():
+            archive.close()
+
+
+# Хэши файла: (sha256, перцептивный хэш или None, размер)
+def hash_source(source, archives):
+    try:
+        data = _read(source, archives)
+    except (OSError, KeyError, zipfile.BadZipFile):
+        return None, None, 0
+    try:
+        phash = dhash(io.BytesIO(data))
+    except (OSError, ValueError):
+        phash = None  # Не изображение
+    return hashlib.sha256(data).hexdigest(), phash, len(data)
+
+
+# Значение поля метаданных: список или строка через запятую
+def _split(value):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = value.split(',')
+    return [item.strip() for item in value if item and item.strip()]
+
+
+def _parse_json(text):
+    data = json.loads(text)
+    return {field: _split(data.get(field)) for field in FIELDS}
+
+
+def _parse_csv(text):
+    # Файл метаданных одного изображения: заголовок authors,tags,characters и одна строка
+    for row in csv.DictReader(io.StringIO(text)):
+        return {field: _split(row.get(field)) for field in FIELDS}
+    return None
+
+
+def _parse_manifest(text):
+    return {row['file']: {field: _split(row.get(field)) for field in FIELDS}
+            for row in csv.DictReader(io.StringIO(text)) if row.get('file')}
+
+
+# Изображения и их метаданные из папки или ZIP-архива.
+# Метаданные файла photo.jpg ищутся в photo.jpg.json, photo.json, photo.jpg.csv, photo.csv,
+# затем в metadata.csv той же папки
+class ImportSource:
+    def __init__(self, path):
+        self.path = path
+        self.archive = zipfile.ZipFile(path) if zipfile.is_zipfile(path) else None
+        if self.archive is None and not os.path.isdir(path):
+            raise ValueError(f"{path} — не папка и не ZIP-архив")
+
+    def close(self):
+        if self.archive is not None:
+            self.archive.close()
+
+    def _names(self):
+        if self.archive is not None:
+            return [info.filename for info in self.archive.infolist() if not info.is_dir()]
+        names = []
+        for dirpath, _, filenames in os.walk(self.path):
+            for filename in filenames:
+                names.append(os.path.relpath(os.path.join(dirpath, filename), self.path).replace(os.sep, '/'))
+        return names
+
+    def _read_text(self, name):
+        if self.archive is not None:
+            return self.archive.read(name).decode('utf-8-sig')
+        with open(os.path.join(self.path, name), 'r', encoding='utf-8-sig') as f:
+            return f.read()
+
+    def source(self, name):
+        if self.archive is not None:
+            return self.path, name
+        return os.path.join(self.path, name), None
+
+    # [(имя, метаданные или None)] в порядке имён
+    def items(self):
+        names = sorted(self._names())
+        present = set(names)
+        manifests = {}
+        for name in names:
+            if posixpath.basename(name).lower() == METADATA_CSV:
+                manifests[posixpath.dirname(name)] = _parse_manifest(self._read_text(name))
+        items = []
+        for name in names:
+            stem, ext = posixpath.splitext(name)
+            if ext.lower() not in IMAGE_EXTENSIONS:
+                continue
+            metadata = None
+            for sidecar, parse in ((name + '.json', _parse_json), (stem + '.json', _parse_json),
+                                   (name + '.csv', _parse_csv), (stem + '.csv', _parse_csv)):
+                if sidecar in present:
+                    metadata = parse(self._read_text(sidecar))
+                    break
+            if metadata is None:
+                metadata = manifests.get(posixpath.dirname(name), {}).get(posixpath.basename(name))
+            items.append((name, metadata))
+        return items
+
+
+# Прогресс этапа с пропускной способностью; печатает не чаще раза в PROGRESS_INTERVAL
+class Progress:
+    def __init__(self, stage, total, report=print):
+        self.stage = stage
+        self.total = total
+        self.report = report
+        self.done = 0
+        self.bytes = 0
+        self.started = time.perf_counter()
+        self._printed = self.started
+
+    def update(self, count=1, size=0):
+        self.done += count
+        self.bytes += size
+        now = time.perf_counter()
+        if now - self._printed >= PROGRESS_INTERVAL or self.done == self.total:
+            self._printed = now
+            self.report(f"{self.stage}: {self.done}/{self.total}, {self.rate():.0f} файлов/с")
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def rate(self):
+        elapsed = self.elapsed()
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+
+def _copy(source, target, archives):
+    if os.path.exists(target):
+        return  # Файл с тем же содержимым уже есть
+    tmp_path = f'{target}.{threading.get_ident()}.tmp'
+    path, member = source
+    if member is None:
+        shutil.copyfile(path, tmp_path)
+    else:
+        with open(tmp_path, 'wb') as f:
+            f.write(_read(source, archives))
+    os.replace(tmp_path, target)
+
+
+# Массовый импорт: хэши в пуле процессов, копирование в пуле потоков, одна запись каталога на всё.
+# Файлы кладутся в photos/ под именем по SHA-256, поэтому одинаковые файлы не дублируются.
+# defaults — авторы/теги/персонажи, добавляемые ко всем файлам; max_distance — порог похожести,
+# похожие на уже имеющиеся изображения пропускаются при skip_similar
+def import_photos(db, path, photos_dir='photos', defaults=None, workers=None, copy_workers=8,
+                  max_distance=6, skip_similar=False, report=print):
+    started = time.perf_counter()
+    defaults = defaults or {}
+    source = ImportSource(path)
+    try:
+        items = source.items()
+        sources = [source.source(name) for name, _ in items]
+    finally:
+        source.close()
+    stats = {'found': len(items), 'imported': 0, 'duplicates': 0, 'similar': 0, 'unreadable': 0, 'bytes': 0}
+    if not items:
+        return dict(stats, seconds=time.perf_counter() - started)
+
+    progress = Progress("Хэширование", len(items), report)
+    batches = [sources[i:i + HASH_BATCH_SIZE] for i in range(0, len(sources), HASH_BATCH_SIZE)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        hashes = []
+        for results in pool.map(hash_batch, batches):
+            for result in results:
+                hashes.append(result)
+                progress.update(size=result[2])
+
+    known_paths = {entry['file_path'] for entry in db.get_entries()}
+    batch_hashes = BKTree()  # Похожие изображения внутри самой пачки
+    seen = {}  # SHA-256 -> индекс в new_items
+    new_items = []
+    copies = []
+    for (name, metadata), src, (digest, phash, size) in zip(items, sources, hashes):
+        if digest is None or phash is None:
+            stats['unreadable'] += 1
+            continue
+        ext = posixpath.splitext(name)[1].lower()
+        file_path = f"{photos_dir}/{digest[:32]}{ext}"
+        metadata = metadata or {}
+        if digest in seen or file_path in known_paths:
+            stats['duplicates'] += 1
+            if digest in seen:
+                # Метаданные копии дополняют уже найденный файл
+                item = new_items[seen[digest]]
+                for field in FIELDS:
+                    item[field] += [value for value in metadata.get(field, []) if value not in item[field]]
+            continue
+        if db.find_similar(phash, max_distance) or batch_hashes.search(phash, max_distance):
+            stats['similar'] += 1
+            if skip_similar:
+                continue
+        seen[digest] = len(new_items)
+        batch_hashes.add(phash, len(new_items))
+        new_items.append({field: defaults.get(field, []) + metadata.get(field, []) for field in FIELDS})
+        new_items[-1].update(file_path=file_path, phash=phash)
+        copies.append((src, file_path, size))
+
+    os.makedirs(photos_dir, exist_ok=True)
+    progress = Progress("Копирование", len(copies), report)
+    # Архивы открываются заранее, один раз на всё копирование, а не потоками наперегонки
+    archives = {path: zipfile.ZipFile(path) for path in {src[0] for src, _, _ in copies if src[1] is not None}}
+    try:
+        with ThreadPoolExecutor(max_workers=copy_workers) as pool:
+            futures = [pool.submit(_copy, src, file_path, archives) for src, file_path, _ in copies]
+            for future, (_, _, size) in zip(futures, copies):
+                future.result()
+                progress.update(size=size)
+    finally:
+        for archive in archives.values():
+            archive.close()
+
+    # Все записи — одной пачкой и одним сбросом каталога на диск
+    autosave = db.autosave
+    db.autosave = False
+    try:
+        db.add_entries(new_items)
+        db.flush()
+    finally:
+        db.autosave = autosave
+    stats['imported'] = len(new_items)
+    stats['bytes'] = sum(size for _, _, size in copies)
+    return dict(stats, seconds=time.perf_counter() - started)
@@ -0,0 +1,112 @@
+import time
+from array import array
+from collections import OrderedDict
+
+
+# Курсор просмотра: хранит только запрос и ID найденных записей (или ничего для
+# просмотра всего каталога), сами записи подгружаются из базы по мере пролистывания
+class Cursor:
+    __slots__ = ('kind', 'query', 'ids', 'index', 'messages', 'prefetch')
+
+    def __init__(self, kind, query=None, ids=None):
+        self.kind = kind
+        self.query = query
+        self.ids = array('q', ids) if ids is not None else None
+        self.index = 0
+        self.messages = None  # ID сообщений текущей страницы галереи
+        self.prefetch = None  # (страница, размер страницы, задача) — заранее подготовленная страница
+
+    def total(self, db):
+        return db.count() if self.ids is None else len(self.ids)
+
+    def entry(self, db, index):
+        if self.ids is None:
+            return db.entry_at(index)
+        return db.get_entry(self.ids[index])
+
+
+# LRU-хранилище курсоров с TTL: простаивающие курсоры вытесняются.
+# С store (SessionPersistence) курсоры пишутся на диск и после перезапуска подгружаются по первому нажатию
+class CursorStore:
+    def __init__(self, max_size=10000, ttl=1800, store=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.store = store
+        self._items = OrderedDict()  # ключ -> (время последнего обращения, курсор)
+
+    def __len__(self):
+        return len(self._items)
+
+    def _evict_expired(self, now):
+        while self._items:
+            key, (touched, _) = next(iter(self._items.items()))
+            if now - touched < self.ttl:
+                break
+            del self._items[key]
+
+    def put(self, key, cursor):
+        now = time.monotonic()
+        self._items[key] = (now, cursor)
+        self._items.move_to_end(key)
+        self._evict_expired(now)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+        if self.store is not None:
+            self.store.save_cursor(key, cursor)
+
+    # Сначала память; при промахе курсор подгружается из store, не блокируя цикл событий
+    async def get(self, key):
+        now = time.monotonic()
+        self._evict_expired(now)
+        item = self._items.get(key)
+        if item is None and self.store is not None:
+            cursor = await self.store.load_cursor(key, self.ttl)
+            now = time.monotonic()
+            item = self._items.get(key)  # Пока шло чтение, курсор могли создать заново
+            if item is None:
+                if cursor is not None:
+                    self._items[key] = (now, cursor)
+                    while len(self._items) > self.max_size:
+                        self._items.popitem(last=False)
+                return cursor
+        if item is None:
+            return None
+        self._items[key] = (now, item[1])
+        self._items.move_to_end(key)
+        if self.store is not None:
+            self.store.touch_cursor(key, item[1])
+        return item[1]
+
+    def pop(self, key):
+        item = self._items.pop(key, None)
+        if self.store is not None:
+            self.store.drop_cursor(key)
+        return item[1] if item else None
+
+
+# LRU результатов запросов с коротким TTL. В отличие от CursorStore, срок считается от записи,
+# а не от последнего обращения: частый запрос всё равно пересчитывается и видит новые записи
+class ResultCache:
+    def __init__(self, max_size=1000, ttl=30):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items = OrderedDict()  # ключ -> (время записи, значение)
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        item = self._items.get(key)
+        if item is None or time.monotonic() - item[0] >= self.ttl:
+            return None
+        self._items.move_to_end(key)
+        return item[1]
+
+    def put(self, key, value):
+        self._items[key] = (time.monotonic(), value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def clear(self):
+        self._items.clear()
@@ -0,0 +1,303 @@
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from backup import file_hash
+
+# Виды проблем
+MISSING = 'missing'  # Запись каталога без файла
+CORRUPTED = 'corrupted'  # Пустой файл или содержимое изменилось при тех же размере и mtime
+ORPHAN = 'orphan'  # Файл в photos без записи каталога старше grace секунд
+STALE_LINK = 'stale_link'  # Лишняя ссылка в photos_by_author или ссылка на другой файл
+MISSING_LINK = 'missing_link'  # Нет ссылки в папке автора
+NOT_BACKED_UP = 'not_backed_up'  # Файла нет в последнем снапшоте или он изменился после него
+BAD_OBJECT = 'bad_object'  # Объект резервной копии отсутствует или повреждён
+
+
+def _stat_key(stat):
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+# Проверка согласованности каталога с папками photos, photos_by_author и резервной копией.
+# Три дерева обходятся параллельно, файлы хэшируются в пуле потоков по мере обхода. Хэши хранятся
+# в cache_path вместе с размером и mtime: повторная проверка хэширует только изменившиеся файлы
+# (full=True — все, чтобы найти тихую порчу). Файл без записи моложе grace секунд может быть загрузкой
+# незавершённого /add работающего бота, поэтому лишним не считается
+class IntegrityChecker:
+    def __init__(self, db, author_view, backup_store, cache_path='fsck_cache.json', photos_dir='photos',
+                 orphans_dir='photos_orphans', workers=8, grace=24 * 60 * 60):
+        self.db = db
+        self.author_view = author_view
+        self.backup_store = backup_store
+        self.cache_path = cache_path
+        self.photos_dir = photos_dir
+        self.orphans_dir = orphans_dir
+        self.workers = workers
+        self.grace = grace
+        self.stats = {}
+        self._entries = {}  # путь файла -> запись
+        self._hashes = {}  # путь -> sha256 после проверки
+        self._links = {}  # ожидаемая ссылка в папке автора -> (файл, автор)
+        self._manifest = None
+        self._restored = []  # восстановленные файлы, их хэши в кэше устарели
+
+    def _load_cache(self):
+        if not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}  # Испорченный кэш — просто хэшируем всё заново
+
+    def _save_cache(self, cache):
+        tmp_path = self.cache_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False)
+        os.replace(tmp_path, self.cache_path)
+
+    def _rel_path(self, path):
+        return os.path.relpath(path, self.photos_dir).replace(os.sep, '/')
+
+    # Обход дерева: {путь: stat}; файлы, которым нужен хэш, сразу уходят в пул
+    def _walk(self, root, hash_pool, cache, full):
+        files = {}
+        futures = {}
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                if filename.endswith('.tmp'):
+                    continue  # Запись, которая ещё идёт
+                path = os.path.normpath(os.path.join(dirpath, filename))
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue  # Файл удалили во время обхода
+                files[path] = stat
+                cached = cache.get(path)
+                if full or cached is None or cached[:2] != _stat_key(stat):
+                    futures[path] = hash_pool.submit(file_hash, path)
+        return files, futures
+
+    def _walk_links(self):
+        # Ссылки не разыменовываем: битая символическая ссылка тоже должна попасть в отчёт
+        links = {}
+        if not os.path.isdir(self.author_view.root):
+            return links
+        for author in os.listdir(self.author_view.root):
+            folder = os.path.join(self.author_view.root, author)
+            if os.path.isdir(folder):
+                for name in os.listdir(folder):
+                    links[(author, name)] = os.path.join(folder, name)
+        return links
+
+    def check(self, full=False):
+        started = time.perf_counter()
+        cache = self._load_cache()
+        self._entries = {os.path.normpath(entry['file_path']): entry for entry in self.db.get_entries()}
+        self._manifest = self.backup_store.load_manifest()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as hash_pool, ThreadPoolExecutor(max_workers=3) as walkers:
+            photos = walkers.submit(self._walk, self.photos_dir, hash_pool, cache, full)
+            objects = walkers.submit(self._walk, self.backup_store.objects_dir, hash_pool, cache, full)
+            links = walkers.submit(self._walk_links)
+            photos, photo_futures = photos.result()
+            objects, object_futures = objects.result()
+            links = links.result()
+            hashed = {}
+            for path, future in {**photo_futures, **object_futures}.items():
+                try:
+                    hashed[path] = future.result()
+                except OSError:
+                    # Файл удалили или переименовали между обходом и хэшированием: считаем, что его нет
+                    photos.pop(path, None)
+                    objects.pop(path, None)
+
+        # Кэш только для существующих файлов: удалённые из него выпадают
+        self._hashes = {}
+        problems = []
+        new_cache = {}
+        for path, stat in {**photos, **objects}.items():
+            cached = cache.get(path)
+            digest = hashed.get(path) or cached[2]
+            if path in photos and cached is not None and cached[:2] == _stat_key(stat) and cached[2] != digest:
+                problems.append((CORRUPTED, path, "содержимое изменилось без изменения размера и mtime"))
+            self._hashes[path] = digest
+            new_cache[path] = _stat_key(stat) + [digest]
+
+        problems += self._check_photos(photos)
+        problems += self._check_links(links, photos)
+        problems += self._check_backup(photos, objects)
+        self._save_cache(new_cache)
+        self.stats = {'entries': len(self._entries), 'files': len(photos), 'links': len(links),
+                      'objects': len(objects), 'hashed': len(hashed), 'seconds': time.perf_counter() - started}
+        # Тихая порча находится и по кэшу, и по снапшоту — в отчёт попадает один раз
+        unique = {}
+        for kind, path, detail in problems:
+            unique.setdefault((kind, path), detail)
+        return [{'kind': kind, 'path': path, 'detail': detail} for (kind, path), detail in unique.items()]
+
+    def _check_photos(self, photos):
+        problems = []
+        for path, entry in self._entries.items():
+            stat = photos.get(path)
+            if stat is None and not path.startswith(os.path.normpath(self.photos_dir) + os.sep):
+                # Файл вне photos: обход его не видел
+                stat = os.stat(path) if os.path.exists(path) else None
+            if stat is None:
+                problems.append((MISSING, path, f"ID {entry['id']}"))
+            elif stat.st_size == 0:
+                problems.append((CORRUPTED, path, f"ID {entry['id']}: пустой файл"))
+        cutoff = time.time() - self.grace
+        for path, stat in photos.items():
+            if path not in self._entries and stat.st_mtime < cutoff:
+                problems.append((ORPHAN, path, "нет записи в каталоге"))
+        return problems
+
+    def _check_links(self, links, photos):
+        problems = []
+        expected = {}
+        self._links = {}
+        for path, entry in self._entries.items():
+            for author in entry['authors']:
+                if author:
+                    expected[(author, os.path.basename(path))] = path
+                    self._links[self.author_view._target(self.author_view.root, author, path)] = (path, author)
+        for key, link in links.items():
+            path = expected.get(key)
+            if path is None:
+                problems.append((STALE_LINK, link, "нет такой записи у автора"))
+            elif path in photos:
+                try:
+                    same = os.path.samefile(link, path)
+                except OSError:
+                    same = False  # Битая символическая ссылка
+                if not same:
+                    problems.append((STALE_LINK, link, f"указывает не на {path}"))
+        for key, path in expected.items():
+            if key not in links and path in photos:
+                problems.append((MISSING_LINK, os.path.join(self.author_view.root, *key), f"на {path}"))
+        return problems
+
+    def _check_backup(self, photos, objects):
+        if self._manifest is None:
+            return [(NOT_BACKED_UP, self.photos_dir, "нет ни одного снапшота")]
+        problems = []
+        for path, stat in objects.items():
+            if os.path.basename(path) != self._hashes[path]:
+                problems.append((BAD_OBJECT, path, "контрольная сумма не совпадает"))
+        files = self._manifest['files']
+        for rel_path, info in files.items():
+            object_path = os.path.normpath(self.backup_store._object_path(info['hash']))
+            if object_path not in objects:
+                problems.append((BAD_OBJECT, object_path, f"отсутствует объект {rel_path}"))
+        for path, stat in photos.items():
+            if path not in self._entries:
+                continue  # Лишний файл уже в отчёте как ORPHAN, копировать его незачем
+            info = files.get(self._rel_path(path))
+            if info is None or [info['size'], info['mtime']] != _stat_key(stat):
+                problems.append((NOT_BACKED_UP, path, "нет в последнем снапшоте" if info is None
+                                 else "изменился после последнего снапшота"))
+            elif info['hash'] != self._hashes[path]:
+                problems.append((CORRUPTED, path, "не совпадает с резервной копией"))
+        return problems
+
+    # Уцелевшая копия файла: для пропавшего — жёсткая ссылка в папке автора, иначе объект последнего
+    # снапшота с верной контрольной суммой (ссылка на испорченный файл испорчена вместе с ним)
+    def _good_copy(self, path):
+        entry = self._entries.get(path)
+        if entry is not None and not os.path.exists(path):
+            for author in entry['authors']:
+                link = self.author_view._target(self.author_view.root, author, path)
+                if os.path.isfile(link) and not os.path.islink(link) and os.path.getsize(link):
+                    return link
+        info = self._manifest['files'].get(self._rel_path(path)) if self._manifest else None
+        if info is not None:
+            object_path = self.backup_store._object_path(info['hash'])
+            if os.path.exists(object_path) and file_hash(object_path) == info['hash']:
+                return object_path
+        return None
+
+    def _restore(self, path):
+        source = self._good_copy(path)
+        if source is None:
+            return False
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.fsck.tmp'
+        shutil.copy2(source, tmp_path)
+        os.replace(tmp_path, path)
+        self._restored.append(path)
+        entry = self._entries.get(path)
+        if entry is not None:
+            self.author_view.add(path, entry['authors'])
+        return True
+
+    def _quarantine(self, path):
+        if os.stat(path).st_mtime >= time.time() - self.grace:
+            return False  # Файл изменился после проверки — возможно, его снова загрузил бот
+        target = os.path.join(self.orphans_dir, os.path.relpath(path, self.photos_dir))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(path, target)
+        return True
+
+    def _remove_link(self, link):
+        if link in self._links:
+            return self._add_link(link)  # Ссылка на месте, но не на тот файл — пересоздаём
+        os.remove(link)
+        folder = os.path.dirname(link)
+        if not os.listdir(folder):
+            os.rmdir(folder)
+        return True
+
+    # Исправление найденного: файлы восстанавливаются из уцелевших копий, лишние файлы уходят
+    # в orphans_dir (не удаляются), ссылки пересоздаются, резервная копия дописывается.
+    # Возвращает те же проблемы с полем repaired
+    def repair(self, problems):
+        handlers = {
+            MISSING: self._restore,
+            CORRUPTED: self._restore,
+            ORPHAN: self._quarantine,
+            STALE_LINK: self._remove_link,
+            MISSING_LINK: self._add_link,
+        }
+        for problem in problems:
+            handler = handlers.get(problem['kind'])
+            try:
+                problem['repaired'] = bool(handler(problem['path'])) if handler else False
+            except OSError as e:
+                problem['repaired'] = False
+                problem['detail'] += f" (не исправлено: {e})"
+        backup = [problem for problem in problems if problem['kind'] in (BAD_OBJECT, NOT_BACKED_UP)]
+        if backup:
+            for problem in backup:
+                if problem['kind'] == BAD_OBJECT and os.path.exists(problem['path']):
+                    os.remove(problem['path'])  # Испорченный объект, снапшот запишет его заново
+            self.backup_store.run()
+            for problem in backup:
+                problem['repaired'] = self._backed_up(problem)
+        if self._restored:
+            # copy2 сохраняет mtime, поэтому старый хэш в кэше выглядел бы как тихая порча
+            cache = self._load_cache()
+            for path in self._restored:
+                cache[path] = _stat_key(os.stat(path)) + [file_hash(path)]
+            self._save_cache(cache)
+            self._restored = []
+        return problems
+
+    def _add_link(self, link):
+        path, author = self._links[link]
+        self.author_view.add(path, [author])
+        return True
+
+    def _backed_up(self, problem):
+        if problem['kind'] == BAD_OBJECT:
+            digest = os.path.basename(problem['path'])
+            return os.path.exists(problem['path']) and file_hash(problem['path']) == digest
+        manifest = self.backup_store.load_manifest()
+        if manifest is None:
+            return False
+        if problem['path'] == self.photos_dir:
+            return True
+        info = manifest['files'].get(self._rel_path(problem['path']))
+        return info is not None and os.path.exists(self.backup_store._object_path(info['hash']))
@@ -0,0 +1,88 @@
+from collections import Counter
+
+PAD = '\x00'  # Края строки, чтобы начало и конец слова давали свои триграммы
+
+
+def trigrams(key):
+    padded = f'{PAD}{PAD}{key}{PAD}'
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+# Расстояние Левенштейна с отсечкой: None, если оно больше max_distance.
+# Считается только полоса шириной 2 * max_distance + 1 вокруг диагонали
+def levenshtein(a, b, max_distance):
+    if abs(len(a) - len(b)) > max_distance:
+        return None
+    over = max_distance + 1
+    previous = [j if j <= max_distance else over for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        current = [over] * (len(b) + 1)
+        current[0] = i if i <= max_distance else over
+        char_a = a[i - 1]
+        for j in range(max(1, i - max_distance), min(len(b), i + max_distance) + 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != b[j - 1]), over)
+        if min(current) > max_distance:
+            return None
+        previous = current
+    return previous[-1] if previous[-1] <= max_distance else None
+
+
+# Допустимое число опечаток в зависимости от длины запроса
+def max_typos(query):
+    return 1 if len(query) <= 4 else 2 if len(query) <= 10 else 3
+
+
+# Триграммный индекс по ключам (нижний регистр) для поиска с опечатками.
+# Правка на расстоянии d портит не больше 3d триграмм, поэтому кандидат с d опечатками
+# обязан встретиться хотя бы в одной из 3d + 1 самых редких триграмм запроса
+class TrigramIndex:
+    def __init__(self):
+        self.grams = {}  # триграмма -> множество ключей
+
+    def clear(self):
+        self.grams.clear()
+
+    def add(self, key):
+        for gram in trigrams(key):
+            self.grams.setdefault(gram, set()).add(key)
+
+    def remove(self, key):
+        for gram in trigrams(key):
+            keys = self.grams.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.grams[gram]
+
+    # [(расстояние, ключ)] по возрастанию расстояния. Допуск растёт от одной опечатки до max_distance,
+    # пока не найдётся хоть что-то: одна опечатка отсекает почти всех кандидатов и встречается чаще всего
+    def search(self, query, max_distance=None, limit=200):
+        query = query.lower()
+        if max_distance is None:
+            max_distance = max_typos(query)
+        query_grams = sorted(trigrams(query), key=lambda gram: len(self.grams.get(gram, ())))
+        for distance in range(1, max_distance + 1):
+            results = self._search(query, query_grams, distance, limit)
+            if results:
+                return results
+        return []
+
+    def _search(self, query, query_grams, max_distance, limit):
+        candidates = Counter()
+        for gram in query_grams[:3 * max_distance + 1]:
+            candidates.update(self.grams.get(gram, ()))
+        # Сначала проверяем кандидатов с наибольшим числом общих редких триграмм;
+        # перед подсчётом расстояния отсекаем по длине и по числу общих триграмм
+        query_set = set(query_grams)
+        min_shared = len(query_set) - 3 * max_distance
+        results = []
+        for key, _ in candidates.most_common(limit):
+            if abs(len(key) - len(query)) > max_distance:
+                continue
+            if min_shared > 0 and len(trigrams(key) & query_set) < min_shared:
+                continue
+            distance = levenshtein(query, key, max_distance)
+            if distance is not None:
+                results.append((distance, key))
+        results.sort()
+        return results
@@ -0,0 +1,92 @@
+from bisect import bisect_left, insort
+
+
+def normalize(value):
+    # Тот же ключ, что и в прежних сканах (lower), чтобы результаты совпадали
+    return value.lower()
+
+
+# Инвертированный индекс: значение -> отсортированный список ID записей.
+# Дополнительно хранит n-граммный индекс по ключам для поиска подстроки.
+class InvertedIndex:
+    def __init__(self, ngram=3):
+        self.ngram = ngram
+        self.postings = {}  # ключ -> отсортированный список ID
+        self.grams = {}  # n-грамма -> множество ключей
+
+    def clear(self):
+        self.postings.clear()
+        self.grams.clear()
+
+    def __len__(self):
+        return len(self.postings)
+
+    def keys(self):
+        return self.postings.keys()
+
+    def _key_grams(self, key):
+        # Все подстроки длины 1..ngram: запросы короче ngram ищутся напрямую
+        grams = set()
+        for size in range(1, self.ngram + 1):
+            for i in range(len(key) - size + 1):
+                grams.add(key[i:i + size])
+        return grams
+
+    def add(self, value, entry_id):
+        key = normalize(value)
+        ids = self.postings.get(key)
+        if ids is None:
+            self.postings[key] = [entry_id]
+            for gram in self._key_grams(key):
+                self.grams.setdefault(gram, set()).add(key)
+            return
+        pos = bisect_left(ids, entry_id)
+        if pos == len(ids) or ids[pos] != entry_id:
+            insort(ids, entry_id)
+
+    def remove(self, value, entry_id):
+        key = normalize(value)
+        ids = self.postings.get(key)
+        if not ids:
+            return
+        pos = bisect_left(ids, entry_id)
+        if pos < len(ids) and ids[pos] == entry_id:
+            del ids[pos]
+        if not ids:
+            del self.postings[key]
+            for gram in self._key_grams(key):
+                keys = self.grams.get(gram)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self.grams[gram]
+
+    def get(self, value):
+        return self.postings.get(normalize(value), [])
+
+    def find_keys(self, substring):
+        query = normalize(substring)
+        if not query:
+            return list(self.postings)
+        if len(query) <= self.ngram:
+            return list(self.grams.get(query, ()))
+        # Пересекаем множества ключей по n-граммам, начиная с самого маленького
+        candidates = None
+        query_grams = {query[i:i + self.ngram] for i in range(len(query) - self.ngram + 1)}
+        for gram in sorted(query_grams, key=lambda g: len(self.grams.get(g, ()))):
+            keys = self.grams.get(gram)
+            if not keys:
+                return []
+            candidates = set(keys) if candidates is None else candidates & keys
+            if not candidates:
+                return []
+        return [key for key in candidates if query in key]
+
+    def search_substring(self, substring):
+        keys = self.find_keys(substring)
+        if len(keys) == 1:
+            return list(self.postings[keys[0]])
+        ids = set()
+        for key in keys:
+            ids.update(self.postings[key])
+        return sorted(ids)
@@ -0,0 +1,177 @@
+import asyncio
+import functools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+logger = logging.getLogger(__name__)
+
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def write_file(path, data):
+    tmp_path = f'{path}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# Блокировка каталога между процессами: бот держит её всё время работы, команды, которые пишут
+# каталог в обход бота (import), — на время работы. Блокировка снимается ОС и при падении процесса
+class ProcessLock:
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    # False, если блокировку держит другой процесс
+    def acquire(self):
+        f = open(self.path, 'a+')
+        try:
+            if os.name == 'nt':
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        self._file = f
+        return True
+
+    def release(self):
+        if self._file is None:
+            return
+        if os.name == 'nt':
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+
+
+# Пул потоков для дисковых операций: обработчики только ждут результат
+class IOExecutor:
+    def __init__(self, workers=8):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='io')
+
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    def submit(self, func, *args, **kwargs):
+        return self.executor.submit(func, *args, **kwargs)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+# Единственный писатель каталога: база копит изменения в памяти (autosave = False),
+# а писатель сбрасывает их на диск одной записью на пачку изменений.
+# Неудачный сброс (нет места, нет прав) оставляет изменения в базе и повторяется через retry_delay секунд
+class CatalogWriter:
+    def __init__(self, db, io, delay=0.5, retry_delay=5):
+        self.db = db
+        self.io = io
+        self.delay = delay  # Окно, в течение которого изменения объединяются
+        self.retry_delay = retry_delay
+        self.flushes = 0
+        self._loop = None
+        self._event = None
+        self._task = None
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._event = asyncio.Event()
+        self.db.autosave = False
+        self.db.on_dirty = self.request_flush
+        self._task = self._loop.create_task(self._run())
+
+    # Может вызываться из любого потока
+    def request_flush(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._event.set)
+
+    async def _run(self):
+        while True:
+            await self._event.wait()
+            await asyncio.sleep(self.delay)
+            self._event.clear()
+            try:
+                await self.io.run(self.db.flush)
+            except Exception:
+                logger.exception("Не удалось записать каталог, повтор через %s с", self.retry_delay)
+                await asyncio.sleep(self.retry_delay)
+                self._event.set()
+                continue
+            self.flushes += 1
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.io.run(self.db.flush)
+        except Exception:
+            logger.exception("Не удалось записать каталог при остановке")
+            return
+        self.flushes += 1
+
+
+# Измеряет задержку цикла событий: насколько позже заказанного просыпается sleep
+class LoopLagMonitor:
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.samples = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - started - self.interval)
+            self.samples += 1
+            self.total_lag += lag
+            self.max_lag = max(self.max_lag, lag)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return {
+            'samples': self.samples,
+            'avg_ms': self.total_lag / self.samples * 1000 if self.samples else 0.0,
+            'max_ms': self.max_lag * 1000,
+        }
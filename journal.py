@@ -0,0 +1,158 @@
+import json
+import os
+import threading
+import time
+
+# Политики fsync для журнала
+FSYNC_ALWAYS = 'always'  # fsync после каждой записи
+FSYNC_INTERVAL = 'interval'  # fsync не чаще, чем раз в fsync_interval секунд
+FSYNC_NEVER = 'never'  # сброс на диск оставляем ОС
+
+
+# Хранилище каталога: снапшот + журнал добавлений (одна строка JSON на изменение).
+# Каждая запись журнала содержит запись каталога целиком, поэтому повторное
+# применение идемпотентно и порядок снапшот -> журнал всегда корректен.
+class JournalStore:
+    def __init__(self, base_path, fsync=FSYNC_ALWAYS, fsync_interval=1.0,
+                 compact_records=10000, compact_bytes=64 * 1024 * 1024):
+        self.snapshot_path = base_path + '.snapshot.json'
+        self.journal_path = base_path + '.journal'
+        self.compacting_path = base_path + '.journal.compacting'
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.compact_records = compact_records
+        self.compact_bytes = compact_bytes
+
+        self._lock = threading.Lock()
+        self._file = None
+        self._records = 0
+        self._bytes = 0
+        self._last_fsync = 0.0
+        self._compaction = None
+
+    def exists(self):
+        return os.path.exists(self.snapshot_path) or os.path.exists(self.journal_path)
+
+    def load(self):
+        entries = {}
+        self._records = 0
+        self._bytes = 0
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                for entry in json.load(f):
+                    entries[entry['id']] = entry
+        # Журнал прерванного сжатия идёт раньше текущего
+        for path in (self.compacting_path, self.journal_path):
+            for record in self._read_journal(path):
+                entries[record['entry']['id']] = record['entry']
+        if os.path.exists(self.journal_path):
+            self._truncate_partial_tail()
+            self._bytes = os.path.getsize(self.journal_path)
+        return sorted(entries.values(), key=lambda x: x['id'])
+
+    def _read_journal(self, path):
+        if not os.path.exists(path):
+            return
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Оборванная последняя строка после сбоя — пропускаем
+                    continue
+                if path == self.journal_path:
+                    self._records += 1
+                yield record
+
+    def _truncate_partial_tail(self):
+        # Отрезаем недописанную строку, чтобы новые записи не склеились с ней
+        with open(self.journal_path, 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b'\n'):
+                f.truncate(data.rfind(b'\n') + 1)
+
+    def _open(self):
+        if self._file is None:
+            self._file = open(self.journal_path, 'a', encoding='utf-8')
+        return self._file
+
+    @staticmethod
+    def encode(op, entry):
+        return json.dumps({'op': op, 'entry': entry}, ensure_ascii=False) + '\n'
+
+    def append(self, op, entry):
+        self.append_lines([self.encode(op, entry)])
+
+    # Пачка записей дописывается одним вызовом write и одним fsync
+    def append_lines(self, lines):
+        if not lines:
+            return
+        data = ''.join(lines)
+        with self._lock:
+            f = self._open()
+            size = os.fstat(f.fileno()).st_size  # Прошлые пачки уже сброшены в файл
+            try:
+                f.write(data)
+                f.flush()
+                now = time.monotonic()
+                if self.fsync == FSYNC_ALWAYS or (
+                        self.fsync == FSYNC_INTERVAL and now - self._last_fsync >= self.fsync_interval):
+                    os.fsync(f.fileno())
+                    self._last_fsync = now
+            except OSError:
+                # Недописанная пачка отрезается, чтобы её повтор не склеился с оборванной строкой
+                self._file = None
+                try:
+                    f.close()
+                except OSError:
+                    pass
+                os.truncate(self.journal_path, size)
+                raise
+            self._records += len(lines)
+            self._bytes += len(data.encode('utf-8'))
+
+    def needs_compaction(self):
+        if self._compaction is not None and self._compaction.is_alive():
+            return False
+        return self._records >= self.compact_records or self._bytes >= self.compact_bytes
+
+    def compact(self, entries, background=True):
+        # entries — копия каталога на момент ротации журнала
+        with self._lock:
+            if self._compaction is not None and self._compaction.is_alive():
+                return
+            if self._file is not None:
+                os.fsync(self._file.fileno())
+                self._file.close()
+                self._file = None
+            if os.path.exists(self.journal_path) and not os.path.exists(self.compacting_path):
+                os.replace(self.journal_path, self.compacting_path)
+            self._records = 0
+            self._bytes = 0
+        if background:
+            self._compaction = threading.Thread(target=self._write_snapshot, args=(entries,), daemon=True)
+            self._compaction.start()
+        else:
+            self._write_snapshot(entries)
+
+    def import_entries(self, entries):
+        self._write_snapshot(entries)
+
+    def _write_snapshot(self, entries):
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entries, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        if os.path.exists(self.compacting_path):
+            os.remove(self.compacting_path)
+
+    def close(self):
+        if self._compaction is not None:
+            self._compaction.join()
+        with self._lock:
+            if self._file is not None:
+                os.fsync(self._file.fileno())
+                self._file.close()
+                self._file = None
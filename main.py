@@ -1,101 +1,520 @@
+import argparse
+import asyncio
 import json
+import logging
 import os
-import random
-from collections import Counter
-from telegram import Update, ReplyKeyboardMarkup, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
+import re
+import tempfile
+import threading
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from telegram import Update, Message, ReplyKeyboardMarkup, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
+from telegram import InlineQueryResultCachedPhoto, InlineQueryResultsButton
+from telegram.error import BadRequest
 from telegram.ext import (
     Application,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
+    InlineQueryHandler,
     filters,
     CallbackContext,
     ConversationHandler,
 )
-import shutil
+
+from author_stats import AuthorStats
+from author_view import AuthorView
+from backup import BackupStore
+from bulk_import import import_photos
+from cursors import Cursor, CursorStore, ResultCache
+from fsck import IntegrityChecker
+from indexes import InvertedIndex
+from io_pool import CatalogWriter, IOExecutor, LoopLagMonitor, ProcessLock, remove_file, write_file
+from journal import JournalStore
+from metrics import InstrumentedRequest, Metrics
+from phash import BKTree, try_dhash
+from query import QueryError, QueryPlanner
+from records import EntryRecord, vocabulary
+from sessions import SessionPersistence
+from sqlite_db import SQLitePhotoDatabase, migrate_from_json
+from subscriptions import Notifier, SubscriptionStore
+from suggest import CooccurrenceModel
+from update_processor import PerUserUpdateProcessor
+from variants import VARIANTS, VariantCache
+
+logger = logging.getLogger(__name__)
 
 TOKEN = 'YOUR_TOKEN'
 
+# Хранилище каталога: 'json' — photos.json перезаписывается целиком,
+# 'journal' — снапшот + журнал изменений (photos.json импортируется при первом запуске),
+# 'sqlite' — база SQLite (перенос: python main.py migrate-sqlite)
+STORAGE_MODE = 'json'
+SQLITE_PATH = 'photos.db'
+JOURNAL_FSYNC = 'always'  # 'always', 'interval' или 'never'
+JOURNAL_COMPACT_RECORDS = 10000  # Сжатие в снапшот после N записей журнала
+JOURNAL_COMPACT_BYTES = 64 * 1024 * 1024  # ...или после M байт
+# Блокировка каталога: бот держит её во время работы, python main.py import без неё не запускается
+CATALOG_LOCK_PATH = 'catalog.lock'
+
+# Резервное копирование папки photos в фоне
+BACKUP_DIR = 'photos_backup'
+BACKUP_INTERVAL = 300  # Период проверки изменений, секунд
+BACKUP_KEEP = 30  # Сколько снапшотов хранить
+
+# Проверка файлов (python main.py fsck): хэши с размером и mtime для повторных проверок
+# и папка, куда --repair переносит файлы без записей каталога. Файлы моложе FSCK_ORPHAN_GRACE секунд
+# не трогаются: это могут быть загрузки незавершённого /add (сессия живёт до SESSION_TTL)
+FSCK_CACHE_PATH = 'fsck_cache.json'
+ORPHANS_DIR = 'photos_orphans'
+FSCK_ORPHAN_GRACE = 24 * 60 * 60
+
+# Уменьшенные копии фотографий: создаются в пуле процессов при добавлении или первом показе,
+# при превышении VARIANTS_MAX_BYTES вытесняются давно не показанные
+VARIANTS_DIR = 'photos_variants'
+VARIANTS_MAX_BYTES = 2 * 1024 * 1024 * 1024
+VARIANT_WORKERS = None  # По умолчанию — по числу ядер
+NAVIGATION_VARIANT = 'telegram'  # Какой вариант отправлять при пролистывании
+GALLERY_VARIANT = 'telegram'  # ...и в альбомах галереи
+
+# Пул потоков для дисковых операций и окно объединения записей каталога, секунд
+IO_WORKERS = 8
+CATALOG_FLUSH_DELAY = 0.5
+
+# Порог расстояния Хэмминга между перцептивными хэшами, при котором фото считаются дубликатами
+DUPLICATE_DISTANCE = 6
+
+# Сколько тегов подсказывать при добавлении фотографии
+TAG_SUGGESTIONS = 5
+
+# Сколько похожих авторов предлагать, если автор с опечаткой не найден
+AUTHOR_SUGGESTIONS = 5
+
+# Сколько фотографий можно отправить за одну команду /add
+ADD_BATCH_LIMIT = 100
+
+# Курсоры просмотра результатов: не больше CURSOR_CACHE_SIZE, простаивающие дольше CURSOR_TTL секунд удаляются
+CURSOR_CACHE_SIZE = 10000
+CURSOR_TTL = 30 * 60
+
+# Сессии пользователей (user_data, состояния диалогов, курсоры) переживают перезапуск: изменения пишутся
+# в SESSIONS_PATH раз в SESSION_FLUSH_INTERVAL секунд. Раз в SESSION_SWEEP_INTERVAL секунд вытесняются
+# сессии без активности дольше SESSION_TTL и самые старые сверх SESSION_MAX_USERS
+SESSIONS_PATH = 'sessions.db'
+SESSION_FLUSH_INTERVAL = 5
+SESSION_SWEEP_INTERVAL = 60
+SESSION_TTL = 24 * 60 * 60
+SESSION_MAX_USERS = 10000
+
+# Inline-режим (@бот запрос): результаты запроса кэшируются на INLINE_CACHE_TTL секунд, чтобы запросы
+# на каждое нажатие клавиши не выполнялись заново; Telegram отдаёт не больше 50 результатов за раз
+INLINE_PAGE_SIZE = 50
+INLINE_CACHE_SIZE = 1000
+INLINE_CACHE_TTL = 30
+INLINE_CACHE_TIME = 10  # Сколько секунд Telegram может сам кэшировать ответ
+
+# Размеры страницы галереи (альбом Telegram — от 2 до 10 фотографий)
+GALLERY_PAGE_SIZES = (4, 6, 10)
+
+# Метрики в формате Prometheus: http://METRICS_HOST:METRICS_PORT/metrics (None — не запускать сервер)
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9108
+ADMIN_IDS = set()  # Telegram ID пользователей, которым доступна команда /stats
+# Обновления дольше PROFILE_SLOW_UPDATES секунд сохраняются в PROFILE_DIR для flame graph (None — без профилирования)
+PROFILE_SLOW_UPDATES = None
+PROFILE_DIR = 'profiles'
+
+# Подписки на авторов: новые фото копятся NOTIFY_BATCH_DELAY секунд и приходят подписчику одним альбомом.
+# Telegram допускает около 30 сообщений в секунду на бота и одно сообщение в секунду в чат
+SUBSCRIPTIONS_PATH = 'subscriptions.db'
+NOTIFY_BATCH_DELAY = 10
+NOTIFY_GLOBAL_RATE = 25  # Фотографий в секунду во все чаты вместе
+NOTIFY_CHAT_INTERVAL = 1.0  # Секунд между альбомами в один чат
+NOTIFY_WORKERS = 8
+
+# Получение обновлений: 'polling' — опрос getUpdates, 'webhook' — Telegram присылает их на WEBHOOK_URL.
+# Локальный сервер слушает WEBHOOK_LISTEN:WEBHOOK_PORT, TLS обычно снимает обратный прокси перед ним
+RUN_MODE = 'polling'
+WEBHOOK_LISTEN = '127.0.0.1'
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = 'telegram'
+WEBHOOK_URL = None  # Публичный адрес, например 'https://example.com/telegram'
+WEBHOOK_SECRET = None  # Проверяется в заголовке X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_MAX_CONNECTIONS = 40  # Сколько соединений Telegram может открыть одновременно
+# Обновления разных пользователей обрабатываются параллельно, одного пользователя — по очереди
+CONCURRENT_UPDATES = 64
+
+
+# Копия записи, которую можно отдать другому потоку
+def copy_entry(entry):
+    return {key: list(value) if isinstance(value, list) else value for key, value in entry.items()}
+
+
+# Новая запись каталога; списки сортируются по алфавиту
+def new_entry(entry_id, file_path, authors, tags, characters, file_id=None, phash=None):
+    return {
+        'id': entry_id,  # Уникальный ID
+        'file_path': file_path,
+        'authors': sorted([author.strip() for author in authors], key=lambda x: x.lower()),
+        'tags': sorted([tag.strip() for tag in tags], key=lambda x: x.lower()),
+        'characters': sorted([character.strip() for character in characters], key=lambda x: x.lower()),
+        'file_id': file_id,  # file_id фотографии в Telegram, чтобы не загружать файл повторно
+        'phash': phash,  # Перцептивный хэш для поиска дубликатов
+        'added_at': datetime.now().isoformat(timespec='seconds')
+    }
+
 
 # Класс для базы данных фотографий
 class PhotoDatabase:
-    def __init__(self, filename='photos.json'):
+    def __init__(self, filename='photos.json', journal=None):
         self.filename = filename
+        self.journal = journal  # JournalStore или None для режима photos.json
         self.data = []
+        # autosave = False: изменения копятся в памяти, на диск их сбрасывает flush() (см. CatalogWriter)
+        self.autosave = True
+        self.on_dirty = None
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()  # Сбросы на диск идут строго по очереди
+        self._dirty = False
+        self._pending = []  # Ещё не записанные строки журнала
+        self._listeners = []  # Вызываются после записи: callback(op, entry, previous)
+        # Записи хранятся компактно (EntryRecord) и отсортированы по ID. Пока ID идут подряд с 1,
+        # запись находится по номеру строки; иначе — через словарь _by_id
+        self._by_id = None
+        # Индексы: значение -> отсортированный список ID
+        self._author_index = InvertedIndex()
+        self._tag_index = InvertedIndex()
+        self._character_index = InvertedIndex()
+        self._phash_index = BKTree()  # Перцептивные хэши для поиска похожих изображений
+        self._tag_model = CooccurrenceModel()  # Для подсказок тегов
+        self._author_stats = AuthorStats()  # Для /search_author
         self.load_data()
 
     def load_data(self):
-        if os.path.exists(self.filename):
+        if self.journal is not None and self.journal.exists():
+            self.data = [EntryRecord(entry) for entry in self.journal.load()]
+        elif os.path.exists(self.filename):
             with open(self.filename, 'r') as f:
-                self.data = json.load(f)
-
-    def save_data(self):
-        with open(self.filename, 'w') as f:
-            json.dump(self.data, f, indent=4)
-
-    def add_entry(self, file_path, authors, tags, characters):
-        # Сортируем списки по алфавиту
-        sorted_authors = sorted([author.strip() for author in authors], key=lambda x: x.lower())
-        sorted_tags = sorted([tag.strip() for tag in tags], key=lambda x: x.lower())
-        sorted_characters = sorted([character.strip() for character in characters], key=lambda x: x.lower())
-
-        # Добавляем запись
-        entry = {
-            'id': len(self.data) + 1,  # Уникальный ID
-            'file_path': file_path,
-            'authors': sorted_authors,
-            'tags': sorted_tags,
-            'characters': sorted_characters
-        }
-        self.data.append(entry)
-        self.data.sort(key=lambda x: x['id'])  # Сортировка по ID
-        self.save_data()
+                # Записи сжимаются по мере разбора, а не после загрузки всего файла
+                self.data = json.load(f, object_hook=EntryRecord)
+            self.data.sort(key=lambda x: x.id)
+            if self.journal is not None:
+                # Импортируем существующий photos.json в снапшот журнала
+                self.journal.import_entries(self._copy_data())
+        self._rebuild_indexes()
+
+    def _rebuild_indexes(self):
+        contiguous = all(entry.id == row for row, entry in enumerate(self.data, 1))
+        self._by_id = None if contiguous else {}
+        self._author_index.clear()
+        self._tag_index.clear()
+        self._character_index.clear()
+        self._phash_index = BKTree()
+        self._tag_model.clear()
+        self._author_stats.clear()
+        for entry in self.data:
+            self._index_entry(entry)
+
+    def _index_entry(self, entry):
+        if self._by_id is not None:
+            self._by_id[entry['id']] = entry
+        for author in entry['authors']:
+            self._author_index.add(author, entry['id'])
+        for tag in entry['tags']:
+            self._tag_index.add(tag, entry['id'])
+        for character in entry['characters']:
+            self._character_index.add(character, entry['id'])
+        if entry.get('phash'):
+            self._phash_index.add(entry['phash'], entry['id'])
+        self._tag_model.add(entry)
+        self._author_stats.add(entry)
+
+    def _unindex_entry(self, entry):
+        for author in entry['authors']:
+            self._author_index.remove(author, entry['id'])
+        for tag in entry['tags']:
+            self._tag_index.remove(tag, entry['id'])
+        for character in entry['characters']:
+            self._character_index.remove(character, entry['id'])
+        if entry.get('phash'):
+            self._phash_index.remove(entry['phash'], entry['id'])
+        self._tag_model.remove(entry)
+        self._author_stats.remove(entry)
+
+    # Полная запись в JSON; в режиме журнала используется как экспорт
+    def save_data(self, filename=None):
+        with self._lock:
+            self._write_json(self.data, filename or self.filename)
+
+    def _write_json(self, data, filename):
+        tmp_filename = filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            json.dump(data, f, indent=4, default=EntryRecord.to_dict)
+        os.replace(tmp_filename, filename)
+
+    def _persist(self, op, entry):
+        self._record(op, entry)
+        self._changed()
+
+    def _record(self, op, entry):
+        if self.journal is None:
+            self._dirty = True
+        else:
+            self._pending.append(self.journal.encode(op, entry.to_dict()))
+
+    def _changed(self):
+        if self.autosave:
+            self.flush()
+        elif self.on_dirty is not None:
+            self.on_dirty()
+
+    # Сбрасывает накопленные изменения на диск; при autosave = False вызывается из потока писателя
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                if self.journal is None:
+                    if not self._dirty:
+                        return
+                    self._dirty = False
+                    # Пишем копию, чтобы не держать блокировку на время сериализации
+                    data = self.data if self.autosave else self._copy_data()
+                else:
+                    lines, self._pending = self._pending, []
+            try:
+                if self.journal is None:
+                    self._write_json(data, self.filename)
+                    return
+                self.journal.append_lines(lines)
+            except BaseException:
+                # Несохранённая пачка возвращается в очередь и уйдёт со следующим сбросом
+                with self._lock:
+                    if self.journal is None:
+                        self._dirty = True
+                    else:
+                        self._pending[:0] = lines
+                raise
+            if self.journal.needs_compaction():
+                with self._lock:
+                    data = self._copy_data()
+                self.journal.compact(data)
+
+    def _copy_data(self):
+        # to_dict собирает списки заново, поэтому копия не делит их с записями
+        return [entry.to_dict() for entry in self.data]
+
+    def close(self):
+        self.flush()
+        if self.journal is not None:
+            self.journal.close()
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    def _notify(self, op, entry, previous=None):
+        for callback in self._listeners:
+            callback(op, entry, previous)
+
+    # ID новой записи: на единицу больше последнего, поэтому self.data остаётся отсортированным без sort
+    def _next_id(self):
+        return self.data[-1].id + 1 if self.data else 1
+
+    # Запись по ID за O(1)
+    def _find(self, entry_id):
+        if self._by_id is not None:
+            return self._by_id.get(entry_id)
+        return self.data[entry_id - 1] if 0 < entry_id <= len(self.data) else None
+
+    def add_entry(self, file_path, authors, tags, characters, file_id=None, phash=None):
+        with self._lock:
+            # Добавляем запись
+            entry = EntryRecord(new_entry(self._next_id(), file_path, authors, tags, characters, file_id, phash))
+            self.data.append(entry)
+            self._index_entry(entry)
+            self._persist('add', entry)
+        self._notify('add', entry)
+        return entry
+
+    # Пакетное добавление: items — словари с аргументами add_entry, одна запись на диск на всю пачку
+    def add_entries(self, items):
+        entries = []
+        with self._lock:
+            for item in items:
+                entry = EntryRecord(new_entry(self._next_id(), **item))
+                self.data.append(entry)
+                self._index_entry(entry)
+                self._record('add', entry)
+                entries.append(entry)
+            if entries:
+                self._changed()
+        for entry in entries:
+            self._notify('add', entry)
+        return entries
 
     def update_entry(self, entry_id, new_authors=None, new_tags=None, new_characters=None):
-        for entry in self.data:
-            if entry['id'] == int(entry_id):
-                # Обновляем авторов, если переданы
-                if new_authors:
-                    new_authors = [author.strip() for author in new_authors if author.strip()]
-                    entry['authors'] = sorted(list(set(entry['authors'] + new_authors)), key=lambda x: x.lower())
-
-                # Обновляем теги
-                if new_tags:
-                    new_tags = [tag.strip() for tag in new_tags if tag.strip()]
-                    entry['tags'] = sorted(list(set(entry['tags'] + new_tags)), key=lambda x: x.lower())
-
-                # Обновляем персонажей
-                if new_characters:
-                    new_characters = [character.strip() for character in new_characters if character.strip()]
-                    entry['characters'] = sorted(list(set(entry['characters'] + new_characters)),
-                                                 key=lambda x: x.lower())
-
-                break
-        self.data.sort(key=lambda x: x['id'])
-        self.save_data()
+        entry = self._find(int(entry_id))
+        if entry is None:
+            return None
+        with self._lock:
+            previous = copy_entry(entry)
+            self._unindex_entry(entry)
+            # Обновляем авторов, если переданы
+            if new_authors:
+                new_authors = [author.strip() for author in new_authors if author.strip()]
+                entry['authors'] = sorted(list(set(entry['authors'] + new_authors)), key=lambda x: x.lower())
+
+            # Обновляем теги
+            if new_tags:
+                new_tags = [tag.strip() for tag in new_tags if tag.strip()]
+                entry['tags'] = sorted(list(set(entry['tags'] + new_tags)), key=lambda x: x.lower())
+
+            # Обновляем персонажей
+            if new_characters:
+                new_characters = [character.strip() for character in new_characters if character.strip()]
+                entry['characters'] = sorted(list(set(entry['characters'] + new_characters)),
+                                             key=lambda x: x.lower())
+            self._index_entry(entry)
+            self._persist('update', entry)
+        self._notify('update', entry, previous)
+        return entry
+
+    def get_entry(self, entry_id):
+        return self._find(int(entry_id))
+
+    def set_file_id(self, entry_id, file_id):
+        entry = self._find(int(entry_id))
+        if entry is not None and entry.get('file_id') != file_id:
+            with self._lock:
+                entry['file_id'] = file_id
+                self._persist('update', entry)
+
+    def set_phash(self, entry_id, phash):
+        entry = self._find(int(entry_id))
+        if entry is None:
+            return
+        with self._lock:
+            if entry.get('phash'):
+                self._phash_index.remove(entry['phash'], entry['id'])
+            entry['phash'] = phash
+            if phash:
+                self._phash_index.add(phash, entry['id'])
+            self._persist('update', entry)
+
+    # Похожие изображения: [(расстояние Хэмминга, запись)] по возрастанию расстояния
+    def find_similar(self, phash, max_distance):
+        return [(distance, self._find(entry_id))
+                for distance, entry_id in self._phash_index.search(phash, max_distance)]
+
+    # Подсказки тегов по совместной встречаемости с авторами, персонажами и тегами
+    def suggest_tags(self, authors=(), characters=(), tags=(), k=5):
+        return self._tag_model.suggest(authors, characters, tags, k)
+
+    # Авторы, похожие на запрос с опечатками: [(написание, число записей)]
+    def suggest_authors(self, query, k=5):
+        with self._lock:
+            return self._author_stats.suggest(query, k)
+
+    # Случайные авторы со статистикой; время не зависит от размера каталога
+    def sample_authors(self, k=3, top_tags=3):
+        with self._lock:
+            return [{'author': name, 'count': count, 'last_added': last_added,
+                     'top_tags': self._tag_model.top_tags(('author', key), top_tags)}
+                    for key, name, count, last_added in self._author_stats.sample(k)]
+
+    def count(self):
+        return len(self.data)
+
+    def entry_at(self, index):
+        # self.data всегда отсортирован по ID
+        return self.data[index]
+
+    # ID записей по полю: автор — точное совпадение, тег и персонаж — подстрока
+    def find_ids(self, field, value):
+        if field == 'author':
+            return list(self._author_index.get(value))
+        if field == 'tag':
+            return self._tag_index.search_substring(value)
+        if field == 'character':
+            return self._character_index.search_substring(value)
+        raise ValueError(f"Неизвестное поле: {field}")
+
+    # Сколько ID вернёт find_ids, без построения самого списка (для планирования запросов)
+    def count_ids(self, field, value):
+        if field == 'author':
+            return len(self._author_index.get(value))
+        if field in ('tag', 'character'):
+            index = self._tag_index if field == 'tag' else self._character_index
+            return sum(len(index.postings[key]) for key in index.find_keys(value))
+        raise ValueError(f"Неизвестное поле: {field}")
+
+    def all_ids(self):
+        return [entry.id for entry in self.data]
+
+    # Записи по списку ID в том же порядке; несуществующие ID пропускаются
+    def get_entries_by_ids(self, ids):
+        return [entry for entry in map(self._find, ids) if entry is not None]
 
     def search_by_author(self, author):
-        return [entry for entry in self.data if any(author.lower() == a.lower() for a in entry['authors'])]
+        return self.get_entries_by_ids(self.find_ids('author', author))
 
     def search_by_tag(self, tag):
-        return [entry for entry in self.data if any(tag.lower() in t.lower() for t in entry['tags'])]
+        return self.get_entries_by_ids(self.find_ids('tag', tag))
 
     def search_by_character(self, character):
-        return [entry for entry in self.data if any(character.lower() in c.lower() for c in entry['characters'])]
+        return self.get_entries_by_ids(self.find_ids('character', character))
 
     def get_entries(self):
-        return sorted(self.data, key=lambda x: x['id'])
+        return list(self.data)
 
     def get_all_authors(self):
-        authors = set()
-        for entry in self.data:
-            for author in entry['authors']:
-                authors.add(author)
-        return sorted(list(authors), key=lambda x: x.lower())
+        # Одинаковые наборы авторов — один и тот же кортеж ID, раскрываем каждый набор один раз
+        author_ids = set()
+        for authors in {entry.authors for entry in self.data}:
+            author_ids.update(authors)
+        return sorted(vocabulary.decode(author_ids), key=lambda x: x.lower())
 
 
 # Создаем экземпляр базы данных
-db = PhotoDatabase()
+if STORAGE_MODE == 'sqlite':
+    db = SQLitePhotoDatabase(SQLITE_PATH)
+elif STORAGE_MODE == 'journal':
+    db = PhotoDatabase(journal=JournalStore(
+        'photos',
+        fsync=JOURNAL_FSYNC,
+        compact_records=JOURNAL_COMPACT_RECORDS,
+        compact_bytes=JOURNAL_COMPACT_BYTES,
+    ))
+else:
+    db = PhotoDatabase()
+
+# Время обработчиков делится на работу с базой, диском и Bot API
+metrics = Metrics(profile_threshold=PROFILE_SLOW_UPDATES, profile_dir=PROFILE_DIR)
+db = metrics.instrument(db, 'db')
+
+# Дисковые операции выполняются в пуле потоков, запись каталога — единственным писателем
+io_executor = metrics.instrument(IOExecutor(IO_WORKERS), 'io')
+catalog_writer = CatalogWriter(db, io_executor, delay=CATALOG_FLUSH_DELAY)
+
+backup_store = BackupStore('photos', BACKUP_DIR, keep=BACKUP_KEEP)
+
+# Папки по авторам — жёсткие ссылки, синхронизируются при каждой записи в каталог
+author_view = AuthorView('photos_by_author')
+db.add_listener(lambda op, entry, previous: io_executor.submit(author_view.on_change, op, copy_entry(entry), previous))
+
+# Варианты новых фотографий готовим сразу, чтобы первый показ не ждал
+variant_cache = VariantCache(VARIANTS_DIR, VARIANTS_MAX_BYTES, VARIANT_WORKERS)
+db.add_listener(lambda op, entry, previous: op == 'add' and io_executor.submit(variant_cache.prefetch, entry['file_path']))
+
+# Хранилище сессий открывает build_application: импорт main не создаёт sessions.db
+sessions = None
+cursors = CursorStore(CURSOR_CACHE_SIZE, CURSOR_TTL)
+# Незавершённые загрузки /add по пользователям; задачи asyncio не сохраняются, в user_data — только готовые фото
+downloads = {}
+
+# Запросы /search выполняются пересечениями и объединениями списков ID из индексов
+query_planner = QueryPlanner(db)
+inline_results = ResultCache(INLINE_CACHE_SIZE, INLINE_CACHE_TTL)
 
 # Определяем состояния для ConversationHandler
 ADD_PHOTO, ADD_AUTHORS, ADD_TAGS, ADD_CHARACTERS = range(4)
@@ -108,17 +527,87 @@ def create_command_menu():
         ["/add➕", "/update⬆️"],
         ["/search_author👤", "/search_tag🔖"],
         ["/search_character👥", "/display📱"],
-        ["/help🆘"]
+        ["/gallery🖼️", "/help🆘"]
     ]
     return ReplyKeyboardMarkup(command_menu, resize_keyboard=True, one_time_keyboard=True)
 
 
-# Функция для создания инлайн-кнопок для пролистывания
-def create_navigation_buttons(current_index, total, prefix=None):
+# Подпись к фотографии записи
+def entry_caption(entry):
+    return (
+        f"<b>ID:</b> {entry['id']}\n"
+        f"<b>👤 Авторы:</b> {', '.join(entry['authors'])}\n"
+        f"<b>🏷️ Теги:</b> {', '.join(entry['tags'])}\n"
+        f"<b>👥 Персонажи:</b> {', '.join(entry['characters'])}"
+    )
+
+
+# Запоминаем file_id, который Telegram присвоил загруженной фотографии
+def remember_file_id(entry, message):
+    if isinstance(message, Message) and message.photo:
+        db.set_file_id(entry['id'], message.photo[-1].file_id)
+        entry['file_id'] = message.photo[-1].file_id
+
+
+# Отправка фотографии записи: сначала по file_id, при отказе Telegram — загрузка с диска
+async def reply_entry_photo(message, entry, reply_markup):
+    if entry.get('file_id'):
+        try:
+            sent = await message.reply_photo(photo=entry['file_id'], caption=entry_caption(entry),
+                                             parse_mode="HTML", reply_markup=reply_markup)
+            metrics.inc('file_id_cache_total', result='hit')
+            return sent
+        except BadRequest:
+            metrics.inc('file_id_cache_total', result='stale')  # file_id устарел
+    else:
+        metrics.inc('file_id_cache_total', result='miss')
+    photo = await io_executor.run(variant_cache.read, entry['file_path'], NAVIGATION_VARIANT)
+    sent = await message.reply_photo(photo=photo, caption=entry_caption(entry),
+                                     parse_mode="HTML", reply_markup=reply_markup)
+    remember_file_id(entry, sent)
+    return sent
+
+
+async def edit_entry_photo(query, entry, reply_markup):
+    if entry.get('file_id'):
+        try:
+            edited = await query.edit_message_media(
+                media=InputMediaPhoto(entry['file_id'], caption=entry_caption(entry), parse_mode="HTML"),
+                reply_markup=reply_markup
+            )
+            metrics.inc('file_id_cache_total', result='hit')
+            return edited
+        except BadRequest as e:
+            if 'message is not modified' in str(e).lower():
+                return None
+            metrics.inc('file_id_cache_total', result='stale')
+    else:
+        metrics.inc('file_id_cache_total', result='miss')
+    photo = await io_executor.run(variant_cache.read, entry['file_path'], NAVIGATION_VARIANT)
+    edited = await query.edit_message_media(
+        media=InputMediaPhoto(photo, caption=entry_caption(entry), parse_mode="HTML"),
+        reply_markup=reply_markup
+    )
+    remember_file_id(entry, edited)
+    return edited
+
+
+# Кнопки пролистывания: <префикс>prev_<индекс> / <префикс>next_<индекс>
+NAVIGATION_PATTERN = re.compile(r"^(|author|tag|character|query)(prev|next)_(\d+)$")
+# Кнопки галереи: gallery<префикс>prev_<страница> / gallery<префикс>next_<страница>
+GALLERY_PATTERN = re.compile(r"^gallery(|author|tag|character|query)(prev|next)_(\d+)$")
+
+
+# Функция для создания инлайн-кнопок для пролистывания.
+# При page_size > 1 current_index — номер страницы, между стрелками показывается счётчик страниц
+def create_navigation_buttons(current_index, total, prefix=None, page_size=1):
+    pages = (total + page_size - 1) // page_size
     keyboard = []
     if current_index > 0:
         keyboard.append(InlineKeyboardButton("⬅️ Предыдущая", callback_data=f"{prefix or ''}prev_{current_index}"))
-    if current_index < total - 1:
+    if page_size > 1:
+        keyboard.append(InlineKeyboardButton(f"{current_index + 1}/{pages}", callback_data="noop"))
+    if current_index < pages - 1:
         keyboard.append(InlineKeyboardButton("Следующая ➡️", callback_data=f"{prefix or ''}next_{current_index}"))
     return InlineKeyboardMarkup([keyboard] if keyboard else [])
 
@@ -128,72 +617,226 @@ async def start(update: Update, context: CallbackContext) -> None:
     await update.message.reply_text(
         "🌟 <b>Привет! Я бот для управления базой данных фотографий.</b>\n\n"
         "Используй команды:\n"
-        "/add - Добавить новую фотографию\n"
+        "/add - Добавить фотографии (одну, несколько или альбом)\n"
         "/update - Обновить запись\n"
         "/search_author - Найти по автору\n"
         "/search_tag - Найти по тегу\n"
         "/search_character - Найти по персонажу\n"
+        "/search - Поиск по запросу: author:X tag:Y -tag:Z OR ...\n"
         "/display - Показать все записи\n"
+        "/gallery - Несколько фотографий на странице\n"
+        "/subscribe - Подписаться на новые фотографии автора\n"
+        "/subscriptions - Мои подписки\n"
+        f"@{context.bot.username} запрос - Поиск фотографий в любом чате\n"
         "/help - Показать список команд",
         parse_mode="HTML",
         reply_markup=create_command_menu()
     )
 
 
+# Незавершённый /add выбрасывается (/cancel, повторный /add, вытеснение сессии): загрузки отменяются,
+# файлы, созданные ими в photos, удаляются — в каталог они уже не попадут
+def discard_downloads(user_id, user_data) -> None:
+    for task in downloads.pop(user_id, []):
+        task.cancel()
+    for file_path in user_data.pop('new_files', []):
+        io_executor.submit(remove_file, file_path)
+    user_data.pop('photos', None)
+
+
+# Данные диалога вытесняются вместе с простаивающей сессией, а состояние обработчика остаётся в памяти
+# до перезапуска: вернувшийся пользователь начинает команду заново
+async def session_expired(update: Update, context: CallbackContext, *keys) -> bool:
+    if all(key in context.user_data for key in keys):
+        return False
+    await update.message.reply_text("⌛ Сессия истекла, начните команду заново.", reply_markup=create_command_menu())
+    return True
+
+
 # Команда /add
 async def add_entry(update: Update, context: CallbackContext) -> int:
-    await update.message.reply_text("📸 Отправьте фотографию:")
+    discard_downloads(update.effective_user.id, context.user_data)
+    downloads[update.effective_user.id] = []
+    context.user_data['photos'] = []
+    context.user_data['new_files'] = []
+    context.user_data.pop('media_group_id', None)
+    await update.message.reply_text("📸 Отправьте фотографию, альбом или несколько фотографий подряд, затем /done:")
     return ADD_PHOTO
 
 
+# Запись загруженной фотографии и её перцептивный хэш — одна задача пула потоков
+def save_photo(file_path, data):
+    write_file(file_path, data)
+    return try_dhash(file_path)
+
+
+# Загрузка фотографии на диск и перцептивный хэш; выполняется в фоне, пока приходят следующие фото.
+# Созданные файлы попадают в new_files: файл, который уже был (то же фото в каталоге), при отмене не удаляется
+async def download_photo(context: CallbackContext, photo, new_files) -> dict:
+    file = await context.bot.get_file(photo.file_id)
+    file_path = f"photos/{photo.file_unique_id}.jpg"
+    data = await file.download_as_bytearray()
+    created = not os.path.exists(file_path)
+    if created:
+        new_files.append(file_path)
+    saving = io_executor.submit(save_photo, file_path, bytes(data))
+    try:
+        phash = await asyncio.wrap_future(saving)
+    except asyncio.CancelledError:
+        # Отмена не останавливает запись в потоке: файл удаляется, когда она закончится
+        if created:
+            saving.add_done_callback(lambda _: remove_file(file_path))
+        raise
+    return {'file_path': file_path, 'file_id': photo.file_id, 'phash': phash}
+
+
+# Готовое фото сразу попадает в user_data на своё место: после перезапуска оно не потеряется
+# и не останется в photos без записи
+async def download_into(context: CallbackContext, user_id, photos, new_files, index, photo) -> None:
+    photos[index] = await download_photo(context, photo, new_files)
+    context.application.mark_data_for_update_persistence(user_ids=user_id)
+
+
 async def add_photo(update: Update, context: CallbackContext) -> int:
     if not update.message.photo:
         await update.message.reply_text("❌ Пожалуйста, отправьте фотографию.")
         return ADD_PHOTO
+    photos = context.user_data.setdefault('photos', [])
+    if len(photos) >= ADD_BATCH_LIMIT:
+        await update.message.reply_text(f"❌ Не больше {ADD_BATCH_LIMIT} фотографий за раз. Нажмите /done.")
+        return ADD_PHOTO
     photo = update.message.photo[-1]  # Берем фото наибольшего размера
-    file = await context.bot.get_file(photo.file_id)
-    file_path = f"photos/{photo.file_unique_id}.jpg"
     os.makedirs('photos', exist_ok=True)  # Создаем папку, если не существует
-    await file.download_to_drive(file_path)
-    context.user_data['file_path'] = file_path
-    await update.message.reply_text("👤 Введите автора (через запятую, если несколько):")
+    user_id = update.effective_user.id
+    photos.append(None)  # Место под фото, пока оно загружается
+    new_files = context.user_data.setdefault('new_files', [])
+    task = asyncio.create_task(download_into(context, user_id, photos, new_files, len(photos) - 1, photo))
+    downloads.setdefault(user_id, []).append(task)
+    # На альбом отвечаем один раз, а не на каждую его фотографию
+    media_group_id = update.message.media_group_id
+    if media_group_id is None or media_group_id != context.user_data.get('media_group_id'):
+        context.user_data['media_group_id'] = media_group_id
+        await update.message.reply_text("📸 Фотография получена. Отправьте ещё или нажмите /done.")
+    return ADD_PHOTO
+
+
+# Все фотографии получены: дожидаемся загрузок и переходим к авторам.
+# Пустые места — загрузки с ошибкой или прерванные перезапуском бота
+async def add_photos_done(update: Update, context: CallbackContext) -> int:
+    received = context.user_data.get('photos', [])
+    if not received:
+        await update.message.reply_text("❌ Сначала отправьте хотя бы одну фотографию.")
+        return ADD_PHOTO
+    await asyncio.gather(*downloads.pop(update.effective_user.id, []), return_exceptions=True)
+    photos = [photo for photo in received if photo is not None]
+    if len(photos) < len(received):
+        await update.message.reply_text(f"⚠️ Не удалось загрузить фотографий: {len(received) - len(photos)}.")
+    context.user_data['photos'] = photos
+    if not photos:
+        await update.message.reply_text("📸 Отправьте фотографии ещё раз:")
+        return ADD_PHOTO
+    duplicates = {entry['id'] for photo in photos if photo['phash']
+                  for _, entry in db.find_similar(photo['phash'], DUPLICATE_DISTANCE)}
+    if duplicates:
+        ids = ', '.join(str(entry_id) for entry_id in sorted(duplicates)[:5])
+        await update.message.reply_text(
+            f"⚠️ Похожие фотографии уже есть в базе (ID: {ids}). "
+            "Продолжите добавление или отмените его командой /cancel.")
+    await update.message.reply_text(f"📸 Фотографий: {len(photos)}. "
+                                    "👤 Введите автора (через запятую, если несколько):")
     return ADD_AUTHORS
 
 
 async def add_authors(update: Update, context: CallbackContext) -> int:
     context.user_data['authors'] = [author.strip() for author in update.message.text.split(',')]
-    await update.message.reply_text("🏷️ Введите теги (через запятую):")
+    # Подсказываем теги, которые чаще всего встречаются у этих авторов
+    context.user_data['suggested_tags'] = db.suggest_tags(context.user_data['authors'], k=TAG_SUGGESTIONS)
+    context.user_data['chosen_tags'] = []
+    if context.user_data['suggested_tags']:
+        await update.message.reply_text(
+            "🏷️ Введите теги (через запятую) или выберите из предложенных:",
+            reply_markup=create_tag_suggestion_buttons(context.user_data['suggested_tags'], [])
+        )
+    else:
+        await update.message.reply_text("🏷️ Введите теги (через запятую):")
     return ADD_TAGS
 
 
+# Кнопки подсказанных тегов: выбранные отмечены ✅
+def create_tag_suggestion_buttons(suggested, chosen):
+    keyboard = [[InlineKeyboardButton(f"{'✅ ' if tag in chosen else ''}#{tag}", callback_data=f"suggesttag_{i}")]
+                for i, tag in enumerate(suggested)]
+    keyboard.append([InlineKeyboardButton("Готово ➡️", callback_data="suggesttag_done")])
+    return InlineKeyboardMarkup(keyboard)
+
+
+# Теги из подсказок и введённые вручную, без повторов
+def merge_tags(chosen, typed):
+    tags = []
+    for tag in chosen + typed:
+        if tag and tag.lower() not in {t.lower() for t in tags}:
+            tags.append(tag)
+    return tags
+
+
 async def add_tags(update: Update, context: CallbackContext) -> int:
-    context.user_data['tags'] = [tag.strip() for tag in update.message.text.split(',')]
+    typed = [tag.strip() for tag in update.message.text.split(',')]
+    context.user_data['tags'] = merge_tags(context.user_data.get('chosen_tags', []), typed)
     await update.message.reply_text("👥 Введите персонажей (через запятую):")
     return ADD_CHARACTERS
 
 
+# Нажатие на подсказанный тег: отмечаем/снимаем отметку или завершаем выбор
+async def add_tags_suggestion(update: Update, context: CallbackContext) -> int:
+    query = update.callback_query
+    suggested = context.user_data.get('suggested_tags', [])
+    chosen = context.user_data.setdefault('chosen_tags', [])
+    choice = query.data[len("suggesttag_"):]
+    if choice == "done":
+        if not chosen:
+            await query.answer("Выберите хотя бы один тег или введите теги вручную.")
+            return ADD_TAGS
+        await query.answer()
+        context.user_data['tags'] = merge_tags(chosen, [])
+        await query.edit_message_text(f"🏷️ Теги: {', '.join(context.user_data['tags'])}")
+        await query.message.reply_text("👥 Введите персонажей (через запятую):")
+        return ADD_CHARACTERS
+    await query.answer()
+    index = int(choice)
+    if index < len(suggested):
+        tag = suggested[index]
+        if tag in chosen:
+            chosen.remove(tag)
+        else:
+            chosen.append(tag)
+        await query.edit_message_reply_markup(reply_markup=create_tag_suggestion_buttons(suggested, chosen))
+    return ADD_TAGS
+
+
 async def add_characters(update: Update, context: CallbackContext) -> int:
+    if await session_expired(update, context, 'photos', 'authors', 'tags'):
+        return ConversationHandler.END
     context.user_data['characters'] = [character.strip() for character in update.message.text.split(',')]
-    db.add_entry(
-        context.user_data['file_path'],
-        context.user_data['authors'],
-        context.user_data['tags'],
-        context.user_data['characters']
-    )
-    # --- NEW: Copy to author folders and duplicate main folder ---
-    file_path = context.user_data['file_path']
-    authors = context.user_data['authors']
-    if authors:
-        for author in authors:
-            author_folder = os.path.join('photos_by_author', author)
-            os.makedirs(author_folder, exist_ok=True)
-            shutil.copy2(file_path, os.path.join(author_folder, os.path.basename(file_path)))
-    # Duplicate main folder
-    if os.path.exists('photos_backup'):
-        shutil.rmtree('photos_backup')
-    shutil.copytree('photos', 'photos_backup')
-    # --- END NEW ---
-    await update.message.reply_text("✅ Фотография добавлена!", parse_mode="HTML")
+    photos = context.user_data.pop('photos')
+    # Файлы загрузок, прерванных перезапуском после записи, в каталог не попадают
+    used = {photo['file_path'] for photo in photos}
+    for file_path in context.user_data.pop('new_files', []):
+        if file_path not in used:
+            io_executor.submit(remove_file, file_path)
+    # Одни и те же авторы, теги и персонажи для всех фотографий; вся пачка — одна запись каталога
+    entries = db.add_entries([
+        dict(photo,
+             authors=context.user_data['authors'],
+             tags=context.user_data['tags'],
+             characters=context.user_data['characters'])
+        for photo in photos
+    ])
+    # Папки по авторам обновляет author_view, резервную копию — фоновая задача (один проход на пачку)
+    backup_store.mark_dirty()
+    if len(entries) == 1:
+        await update.message.reply_text("✅ Фотография добавлена!", parse_mode="HTML")
+    else:
+        await update.message.reply_text(f"✅ Добавлено фотографий: {len(entries)}!", parse_mode="HTML")
     return ConversationHandler.END
 
 
@@ -206,7 +849,7 @@ async def update_entry(update: Update, context: CallbackContext) -> int:
 async def update_id(update: Update, context: CallbackContext) -> int:
     try:
         entry_id = int(update.message.text)
-        if not any(entry['id'] == entry_id for entry in db.data):
+        if db.get_entry(entry_id) is None:
             await update.message.reply_text("❌ Запись с таким ID не найдена. Введите другой ID:")
             return UPDATE_ID
         context.user_data['id'] = entry_id
@@ -245,6 +888,8 @@ async def update_tags_skip(update: Update, context: CallbackContext) -> int:
 
 
 async def update_characters(update: Update, context: CallbackContext) -> int:
+    if await session_expired(update, context, 'id'):
+        return ConversationHandler.END
     if update.message.text != "/skip":
         context.user_data['new_characters'] = [character.strip() for character in update.message.text.split(',')]
     db.update_entry(
@@ -258,6 +903,8 @@ async def update_characters(update: Update, context: CallbackContext) -> int:
 
 
 async def update_characters_skip(update: Update, context: CallbackContext) -> int:
+    if await session_expired(update, context, 'id'):
+        return ConversationHandler.END
     db.update_entry(
         context.user_data['id'],
         new_authors=context.user_data.get('new_authors'),
@@ -270,53 +917,96 @@ async def update_characters_skip(update: Update, context: CallbackContext) -> in
 
 # Команда /search_author
 async def search_author(update: Update, context: CallbackContext) -> int:
-    authors = db.get_all_authors()
-    if not authors:
+    random_authors = db.sample_authors(3)
+    if not random_authors:
         await update.message.reply_text("❌ В базе данных нет авторов.")
         return ConversationHandler.END
-    random_authors = random.sample(authors, min(3, len(authors)))
     text_lines = []
-    keyboard = []
-    for idx, author in enumerate(random_authors, 1):
-        entries = db.search_by_author(author)
-        tags = [tag for entry in entries for tag in entry['tags']]
-        tag_counts = Counter(tags)
-        top_tags = ', '.join([f"#{t}" for t, _ in tag_counts.most_common(3)])
-        line = f"{idx}. {author}"
+    for idx, stats in enumerate(random_authors, 1):
+        author = stats['author']
+        top_tags = ', '.join([f"#{t}" for t in stats['top_tags']])
+        line = f"{idx}. {author} ({stats['count']})"
         if top_tags:
             line += f" — {top_tags}"
         text_lines.append(line)
-        keyboard.append([InlineKeyboardButton(f"{author}", callback_data=f"authorselect_{author}")])
+    context.user_data['author_choices'] = [stats['author'] for stats in random_authors]
     text = "\n".join(text_lines)
     text += "\n\nВыберите автора, нажав на кнопку, или введите имя автора вручную:"
-    await update.message.reply_text(text)
+    await update.message.reply_text(text, reply_markup=create_author_buttons(context.user_data['author_choices']))
     return 0
 
 
+# Кнопки выбора автора: в callback_data только номер, имя может не влезть в 64 байта
+def create_author_buttons(authors, counts=None):
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(f"{author} ({counts[i]})" if counts else author, callback_data=f"authorselect_{i}")]
+        for i, author in enumerate(authors)
+    ])
+
+
 async def search_author_result(update: Update, context: CallbackContext) -> int:
     author = update.message.text
-    results = db.search_by_author(author)
-    if results:
-        context.user_data['search_results'] = results
-        context.user_data['search_index'] = 0
-        entry = results[0]
-        caption = (
-            f"<b>ID:</b> {entry['id']}\n"
-            f"<b>👤 Авторы:</b> {', '.join(entry['authors'])}\n"
-            f"<b>🏷️ Теги:</b> {', '.join(entry['tags'])}\n"
-            f"<b>👥 Персонажи:</b> {', '.join(entry['characters'])}"
-        )
-        try:
-            await update.message.reply_photo(
-                photo=open(entry['file_path'], 'rb'),
-                caption=caption,
-                parse_mode="HTML",
-                reply_markup=create_navigation_buttons(0, len(results), prefix='author')
-            )
-        except FileNotFoundError:
-            await update.message.reply_text(f"❌ Фотография с ID {entry['id']} не найдена на сервере.")
-    else:
+    cursor = Cursor('author', author, db.find_ids('author', author))
+    if cursor.ids:
+        await start_browsing(update, context, cursor)
+        return ConversationHandler.END
+    # Возможно, опечатка: предлагаем похожих авторов и ждём выбора или нового ввода
+    suggestions = db.suggest_authors(author, AUTHOR_SUGGESTIONS)
+    if not suggestions:
         await update.message.reply_text(f"❌ Записей с автором '{author}' не найдено.")
+        return ConversationHandler.END
+    context.user_data['author_choices'] = [name for name, _ in suggestions]
+    await update.message.reply_text(
+        f"❌ Записей с автором '{author}' не найдено. Возможно, вы имели в виду:",
+        reply_markup=create_author_buttons(context.user_data['author_choices'], [count for _, count in suggestions])
+    )
+    return 0
+
+
+# Нажатие на кнопку автора из /search_author или из подсказок
+async def search_author_select(update: Update, context: CallbackContext) -> int:
+    query = update.callback_query
+    await query.answer()
+    choices = context.user_data.get('author_choices', [])
+    index = int(query.data[len("authorselect_"):])
+    if index >= len(choices):
+        await query.edit_message_text("❌ Список авторов устарел, выполните /search_author ещё раз.")
+        return ConversationHandler.END
+    author = choices[index]
+    await query.edit_message_reply_markup(reply_markup=None)
+    cursor = Cursor('author', author, db.find_ids('author', author))
+    if cursor.ids:
+        await start_browsing(update, context, cursor)
+    else:
+        await query.message.reply_text(f"❌ Записей с автором '{author}' не найдено.")
+    return ConversationHandler.END
+
+
+# Команда /search <запрос>; без запроса — спрашиваем его следующим сообщением
+async def search_query(update: Update, context: CallbackContext) -> int:
+    if context.args:
+        return await run_search_query(update, context, ' '.join(context.args))
+    await update.message.reply_text(
+        "🔍 Введите запрос, например: author:Автор tag:тег -tag:исключить character:\"Имя Фамилия\" OR tag:другой\n"
+        "Условия подряд — И, OR — ИЛИ, минус — НЕ, скобки группируют; слово без поля ищется во всех полях.")
+    return "search_query"
+
+
+async def search_query_result(update: Update, context: CallbackContext) -> int:
+    return await run_search_query(update, context, update.message.text)
+
+
+async def run_search_query(update: Update, context: CallbackContext, text) -> int:
+    try:
+        ids = query_planner.search(text)
+    except QueryError as e:
+        await update.message.reply_text(f"❌ {e}")
+        return ConversationHandler.END
+    if ids:
+        await update.message.reply_text(f"🔍 Найдено записей: {len(ids)}")
+        await start_browsing(update, context, Cursor('query', text, ids))
+    else:
+        await update.message.reply_text("❌ По запросу ничего не найдено.")
     return ConversationHandler.END
 
 
@@ -328,62 +1018,13 @@ async def search_tag(update: Update, context: CallbackContext) -> None:
 
 async def search_tag_result(update: Update, context: CallbackContext) -> int:
     tag = update.message.text
-    results = db.search_by_tag(tag)
-    if results:
-        context.user_data['search_results'] = results
-        context.user_data['search_index'] = 0
-        entry = results[0]
-        caption = (
-            f"<b>ID:</b> {entry['id']}\n"
-            f"<b>👤 Авторы:</b> {', '.join(entry['authors'])}\n"
-            f"<b>🏷️ Теги:</b> {', '.join(entry['tags'])}\n"
-            f"<b>👥 Персонажи:</b> {', '.join(entry['characters'])}"
-        )
-        try:
-            await update.message.reply_photo(
-                photo=open(entry['file_path'], 'rb'),
-                caption=caption,
-                parse_mode="HTML",
-                reply_markup=create_navigation_buttons(0, len(results), prefix='tag')
-            )
-        except FileNotFoundError:
-            await update.message.reply_text(f"❌ Фотография с ID {entry['id']} не найдена на сервере.")
+    cursor = Cursor('tag', tag, db.find_ids('tag', tag))
+    if cursor.ids:
+        await start_browsing(update, context, cursor)
     else:
         await update.message.reply_text(f"❌ Записей с тегом '{tag}' не найдено.")
 
 
-async def tag_button_handler(update: Update, context: CallbackContext) -> None:
-    query = update.callback_query
-    await query.answer()
-    results = context.user_data.get('search_results', [])
-    if not results:
-        await query.edit_message_text("❌ Ошибка: список записей недоступен.")
-        return
-    current_index = context.user_data.get('search_index', 0)
-    callback_data = query.data
-    if callback_data.startswith("tagprev_"):
-        current_index = max(0, current_index - 1)
-    elif callback_data.startswith("tagnext_"):
-        current_index = min(len(results) - 1, current_index + 1)
-    context.user_data['search_index'] = current_index
-    entry = results[current_index]
-    caption = (
-        f"<b>ID:</b> {entry['id']}\n"
-        f"<b>👤 Авторы:</b> {', '.join(entry['authors'])}\n"
-        f"<b>🏷️ Теги:</b> {', '.join(entry['tags'])}\n"
-        f"<b>👥 Персонажи:</b> {', '.join(entry['characters'])}"
-    )
-    try:
-        await query.edit_message_media(
-            media=InputMediaPhoto(open(entry['file_path'], 'rb'), caption=caption, parse_mode="HTML"),
-            reply_markup=create_navigation_buttons(current_index, len(results), prefix='tag')
-        )
-    except FileNotFoundError:
-        await query.edit_message_text(f"❌ Фотография с ID {entry['id']} не найдена на сервере.")
-    except Exception as e:
-        await query.edit_message_text(f"❌ Произошла ошибка при обновлении фотографии: {str(e)}")
-
-
 # Команда /search_character
 async def search_character(update: Update, context: CallbackContext) -> None:
     await update.message.reply_text("🔍 Введите персонажа для поиска:")
@@ -392,172 +1033,354 @@ async def search_character(update: Update, context: CallbackContext) -> None:
 
 async def search_character_result(update: Update, context: CallbackContext) -> int:
     character = update.message.text
-    results = db.search_by_character(character)
-    if results:
-        context.user_data['search_results'] = results
-        context.user_data['search_index'] = 0
-        entry = results[0]
-        caption = (
-            f"<b>ID:</b> {entry['id']}\n"
-            f"<b>👤 Авторы:</b> {', '.join(entry['authors'])}\n"
-            f"<b>🏷️ Теги:</b> {', '.join(entry['tags'])}\n"
-            f"<b>👥 Персонажи:</b> {', '.join(entry['characters'])}"
-        )
-        try:
-            await update.message.reply_photo(
-                photo=open(entry['file_path'], 'rb'),
-                caption=caption,
-                parse_mode="HTML",
-                reply_markup=create_navigation_buttons(0, len(results), prefix='character')
-            )
-        except FileNotFoundError:
-            await update.message.reply_text(f"❌ Фотография с ID {entry['id']} не найдена на сервере.")
+    cursor = Cursor('character', character, db.find_ids('character', character))
+    if cursor.ids:
+        await start_browsing(update, context, cursor)
     else:
         await update.message.reply_text(f"❌ Записей с персонажем '{character}' не найдено.")
 
 
-async def character_button_handler(update: Update, context: CallbackContext) -> None:
-    query = update.callback_query
-    await query.answer()
-    results = context.user_data.get('search_results', [])
-    if not results:
-        await query.edit_message_text("❌ Ошибка: список записей недоступен.")
-        return
-    current_index = context.user_data.get('search_index', 0)
-    callback_data = query.data
-    if callback_data.startswith("characterprev_"):
-        current_index = max(0, current_index - 1)
-    elif callback_data.startswith("characternext_"):
-        current_index = min(len(results) - 1, current_index + 1)
-    context.user_data['search_index'] = current_index
-    entry = results[current_index]
-    caption = (
-        f"<b>ID:</b> {entry['id']}\n"
-        f"<b>👤 Авторы:</b> {', '.join(entry['authors'])}\n"
-        f"<b>🏷️ Теги:</b> {', '.join(entry['tags'])}\n"
-        f"<b>👥 Персонажи:</b> {', '.join(entry['characters'])}"
-    )
-    try:
-        await query.edit_message_media(
-            media=InputMediaPhoto(open(entry['file_path'], 'rb'), caption=caption, parse_mode="HTML"),
-            reply_markup=create_navigation_buttons(current_index, len(results), prefix='character')
-        )
-    except FileNotFoundError:
-        await query.edit_message_text(f"❌ Фотография с ID {entry['id']} не найдена на сервере.")
-    except Exception as e:
-        await query.edit_message_text(f"❌ Произошла ошибка при обновлении фотографии: {str(e)}")
+# ID результатов inline-запроса, новые сначала (пустой запрос — весь каталог), и текст ошибки.
+# Повторный ввод того же запроса в течение INLINE_CACHE_TTL берётся из кэша, не из базы
+def inline_result_ids(text):
+    key = text.lower()  # Поиск не зависит от регистра
+    cached = inline_results.get(key)
+    if cached is None:
+        try:
+            cached = (array('q', reversed(query_planner.search(text) if text else db.all_ids())), None)
+        except QueryError as e:
+            cached = (array('q'), str(e))
+        inline_results.put(key, cached)
+        metrics.inc('inline_cache_total', result='miss')
+    else:
+        metrics.inc('inline_cache_total', result='hit')
+    return cached
+
+
+# Страница inline-ответа с offset: (результаты, next_offset, ошибка). Показываются только записи
+# с file_id — в inline-ответе нельзя загрузить файл; записи без него пропускаются кусками по ходу
+def build_inline_answer(text, offset):
+    ids, error = inline_result_ids(text)
+    entries = []
+    position = offset
+    while len(entries) < INLINE_PAGE_SIZE and position < len(ids):
+        chunk = ids[position:position + INLINE_PAGE_SIZE * 2]
+        found = [entry for entry in db.get_entries_by_ids(chunk) if entry.get('file_id')]
+        needed = INLINE_PAGE_SIZE - len(entries)
+        if len(found) > needed:
+            found = found[:needed]
+            position += chunk.index(found[-1]['id']) + 1
+        else:
+            position += len(chunk)
+        entries += found
+    results = [InlineQueryResultCachedPhoto(id=str(entry['id']), photo_file_id=entry['file_id'],
+                                            caption=entry_caption(entry), parse_mode="HTML")
+               for entry in entries]
+    return results, str(position) if position < len(ids) else '', error
+
+
+# Inline-режим: @бот запрос в любом чате, тот же язык запросов, что у /search
+async def inline_query(update: Update, context: CallbackContext) -> None:
+    query = update.inline_query
+    text = ' '.join(query.query.split())
+    offset = int(query.offset) if query.offset.isdigit() else 0
+    results, next_offset, error = build_inline_answer(text, offset)
+    button = None
+    if error and not offset:
+        # Кнопка над результатами открывает личный чат с ботом
+        button = InlineQueryResultsButton(text=f"❌ {error}", start_parameter='help')
+    await query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=False, next_offset=next_offset,
+                       button=button)
 
 
 # Команда /display
 async def display_entries(update: Update, context: CallbackContext) -> None:
-    entries = db.get_entries()
-    if not entries:
+    if not db.count():
         await update.message.reply_text("❌ В базе данных нет записей.")
         return
+    await start_browsing(update, context, Cursor(''))
 
-    # Отправляем первое фото с кнопками
-    entry = entries[0]
-    caption = (
-        f"<b>ID:</b> {entry['id']}\n"
-        f"<b>👤 Авторы:</b> {', '.join(entry['authors'])}\n"
-        f"<b>🏷️ Теги:</b> {', '.join(entry['tags'])}\n"
-        f"<b>👥 Персонажи:</b> {', '.join(entry['characters'])}"
-    )
+
+# Курсор хранится в общем LRU по пользователю и виду просмотра (префиксу кнопок)
+def cursor_key(update: Update, kind):
+    return update.effective_user.id, kind
+
+
+# Отправляем первое фото курсора с кнопками
+async def start_browsing(update: Update, context: CallbackContext, cursor) -> None:
+    cursors.put(cursor_key(update, cursor.kind), cursor)
+    page_size = context.user_data.get('page_size', 1)
+    if page_size > 1:
+        await send_gallery_page(context.bot, update.effective_chat.id, cursor, 0, page_size)
+        return
+    entry = cursor.entry(db, 0)
+    # Просмотр начинается и из сообщения, и из нажатия на кнопку
+    message = update.effective_message
     try:
-        context.user_data['current_index'] = 0  # Сохраняем текущий индекс
-        context.user_data['display_entries'] = entries  # Сохраняем список записей
-        await update.message.reply_photo(
-            photo=open(entry['file_path'], 'rb'),
-            caption=caption,
-            parse_mode="HTML",
-            reply_markup=create_navigation_buttons(0, len(entries))
-        )
+        await reply_entry_photo(message, entry,
+                                create_navigation_buttons(0, cursor.total(db), prefix=cursor.kind))
     except FileNotFoundError:
-        await update.message.reply_text(f"❌ Фотография с ID {entry['id']} не найдена на сервере.")
+        await message.reply_text(f"❌ Фотография с ID {entry['id']} не найдена на сервере.")
     except Exception as e:
-        await update.message.reply_text(f"❌ Произошла ошибка при отображении фотографии: {str(e)}")
+        await message.reply_text(f"❌ Произошла ошибка при отображении фотографии: {str(e)}")
 
 
-# Обработчик кнопок пролистывания
-async def button_handler(update: Update, context: CallbackContext) -> None:
+# Обработчик кнопок пролистывания: prev_/next_, authorprev_/authornext_ и т.д.
+async def navigation_handler(update: Update, context: CallbackContext) -> None:
     query = update.callback_query
     await query.answer()  # Подтверждаем получение callback
 
-    entries = context.user_data.get('display_entries', [])
-    if not entries:
+    kind, direction, index = NAVIGATION_PATTERN.match(query.data).groups()
+    cursor = await cursors.get(cursor_key(update, kind))
+    total = cursor.total(db) if cursor else 0
+    if not total:
         await query.edit_message_text("❌ Ошибка: список записей недоступен.")
         return
 
-    current_index = context.user_data.get('current_index', 0)
-    callback_data = query.data
-
-    # Определяем новый индекс
-    try:
-        if callback_data.startswith("prev_"):
-            current_index = max(0, current_index - 1)
-        elif callback_data.startswith("next_"):
-            current_index = min(len(entries) - 1, current_index + 1)
-    except ValueError:
-        await query.edit_message_text("❌ Ошибка: неверные данные кнопки.")
-        return
-
-    context.user_data['current_index'] = current_index
-    entry = entries[current_index]
-
-    caption = (
-        f"<b>ID:</b> {entry['id']}\n"
-        f"<b>👤 Авторы:</b> {', '.join(entry['authors'])}\n"
-        f"<b>🏷️ Теги:</b> {', '.join(entry['tags'])}\n"
-        f"<b>👥 Персонажи:</b> {', '.join(entry['characters'])}"
-    )
+    # Индекс берём из кнопки, чтобы листать корректно в любом из отправленных сообщений
+    current_index = int(index)
+    if direction == 'prev':
+        current_index = max(0, current_index - 1)
+    else:
+        current_index = min(total - 1, current_index + 1)
+    cursor.index = current_index
+    entry = cursor.entry(db, current_index)
 
     try:
         # Обновляем сообщение с новым фото и кнопками
-        await query.edit_message_media(
-            media=InputMediaPhoto(open(entry['file_path'], 'rb'), caption=caption, parse_mode="HTML"),
-            reply_markup=create_navigation_buttons(current_index, len(entries))
-        )
+        await edit_entry_photo(query, entry, create_navigation_buttons(current_index, total, prefix=kind))
     except FileNotFoundError:
         await query.edit_message_text(f"❌ Фотография с ID {entry['id']} не найдена на сервере.")
     except Exception as e:
         await query.edit_message_text(f"❌ Произошла ошибка при обновлении фотографии: {str(e)}")
 
 
-# Обработчик кнопок пролистывания по авторам
-async def author_button_handler(update: Update, context: CallbackContext) -> None:
+# Команда /gallery N — просмотр по N фотографий на странице (1 — по одной)
+async def gallery_command(update: Update, context: CallbackContext) -> None:
+    try:
+        page_size = int(context.args[0])
+    except (IndexError, ValueError):
+        current = context.user_data.get('page_size', 1)
+        await update.message.reply_text(
+            f"Сейчас на странице: {current}. Используйте /gallery N, где N — "
+            f"{', '.join(map(str, GALLERY_PAGE_SIZES))} или 1 для просмотра по одной фотографии."
+        )
+        return
+    if page_size != 1 and page_size not in GALLERY_PAGE_SIZES:
+        await update.message.reply_text(
+            f"❌ Допустимые размеры страницы: 1, {', '.join(map(str, GALLERY_PAGE_SIZES))}.")
+        return
+    context.user_data['page_size'] = page_size
+    await update.message.reply_text(f"✅ Фотографий на странице: {page_size}")
+
+
+# Фотография для альбома: file_id или содержимое файла (None, если файла нет)
+def read_gallery_photo(entry, use_file_id=True):
+    if use_file_id and entry.get('file_id'):
+        metrics.inc('file_id_cache_total', result='hit')
+        return entry['file_id']
+    metrics.inc('file_id_cache_total', result='miss' if use_file_id else 'stale')
+    try:
+        return variant_cache.read(entry['file_path'], GALLERY_VARIANT)
+    except FileNotFoundError:
+        return None
+
+
+# Читаем файлы записей в потоках, не блокируя цикл событий; записи без файла пропускаются
+async def read_gallery_photos(entries, use_file_id=True):
+    photos = await asyncio.gather(*(io_executor.run(read_gallery_photo, entry, use_file_id)
+                                    for entry in entries))
+    return [(entry, photo) for entry, photo in zip(entries, photos) if photo is not None]
+
+
+async def load_gallery_page(cursor, page, page_size, use_file_id=True):
+    start_index = page * page_size
+    entries = [cursor.entry(db, index)
+               for index in range(start_index, min(start_index + page_size, cursor.total(db)))]
+    return await read_gallery_photos(entries, use_file_id)
+
+
+# Готовим следующую страницу, пока пользователь смотрит текущую
+def prefetch_gallery_page(cursor, page, page_size):
+    if page * page_size >= cursor.total(db):
+        cursor.prefetch = None
+        return
+    cursor.prefetch = (page, page_size, asyncio.create_task(load_gallery_page(cursor, page, page_size)))
+
+
+async def take_gallery_page(cursor, page, page_size):
+    if cursor.prefetch is not None:
+        prefetched_page, prefetched_size, task = cursor.prefetch
+        cursor.prefetch = None
+        if (prefetched_page, prefetched_size) == (page, page_size):
+            try:
+                items = await task
+                metrics.inc('gallery_prefetch_total', result='hit')
+                return items
+            except Exception:
+                pass
+        else:
+            task.cancel()
+    metrics.inc('gallery_prefetch_total', result='miss')
+    return await load_gallery_page(cursor, page, page_size)
+
+
+# header добавляется в начало подписи первой фотографии
+async def send_gallery_media(bot, chat_id, items, header=''):
+    captions = [(header if i == 0 else '') + entry_caption(entry) for i, (entry, _) in enumerate(items)]
+    if len(items) == 1:
+        return [await bot.send_photo(chat_id, items[0][1], caption=captions[0], parse_mode="HTML")]
+    media = [InputMediaPhoto(photo, caption=caption, parse_mode="HTML")
+             for (_, photo), caption in zip(items, captions)]
+    return list(await bot.send_media_group(chat_id, media))
+
+
+# Страница галереи: один альбом (send_media_group) и сообщение с кнопками и счётчиком страниц
+async def send_gallery_page(bot, chat_id, cursor, page, page_size) -> None:
+    items = await take_gallery_page(cursor, page, page_size)
+    if not items:
+        await bot.send_message(chat_id, "❌ Фотографии этой страницы не найдены на сервере.")
+        return
+    try:
+        messages = await send_gallery_media(bot, chat_id, items)
+    except BadRequest:
+        # Какой-то из file_id устарел — загружаем страницу с диска
+        items = await load_gallery_page(cursor, page, page_size, use_file_id=False)
+        messages = await send_gallery_media(bot, chat_id, items)
+    for (entry, _), message in zip(items, messages):
+        remember_file_id(entry, message)
+    navigation = await bot.send_message(
+        chat_id,
+        f"📄 Страница {page + 1}",
+        reply_markup=create_navigation_buttons(page, cursor.total(db), prefix='gallery' + cursor.kind,
+                                               page_size=page_size)
+    )
+    cursor.index = page
+    cursor.messages = [message.message_id for message in messages] + [navigation.message_id]
+    prefetch_gallery_page(cursor, page + 1, page_size)
+
+
+# Уведомление подписчику: новые фотографии одним альбомом. Ошибки Telegram обрабатывает Notifier
+async def deliver_notification(bot, chat_id, batch) -> None:
+    entries = [entry for entry in (db.get_entry(entry_id) for entry_id, _ in batch) if entry is not None]
+    authors = sorted({author for _, author in batch}, key=lambda x: x.lower())
+    header = f"🔔 <b>Новые фотографии: {', '.join(authors)}</b>\n\n"
+    items = await read_gallery_photos(entries)
+    if not items:
+        return
+    try:
+        messages = await send_gallery_media(bot, chat_id, items, header)
+    except BadRequest:
+        # Устаревший file_id — загружаем с диска
+        items = await read_gallery_photos(entries, use_file_id=False)
+        messages = await send_gallery_media(bot, chat_id, items, header)
+    for (entry, _), message in zip(items, messages):
+        remember_file_id(entry, message)
+
+
+# Подписки хранятся отдельно от каталога; каждая новая запись ставится в очередь рассылки её подписчикам.
+# Хранилище открывается вместе с приложением (build_application), а не при импорте main
+subscriptions = None
+notifier = None
+
+
+def open_subscriptions() -> None:
+    global subscriptions, notifier
+    subscriptions = SubscriptionStore(SUBSCRIPTIONS_PATH)
+    notifier = Notifier(subscriptions, deliver_notification, io_executor, batch_delay=NOTIFY_BATCH_DELAY,
+                        global_rate=NOTIFY_GLOBAL_RATE, chat_interval=NOTIFY_CHAT_INTERVAL, workers=NOTIFY_WORKERS)
+
+
+db.add_listener(lambda op, entry, previous: notifier is not None
+                and io_executor.submit(notifier.on_change, op, copy_entry(entry), previous))
+
+
+# Написание автора, как в каталоге, или None, если такого автора нет
+def catalog_author(name):
+    ids = db.find_ids('author', name)
+    if not ids:
+        return None
+    return next(author for author in db.get_entry(ids[0])['authors'] if author.lower() == name.lower())
+
+
+def subscriptions_text(authors):
+    if not authors:
+        return "Подписок пока нет."
+    return "🔔 Ваши подписки:\n" + "\n".join(f"• {author}" for author in authors)
+
+
+# Команда /subscribe <автор> — присылать новые фотографии автора в этот чат
+async def subscribe_command(update: Update, context: CallbackContext) -> None:
+    chat_id = update.effective_chat.id
+    name = ' '.join(context.args).strip()
+    if not name:
+        authors = await io_executor.run(subscriptions.authors, chat_id)
+        await update.message.reply_text(
+            subscriptions_text(authors) + "\n\nПодписаться: /subscribe <автор>\nОтписаться: /unsubscribe <автор>")
+        return
+    author = catalog_author(name)
+    if author is None:
+        text = f"❌ Автор '{name}' не найден."
+        suggestions = db.suggest_authors(name, AUTHOR_SUGGESTIONS)
+        if suggestions:
+            text += " Возможно, вы имели в виду: " + ", ".join(suggested for suggested, _ in suggestions)
+        await update.message.reply_text(text)
+        return
+    if await io_executor.run(subscriptions.subscribe, chat_id, author):
+        await update.message.reply_text(f"✅ Вы подписались на {author}. Новые фотографии придут в этот чат.")
+    else:
+        await update.message.reply_text(f"ℹ️ Вы уже подписаны на {author}.")
+
+
+# Команда /unsubscribe <автор>
+async def unsubscribe_command(update: Update, context: CallbackContext) -> None:
+    chat_id = update.effective_chat.id
+    name = ' '.join(context.args).strip()
+    if not name:
+        authors = await io_executor.run(subscriptions.authors, chat_id)
+        await update.message.reply_text(subscriptions_text(authors) + "\n\nОтписаться: /unsubscribe <автор>")
+        return
+    if await io_executor.run(subscriptions.unsubscribe, chat_id, name):
+        await update.message.reply_text(f"✅ Подписка на {name} отменена.")
+    else:
+        await update.message.reply_text(f"❌ Подписки на {name} нет.")
+
+
+# Команда /subscriptions — список подписок чата
+async def subscriptions_command(update: Update, context: CallbackContext) -> None:
+    authors = await io_executor.run(subscriptions.authors, update.effective_chat.id)
+    await update.message.reply_text(subscriptions_text(authors))
+
+
+# Обработчик кнопок галереи: удаляем предыдущую страницу и отправляем новую
+async def gallery_navigation_handler(update: Update, context: CallbackContext) -> None:
     query = update.callback_query
     await query.answer()
-    results = context.user_data.get('search_results', [])
-    if not results:
+
+    kind, direction, page = GALLERY_PATTERN.match(query.data).groups()
+    cursor = await cursors.get(cursor_key(update, kind))
+    page_size = context.user_data.get('page_size', 1)
+    if cursor is None or not cursor.total(db) or page_size < 2:
         await query.edit_message_text("❌ Ошибка: список записей недоступен.")
         return
-    current_index = context.user_data.get('search_index', 0)
-    callback_data = query.data
-    if callback_data.startswith("authorprev_"):
-        current_index = max(0, current_index - 1)
-    elif callback_data.startswith("authornext_"):
-        current_index = min(len(results) - 1, current_index + 1)
-    context.user_data['search_index'] = current_index
-    entry = results[current_index]
-    caption = (
-        f"<b>ID:</b> {entry['id']}\n"
-        f"<b>👤 Авторы:</b> {', '.join(entry['authors'])}\n"
-        f"<b>🏷️ Теги:</b> {', '.join(entry['tags'])}\n"
-        f"<b>👥 Персонажи:</b> {', '.join(entry['characters'])}"
-    )
-    try:
-        await query.edit_message_media(
-            media=InputMediaPhoto(open(entry['file_path'], 'rb'), caption=caption, parse_mode="HTML"),
-            reply_markup=create_navigation_buttons(current_index, len(results), prefix='author')
-        )
-    except FileNotFoundError:
-        await query.edit_message_text(f"❌ Фотография с ID {entry['id']} не найдена на сервере.")
-    except Exception as e:
-        await query.edit_message_text(f"❌ Произошла ошибка при обновлении фотографии: {str(e)}")
+
+    pages = (cursor.total(db) + page_size - 1) // page_size
+    page = max(0, int(page) - 1) if direction == 'prev' else min(pages - 1, int(page) + 1)
+    chat_id = update.effective_chat.id
+    old_messages = set(cursor.messages or ()) | {query.message.message_id}
+    await asyncio.gather(*(context.bot.delete_message(chat_id, message_id) for message_id in old_messages),
+                         return_exceptions=True)
+    await send_gallery_page(context.bot, chat_id, cursor, page, page_size)
+
+
+# Счётчик страниц — кнопка без действия
+async def noop_handler(update: Update, context: CallbackContext) -> None:
+    await update.callback_query.answer()
 
 
 # Команда /cancel
 async def cancel(update: Update, context: CallbackContext) -> int:
+    discard_downloads(update.effective_user.id, context.user_data)
     await update.message.reply_text(
         "Операция отменена.",
         reply_markup=create_command_menu()
@@ -569,35 +1392,127 @@ async def cancel(update: Update, context: CallbackContext) -> int:
 async def help_command(update: Update, context: CallbackContext) -> None:
     await update.message.reply_text(
         "🌟 <b>Доступные команды:</b>\n\n"
-        "/add - Добавить новую фотографию\n"
+        "/add - Добавить фотографии (одну, несколько или альбом)\n"
         "/update - Обновить запись\n"
         "/search_author - Найти по автору\n"
         "/search_tag - Найти по тегу\n"
         "/search_character - Найти по персонажу\n"
+        "/search - Поиск по запросу: author:X tag:Y -tag:Z OR ...\n"
         "/display - Показать все записи\n"
+        "/gallery - Несколько фотографий на странице\n"
+        "/subscribe - Подписаться на новые фотографии автора\n"
+        "/subscriptions - Мои подписки\n"
+        f"@{context.bot.username} запрос - Поиск фотографий в любом чате\n"
         "/help - Показать список команд",
         parse_mode="HTML",
         reply_markup=create_command_menu()
     )
 
 
-def main() -> None:
-    # Создаем директорию для фото
-    os.makedirs('photos', exist_ok=True)
+# Команда /stats — задержки обработчиков и счётчики, только для ADMIN_IDS
+async def stats_command(update: Update, context: CallbackContext) -> None:
+    if update.effective_user is None or update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("❌ Команда доступна только администраторам.")
+        return
+    pending = await io_executor.run(subscriptions.pending_count)
+    await update.message.reply_text(
+        "📊 " + metrics.summary() +
+        f"\nУведомления: отправлено фото {notifier.sent}, повторов {notifier.retries}, "
+        f"не доставлено {notifier.dropped}, в очереди {pending}"
+    )
 
-    # Создаем приложение с токеном
-    application = Application.builder().token(TOKEN).build()
+
+# Фоновая задача резервного копирования, выполняется вне цикла событий
+async def backup_loop() -> None:
+    while True:
+        await asyncio.sleep(BACKUP_INTERVAL)
+        if backup_store.dirty:
+            # Ошибка одного прохода (нет места, нет прав) не должна останавливать копирование насовсем
+            try:
+                await io_executor.run(backup_store.run)
+            except Exception:
+                logger.exception("Резервное копирование не удалось, повтор через %s с", BACKUP_INTERVAL)
+
+
+# Состояния сохраняемых диалогов в памяти обработчиков: имя -> {ключ: состояние}. Открытого способа
+# забыть ключ у ConversationHandler в PTB нет, поэтому словарь берётся через getattr: если его переименуют,
+# вытеснение просто перестанет освобождать эту память, а диалоги из sessions.db всё равно удалятся
+def conversation_states(application: Application) -> dict:
+    states = {}
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if isinstance(handler, ConversationHandler) and handler.persistent:
+                conversations = getattr(handler, '_conversations', None)
+                if conversations is not None:
+                    states[handler.name] = conversations
+    return states
+
+
+# Вытеснение простаивающих сессий: user_data и диалоги удаляются из памяти и из sessions.db
+def evict_sessions(application: Application, user_ids) -> None:
+    states = conversation_states(application)
+    for user_id in user_ids:
+        if user_id in application.user_data:
+            discard_downloads(user_id, application.user_data[user_id])
+        application.drop_user_data(user_id)
+        for name, key in sessions.drop_conversations(user_id):
+            if name in states:
+                states[name].pop(key, None)
+
+
+async def session_loop(application: Application) -> None:
+    while True:
+        await asyncio.sleep(SESSION_SWEEP_INTERVAL)
+        evict_sessions(application, sessions.idle_users(SESSION_TTL, SESSION_MAX_USERS))
+        await io_executor.run(sessions.sweep_cursors, CURSOR_TTL, CURSOR_CACHE_SIZE)
+
+
+async def post_init(application: Application) -> None:
+    catalog_writer.start()
+    application.create_task(backup_loop())
+    application.create_task(session_loop(application))
+    notifier.start(application.bot)
+    if METRICS_PORT is not None:
+        metrics.start_http_server(METRICS_HOST, METRICS_PORT)
+
+
+async def post_shutdown(application: Application) -> None:
+    await notifier.stop()
+    subscriptions.close()
+    await catalog_writer.stop()
+    variant_cache.close()
+    metrics.stop_http_server()
+
+
+# Приложение со всеми обработчиками; base_url позволяет подставить свой сервер Bot API (нагрузочный тест)
+def build_application(token=TOKEN, base_url=None) -> Application:
+    global sessions
+    sessions = SessionPersistence(SESSIONS_PATH, io_executor, update_interval=SESSION_FLUSH_INTERVAL)
+    cursors.store = sessions
+    open_subscriptions()
+    builder = (Application.builder().token(token)
+               .request(InstrumentedRequest(metrics, connection_pool_size=256))
+               .concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))
+               .persistence(sessions)
+               .post_init(post_init).post_shutdown(post_shutdown))
+    if base_url is not None:
+        builder = builder.base_url(base_url)
+    application = builder.build()
 
     # Обработчик команды /start
     application.add_handler(CommandHandler("start", start))
 
     # Обработчик команды /add
     add_conversation_handler = ConversationHandler(
+        name='add',
+        persistent=True,
         entry_points=[CommandHandler('add', add_entry)],
         states={
-            ADD_PHOTO: [MessageHandler(filters.PHOTO, add_photo)],
+            ADD_PHOTO: [MessageHandler(filters.PHOTO, add_photo),
+                        CommandHandler('done', add_photos_done)],
             ADD_AUTHORS: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_authors)],
-            ADD_TAGS: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_tags)],
+            ADD_TAGS: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_tags),
+                       CallbackQueryHandler(add_tags_suggestion, pattern="^suggesttag_")],
             ADD_CHARACTERS: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_characters)],
         },
         fallbacks=[CommandHandler('cancel', cancel)],
@@ -606,6 +1521,8 @@ def main() -> None:
 
     # Обработчик команды /update
     update_conversation_handler = ConversationHandler(
+        name='update',
+        persistent=True,
         entry_points=[CommandHandler('update', update_entry)],
         states={
             UPDATE_ID: [MessageHandler(filters.TEXT & ~filters.COMMAND, update_id)],
@@ -622,9 +1539,12 @@ def main() -> None:
 
     # Обработчик команды /search_author
     search_author_conversation_handler = ConversationHandler(
+        name='search_author',
+        persistent=True,
         entry_points=[CommandHandler('search_author', search_author)],
         states={
-            0: [MessageHandler(filters.TEXT & ~filters.COMMAND, search_author_result)],
+            0: [MessageHandler(filters.TEXT & ~filters.COMMAND, search_author_result),
+                CallbackQueryHandler(search_author_select, pattern="^authorselect_")],
         },
         fallbacks=[CommandHandler('cancel', cancel)],
     )
@@ -632,6 +1552,8 @@ def main() -> None:
 
     # Обработчик команды /search_tag
     search_tag_conversation_handler = ConversationHandler(
+        name='search_tag',
+        persistent=True,
         entry_points=[CommandHandler('search_tag', search_tag)],
         states={
             "search_tag": [MessageHandler(filters.TEXT & ~filters.COMMAND, search_tag_result)],
@@ -642,6 +1564,8 @@ def main() -> None:
 
     # Обработчик команды /search_character
     search_character_conversation_handler = ConversationHandler(
+        name='search_character',
+        persistent=True,
         entry_points=[CommandHandler('search_character', search_character)],
         states={
             "search_character": [MessageHandler(filters.TEXT & ~filters.COMMAND, search_character_result)],
@@ -650,28 +1574,306 @@ def main() -> None:
     )
     application.add_handler(search_character_conversation_handler)
 
+    # Обработчик команды /search
+    search_query_conversation_handler = ConversationHandler(
+        name='search',
+        persistent=True,
+        entry_points=[CommandHandler('search', search_query)],
+        states={
+            "search_query": [MessageHandler(filters.TEXT & ~filters.COMMAND, search_query_result)],
+        },
+        fallbacks=[CommandHandler('cancel', cancel)],
+    )
+    application.add_handler(search_query_conversation_handler)
+
     # Обработчик команды /display
     application.add_handler(CommandHandler("display", display_entries))
 
-    # Обработчик кнопок пролистывания
-    application.add_handler(CallbackQueryHandler(button_handler, pattern="^(prev|next)_"))
+    # Обработчик кнопок пролистывания (весь каталог, авторы, теги, персонажи)
+    application.add_handler(CallbackQueryHandler(navigation_handler, pattern=NAVIGATION_PATTERN))
 
-    # Обработчик кнопок пролистывания по авторам
-    application.add_handler(CallbackQueryHandler(author_button_handler, pattern="^author(prev|next)_"))
+    # Галерея: команда /gallery и кнопки страниц
+    application.add_handler(CommandHandler("gallery", gallery_command))
+    application.add_handler(CallbackQueryHandler(gallery_navigation_handler, pattern=GALLERY_PATTERN))
+    application.add_handler(CallbackQueryHandler(noop_handler, pattern="^noop$"))
 
-    # Обработчик кнопок пролистывания по тегам
-    application.add_handler(CallbackQueryHandler(tag_button_handler, pattern="^tag(prev|next)_"))
+    # Подписки на авторов
+    application.add_handler(CommandHandler("subscribe", subscribe_command))
+    application.add_handler(CommandHandler("unsubscribe", unsubscribe_command))
+    application.add_handler(CommandHandler("subscriptions", subscriptions_command))
 
-    # Обработчик кнопок пролистывания по персонажам
-    application.add_handler(CallbackQueryHandler(character_button_handler, pattern="^character(prev|next)_"))
+    # Inline-режим: @бот запрос
+    application.add_handler(InlineQueryHandler(inline_query))
 
     # Обработчик команды /help
     application.add_handler(CommandHandler("help", help_command))
 
+    # Статистика для администраторов
+    application.add_handler(CommandHandler("stats", stats_command))
+
+    # Задержки и ошибки всех обработчиков, включая состояния диалогов
+    metrics.instrument_application(application)
+    return application
+
+
+def main() -> None:
+    # Каталог в памяти бота перезаписал бы изменения другого процесса при следующем сбросе
+    catalog_lock = ProcessLock(CATALOG_LOCK_PATH)
+    if not catalog_lock.acquire():
+        raise SystemExit("Каталог занят: уже запущен бот или идёт python main.py import")
+    # Создаем директорию для фото
+    os.makedirs('photos', exist_ok=True)
+    application = build_application()
+
     # Запуск бота
-    application.run_polling()
+    if RUN_MODE == 'webhook':
+        if WEBHOOK_URL is None:
+            raise SystemExit("Для RUN_MODE = 'webhook' нужно указать WEBHOOK_URL")
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+        )
+    else:
+        application.run_polling()
+    # Сессии дописываются при остановке приложения, после post_shutdown
+    sessions.close()
+    db.close()
+    catalog_lock.release()
+
+
+# Служебные команды: python main.py <команда>; без команды запускается бот
+def cli() -> None:
+    parser = argparse.ArgumentParser(description="PICASo")
+    subparsers = parser.add_subparsers(dest='command')
+
+    migrate_parser = subparsers.add_parser('migrate-sqlite', help="Перенести photos.json в SQLite")
+    migrate_parser.add_argument('--source', default='photos.json')
+    migrate_parser.add_argument('--target', default=SQLITE_PATH)
+
+    rebuild_parser = subparsers.add_parser('rebuild-author-view', help="Пересобрать photos_by_author из каталога")
+    rebuild_parser.add_argument('--workers', type=int, default=8)
+
+    lag_parser = subparsers.add_parser('measure-loop-lag',
+                                       help="Задержка цикла событий при потоке добавлений: до и после писателя")
+    lag_parser.add_argument('--entries', type=int, default=20000, help="Размер тестового каталога")
+    lag_parser.add_argument('--adds', type=int, default=200, help="Сколько записей добавить")
+
+    dedupe_parser = subparsers.add_parser('dedupe', help="Найти похожие изображения в каталоге")
+    dedupe_parser.add_argument('--distance', type=int, default=DUPLICATE_DISTANCE)
+    dedupe_parser.add_argument('--workers', type=int, default=None, help="Число процессов для хэширования")
+
+    import_parser = subparsers.add_parser('import', help="Массовый импорт фотографий из папки или ZIP-архива")
+    import_parser.add_argument('source', help="Папка или ZIP-архив; метаданные — photo.json/photo.csv или metadata.csv")
+    import_parser.add_argument('--authors', default='', help="Авторы для всех файлов, через запятую")
+    import_parser.add_argument('--tags', default='', help="Теги для всех файлов, через запятую")
+    import_parser.add_argument('--characters', default='', help="Персонажи для всех файлов, через запятую")
+    import_parser.add_argument('--workers', type=int, default=None, help="Число процессов для хэширования")
+    import_parser.add_argument('--distance', type=int, default=DUPLICATE_DISTANCE)
+    import_parser.add_argument('--skip-similar', action='store_true', help="Не импортировать похожие изображения")
+
+    variants_parser = subparsers.add_parser('variants', help="Создать уменьшенные копии для всего каталога")
+    variants_parser.add_argument('--variant', choices=sorted(VARIANTS), action='append',
+                                 help="Какие варианты создать (по умолчанию все)")
+    variants_parser.add_argument('--workers', type=int, default=VARIANT_WORKERS, help="Число процессов")
+
+    backup_parser = subparsers.add_parser('backup', help="Резервная копия папки photos")
+    backup_parser.add_argument('action', choices=['run', 'list', 'verify', 'restore'])
+    backup_parser.add_argument('--snapshot', help="Имя снапшота (по умолчанию последний)")
+    backup_parser.add_argument('--target', default='photos_restored', help="Куда восстановить файлы")
+
+    fsck_parser = subparsers.add_parser('fsck', help="Сверить каталог с photos, photos_by_author и резервной копией")
+    fsck_parser.add_argument('--repair', action='store_true', help="Исправить найденное")
+    fsck_parser.add_argument('--full', action='store_true', help="Хэшировать все файлы, а не только изменившиеся")
+    fsck_parser.add_argument('--workers', type=int, default=8)
+
+    args = parser.parse_args()
+    if args.command is None:
+        main()
+    elif args.command == 'migrate-sqlite':
+        try:
+            count = migrate_from_json(args.source, args.target)
+        except ValueError as e:
+            parser.exit(1, f"❌ {e}\n")
+        print(f"✅ Перенесено записей: {count}")
+    elif args.command == 'rebuild-author-view':
+        author_view.workers = args.workers
+        links = author_view.rebuild(db.get_entries())
+        print(f"✅ Папки по авторам пересобраны, ссылок: {links}")
+    elif args.command == 'measure-loop-lag':
+        for mode, stats in asyncio.run(measure_loop_lag(args.entries, args.adds)).items():
+            print(f"{mode}: задержка средняя {stats['avg_ms']:.1f} мс, максимальная {stats['max_ms']:.1f} мс, "
+                  f"записей на диск: {stats['flushes']}")
+    elif args.command == 'dedupe':
+        run_dedupe(args.distance, args.workers)
+    elif args.command == 'import':
+        run_import(args, parser)
+    elif args.command == 'variants':
+        run_variants(args)
+    elif args.command == 'backup':
+        run_backup_command(args, parser)
+    elif args.command == 'fsck':
+        run_fsck(args, parser)
+
+
+# Поток добавлений во временный каталог: 'sync' — запись на каждое изменение в цикле событий,
+# 'writer' — CatalogWriter с объединением записей в пуле потоков
+async def measure_loop_lag(entries, adds):
+    results = {}
+    for mode in ('sync', 'writer'):
+        with tempfile.TemporaryDirectory() as tmp:
+            test_db = PhotoDatabase(os.path.join(tmp, 'photos.json'))
+            for i in range(entries):
+                test_db.data.append(EntryRecord({
+                    'id': i + 1, 'file_path': f"photos/{i}.jpg", 'authors': [f"author{i % 500}"],
+                    'tags': [f"tag{i % 50}", f"tag{i % 7}"], 'characters': [f"character{i % 300}"], 'file_id': None}))
+            test_db._rebuild_indexes()
+            test_db.save_data()
+
+            monitor = LoopLagMonitor()
+            monitor.start()
+            writer = None
+            if mode == 'writer':
+                writer = CatalogWriter(test_db, io_executor, delay=CATALOG_FLUSH_DELAY)
+                writer.start()
+            saves = 0
+            for i in range(adds):
+                test_db.add_entry(f"photos/new{i}.jpg", ["author"], ["tag"], ["character"])
+                saves += test_db.autosave
+                await asyncio.sleep(0.005)  # Обновления приходят каждые 5 мс
+            if writer is not None:
+                await writer.stop()
+            await monitor.stop()
+            results[mode] = dict(monitor.stats(), flushes=writer.flushes if writer else saves)
+    return results
+
+
+# Досчитываем перцептивные хэши в пуле процессов и выводим группы похожих изображений
+def run_dedupe(max_distance, workers) -> None:
+    entries = db.get_entries()
+    missing = [entry for entry in entries if not entry.get('phash') and os.path.exists(entry['file_path'])]
+    if missing:
+        print(f"Хэширование {len(missing)} изображений...")
+        db.autosave = False  # Одна запись каталога в конце вместо записи на каждый хэш
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            hashes = pool.map(try_dhash, [entry['file_path'] for entry in missing], chunksize=64)
+            for entry, phash in zip(missing, hashes):
+                if phash:
+                    db.set_phash(entry['id'], phash)
+                    entry['phash'] = phash
+        db.flush()
+
+    # Объединяем похожие записи в группы (система непересекающихся множеств)
+    parent = {}
+
+    def find(entry_id):
+        while parent.setdefault(entry_id, entry_id) != entry_id:
+            parent[entry_id] = parent[parent[entry_id]]
+            entry_id = parent[entry_id]
+        return entry_id
+
+    for entry in entries:
+        if not entry.get('phash'):
+            continue
+        for _, other in db.find_similar(entry['phash'], max_distance):
+            if other['id'] != entry['id']:
+                parent[find(other['id'])] = find(entry['id'])
+
+    groups = {}
+    for entry_id in parent:
+        groups.setdefault(find(entry_id), []).append(entry_id)
+    groups = sorted(sorted(group) for group in groups.values() if len(group) > 1)
+    for group in groups:
+        print("Похожие: ID " + ", ".join(map(str, group)))
+    print(f"✅ Найдено групп похожих изображений: {len(groups)}")
+
+
+def run_import(args, parser) -> None:
+    # Импорт пишет каталог сам: при запущенном боте его следующий сброс затёр бы новые записи
+    catalog_lock = ProcessLock(CATALOG_LOCK_PATH)
+    if not catalog_lock.acquire():
+        parser.exit(1, "❌ Бот запущен: остановите его перед импортом\n")
+    defaults = {field: [value.strip() for value in getattr(args, field).split(',') if value.strip()]
+                for field in ('authors', 'tags', 'characters')}
+    try:
+        stats = import_photos(db, args.source, defaults=defaults, workers=args.workers,
+                              max_distance=args.distance, skip_similar=args.skip_similar)
+    except ValueError as e:
+        parser.exit(1, f"❌ {e}\n")
+    finally:
+        catalog_lock.release()
+    seconds = max(stats['seconds'], 1e-9)
+    print(f"Найдено изображений: {stats['found']}, дубликатов: {stats['duplicates']}, "
+          f"похожих на имеющиеся: {stats['similar']}, нечитаемых: {stats['unreadable']}")
+    print(f"✅ Импортировано: {stats['imported']} за {stats['seconds']:.1f} с "
+          f"({stats['found'] / seconds:.0f} файлов/с, {stats['bytes'] / seconds / 1024 / 1024:.1f} МБ/с)")
+    # Папки по авторам обновляются слушателем в пуле потоков; варианты новых файлов не ждём —
+    # их досоздаст команда variants или бот при первом показе
+    io_executor.shutdown()
+    variant_cache.close(cancel=True)
+
+
+def run_variants(args) -> None:
+    variant_cache.workers = args.workers
+    file_paths = [entry['file_path'] for entry in db.get_entries()]
+    started = time.perf_counter()
+
+    def progress(done, total):
+        if done % 500 == 0 or done == total:
+            print(f"Варианты: {done}/{total}")
+
+    created, failed = variant_cache.backfill(file_paths, args.variant, progress)
+    variant_cache.close()
+    print(f"✅ Создано вариантов: {created}, ошибок: {failed} за {time.perf_counter() - started:.1f} с; "
+          f"кэш занимает {variant_cache.total_bytes / 1024 / 1024:.1f} МБ")
+
+
+def run_backup_command(args, parser) -> None:
+    if args.action == 'run':
+        snapshot, copied = backup_store.run()
+        if snapshot is None:
+            print("Изменений нет, новый снапшот не нужен.")
+        else:
+            print(f"✅ Снапшот {snapshot}, скопировано файлов: {copied}")
+    elif args.action == 'list':
+        for snapshot in backup_store.list_snapshots():
+            print(snapshot)
+    elif args.action == 'verify':
+        problems = backup_store.verify(args.snapshot)
+        for path, problem in problems:
+            print(f"❌ {path}: {problem}")
+        if problems:
+            parser.exit(1)
+        print("✅ Резервная копия в порядке.")
+    elif args.action == 'restore':
+        try:
+            count = backup_store.restore(args.target, args.snapshot)
+        except (ValueError, FileNotFoundError) as e:
+            parser.exit(1, f"❌ {e}\n")
+        print(f"✅ Восстановлено файлов: {count} в {args.target}")
+
+
+def run_fsck(args, parser) -> None:
+    checker = IntegrityChecker(db, author_view, backup_store, FSCK_CACHE_PATH, orphans_dir=ORPHANS_DIR,
+                               workers=args.workers, grace=FSCK_ORPHAN_GRACE)
+    problems = checker.check(full=args.full)
+    stats = checker.stats
+    print(f"Записей: {stats['entries']}, файлов: {stats['files']}, ссылок: {stats['links']}, "
+          f"объектов копии: {stats['objects']}; хэшировано: {stats['hashed']} за {stats['seconds']:.1f} с")
+    if args.repair and problems:
+        checker.repair(problems)
+    for problem in problems:
+        mark = "✅ исправлено" if problem.get('repaired') else "❌"
+        print(f"{mark} {problem['kind']} {problem['path']}: {problem['detail']}")
+    left = [problem for problem in problems if not problem.get('repaired')]
+    if left:
+        parser.exit(1, f"Проблем: {len(problems)}, не исправлено: {len(left)}\n")
+    print(f"✅ Исправлено проблем: {len(problems)}" if problems else "✅ Каталог и файлы согласованы.")
 
 
 if __name__ == "__main__":
 
-    main()
+    cli()
@@ -0,0 +1,315 @@
+import bisect
+import contextvars
+import functools
+import inspect
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telegram.ext import ConversationHandler
+from telegram.request import HTTPXRequest
+
+# Границы корзин гистограмм, секунд
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PARTS = ('db', 'io', 'telegram')  # На что делится время обработки обновления
+PREFIX = 'picaso_'
+
+# Время по частям для обновления, которое сейчас обрабатывается: {часть: секунды} или None
+_current = contextvars.ContextVar('metrics_update', default=None)
+
+
+class Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # Последняя корзина — +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    # Оценка квантиля по верхней границе корзины
+    def quantile(self, q):
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank and count:
+                return bound
+        return 0.0
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    items = [f'{key}="{value}"' for key, value in labels + extra]
+    return '{' + ','.join(items) + '}' if items else ''
+
+
+# Сэмплирующий профилировщик: раз в interval снимает стек потока и копит стеки
+# в «свёрнутом» формате flame graph (flamegraph.pl, speedscope)
+class SamplingProfiler:
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+
+# Гистограммы задержек и счётчики; пишутся из цикла событий и из потоков
+class Metrics:
+    def __init__(self, profile_threshold=None, profile_dir='profiles'):
+        self.started = time.time()
+        self.profile_threshold = profile_threshold  # Обновления дольше порога сохраняются для flame graph
+        self.profile_dir = profile_dir
+        self._lock = threading.Lock()
+        self._histograms = {}  # имя -> {метки: Histogram}
+        self._counters = {}  # имя -> {метки: значение}
+        self._server = None
+
+    def inc(self, name, value=1, **labels):
+        key = _labels(labels)
+        with self._lock:
+            counters = self._counters.setdefault(name, {})
+            counters[key] = counters.get(key, 0) + value
+
+    def counter(self, name, **labels):
+        with self._lock:
+            return self._counters.get(name, {}).get(_labels(labels), 0)
+
+    def observe(self, name, value, **labels):
+        key = _labels(labels)
+        with self._lock:
+            histograms = self._histograms.setdefault(name, {})
+            histogram = histograms.get(key)
+            if histogram is None:
+                histogram = histograms[key] = Histogram()
+            histogram.observe(value)
+
+    # Добавляет время к части (db, io, telegram) обрабатываемого сейчас обновления
+    @staticmethod
+    def add_time(part, seconds):
+        parts = _current.get()
+        if parts is not None:
+            parts[part] += seconds
+
+    # Обёртка над объектом: время вызовов его методов (и ожидания их результата) идёт в part
+    def instrument(self, target, part):
+        return TimedProxy(target, part)
+
+    # Обёртка обработчика: задержка по частям, ошибки и профиль медленных обновлений
+    def wrap_handler(self, name, callback):
+        @functools.wraps(callback)
+        async def wrapper(update, context):
+            parts = dict.fromkeys(PARTS, 0.0)
+            token = _current.set(parts)
+            profiler = None
+            if self.profile_threshold is not None:
+                profiler = SamplingProfiler(threading.get_ident()).start()
+            started = time.perf_counter()
+            try:
+                return await callback(update, context)
+            except Exception:
+                self.inc('handler_errors_total', handler=name)
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                _current.reset(token)
+                self.observe('handler_seconds', elapsed, handler=name, part='total')
+                for part, seconds in parts.items():
+                    self.observe('handler_seconds', seconds, handler=name, part=part)
+                other = max(0.0, elapsed - sum(parts.values()))
+                self.observe('handler_seconds', other, handler=name, part='other')
+                if profiler is not None:
+                    stacks = profiler.stop()
+                    if elapsed >= self.profile_threshold:
+                        self._dump_profile(name, elapsed, stacks)
+        return wrapper
+
+    def _dump_profile(self, name, elapsed, stacks):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        filename = f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-{elapsed * 1000:.0f}ms.folded"
+        with open(os.path.join(self.profile_dir, filename), 'w') as f:
+            for stack, count in stacks.most_common():
+                f.write(f'{stack} {count}\n')
+        self.inc('slow_updates_total', handler=name)
+
+    # Оборачивает все обработчики приложения, включая состояния ConversationHandler
+    def instrument_application(self, application):
+        def wrap(handler):
+            if isinstance(handler, ConversationHandler):
+                for child in handler.entry_points + handler.fallbacks:
+                    wrap(child)
+                for handlers in handler.states.values():
+                    for child in handlers:
+                        wrap(child)
+            else:
+                handler.callback = self.wrap_handler(handler.callback.__name__, handler.callback)
+
+        for handlers in application.handlers.values():
+            for handler in handlers:
+                wrap(handler)
+
+    # Текстовый формат Prometheus
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, counters in sorted(self._counters.items()):
+                lines.append(f'# TYPE {PREFIX}{name} counter')
+                for labels, value in sorted(counters.items()):
+                    lines.append(f'{PREFIX}{name}{_format_labels(labels)} {value}')
+            for name, histograms in sorted(self._histograms.items()):
+                lines.append(f'# TYPE {PREFIX}{name} histogram')
+                for labels, histogram in sorted(histograms.items()):
+                    cumulative = 0
+                    for bound, count in zip(BUCKETS + ('+Inf',), histogram.counts):
+                        cumulative += count
+                        lines.append(f'{PREFIX}{name}_bucket{_format_labels(labels, (("le", bound),))} {cumulative}')
+                    lines.append(f'{PREFIX}{name}_sum{_format_labels(labels)} {histogram.sum}')
+                    lines.append(f'{PREFIX}{name}_count{_format_labels(labels)} {histogram.count}')
+        lines.append(f'# TYPE {PREFIX}uptime_seconds gauge')
+        lines.append(f'{PREFIX}uptime_seconds {time.time() - self.started:.0f}')
+        return '\n'.join(lines) + '\n'
+
+    # Краткая сводка для команды /stats
+    def summary(self):
+        with self._lock:
+            handlers = {dict(labels)['handler']: histogram
+                        for labels, histogram in self._histograms.get('handler_seconds', {}).items()
+                        if dict(labels)['part'] == 'total'}
+            parts = {(dict(labels)['handler'], dict(labels)['part']): histogram
+                     for labels, histogram in self._histograms.get('handler_seconds', {}).items()}
+            counters = {name: dict(values) for name, values in self._counters.items()}
+        uptime = time.time() - self.started
+        total = sum(histogram.count for histogram in handlers.values())
+        lines = [f"Обновлений: {total} за {uptime / 60:.0f} мин ({total / max(uptime, 1):.2f}/с)"]
+        for name, histogram in sorted(handlers.items(), key=lambda item: -item[1].count):
+            split = ', '.join(f"{part} {parts[(name, part)].sum / histogram.count * 1000:.1f}"
+                              for part in PARTS if (name, part) in parts)
+            lines.append(f"{name}: {histogram.count} шт., p50 {histogram.quantile(0.5) * 1000:.0f} мс, "
+                         f"p95 {histogram.quantile(0.95) * 1000:.0f} мс; в среднем мс: {split}")
+        for name, values in sorted(counters.items()):
+            lines.append(f"{name}: " + ', '.join(
+                f"{'/'.join(str(value) for _, value in labels) or 'всего'} {count}"
+                for labels, count in sorted(values.items())))
+        return '\n'.join(lines)
+
+    def start_http_server(self, host='127.0.0.1', port=9108):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, name='metrics', daemon=True).start()
+
+    def stop_http_server(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+# Прокси, который считает время методов объекта как часть обработки текущего обновления
+class TimedProxy:
+    def __init__(self, target, part):
+        object.__setattr__(self, '_target', target)
+        object.__setattr__(self, '_part', part)
+        object.__setattr__(self, '_wrappers', {})  # имя метода -> обёртка, чтобы не собирать её на каждый вызов
+
+    def __getattr__(self, name):
+        wrapper = self._wrappers.get(name)
+        if wrapper is not None:
+            return wrapper
+        value = getattr(self._target, name)
+        if not callable(value):
+            return value
+        part = self._part
+
+        @functools.wraps(value)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = value(*args, **kwargs)
+            finally:
+                Metrics.add_time(part, time.perf_counter() - started)
+            if inspect.isawaitable(result):
+                return _timed_await(result, part)
+            return result
+        self._wrappers[name] = timed
+        return timed
+
+    def __setattr__(self, name, value):
+        self._wrappers.pop(name, None)
+        setattr(self._target, name, value)
+
+
+async def _timed_await(awaitable, part):
+    started = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        Metrics.add_time(part, time.perf_counter() - started)
+
+
+# Запросы к Bot API: время идёт в часть telegram, загрузки файлов считаются отдельно
+class InstrumentedRequest(HTTPXRequest):
+    def __init__(self, metrics, **kwargs):
+        super().__init__(**kwargs)
+        self.metrics = metrics
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        if request_data is not None and request_data.contains_files:
+            self.metrics.inc('uploads_total', method=api_method)
+        started = time.perf_counter()
+        try:
+            return await super().do_request(url, method, request_data, *args, **kwargs)
+        except Exception:
+            self.metrics.inc('telegram_errors_total', method=api_method)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            Metrics.add_time('telegram', elapsed)
+            self.metrics.observe('telegram_request_seconds', elapsed, method=api_method)
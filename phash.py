@@ -0,0 +1,82 @@
+from PIL import Image
+
+HASH_SIZE = 8  # 8x8 = 64-битный хэш
+
+
+# Разностный перцептивный хэш (dHash): устойчив к пережатию, изменению размера и небольшой обрезке.
+# Возвращается шестнадцатеричной строкой, чтобы храниться в JSON как есть
+def dhash(path, size=HASH_SIZE):
+    with Image.open(path) as image:
+        image = image.convert('L').resize((size + 1, size), Image.LANCZOS)
+        pixels = list(image.getdata())
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return f'{value:0{size * size // 4}x}'
+
+
+# Хэш файла или None, если файл не читается как изображение (для пула процессов)
+def try_dhash(path):
+    try:
+        return dhash(path)
+    except (OSError, ValueError):
+        return None
+
+
+def hamming(a, b):
+    return bin(int(a, 16) ^ int(b, 16)).count('1')
+
+
+# BK-дерево по расстоянию Хэмминга: поиск близких хэшей без перебора всех записей
+class BKTree:
+    def __init__(self):
+        self.root = None  # [хэш, [ID записей], {расстояние: дочерний узел} или None у листа]
+        self.size = 0
+
+    def add(self, value, entry_id):
+        self.size += 1
+        if self.root is None:
+            self.root = [value, [entry_id], None]
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(entry_id)
+                return
+            if node[2] is None:
+                node[2] = {}  # Большинство узлов — листья, словарь заводится только при первом потомке
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [entry_id], None]
+                return
+            node = child
+
+    def remove(self, value, entry_id):
+        # Узел остаётся в дереве, удаляется только ID
+        node = self.root
+        while node is not None:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                if entry_id in node[1]:
+                    node[1].remove(entry_id)
+                    self.size -= 1
+                return
+            node = node[2].get(distance) if node[2] is not None else None
+
+    def search(self, value, max_distance):
+        # Возвращает [(расстояние, ID записи)] по возрастанию расстояния
+        results = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= max_distance:
+                results.extend((distance, entry_id) for entry_id in node[1])
+            for child_distance, child in (node[2] or {}).items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        return sorted(results)
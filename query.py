@@ -0,0 +1,201 @@
+import re
+from bisect import bisect_left
+
+# Поля запроса и их сокращения; автор — точное совпадение, тег и персонаж — подстрока (как find_ids)
+FIELDS = {
+    'author': 'author', 'a': 'author',
+    'tag': 'tag', 't': 'tag',
+    'character': 'character', 'char': 'character', 'c': 'character',
+}
+
+# Минус перед скобкой исключает всю группу: -(tag:a OR tag:b)
+TOKEN_PATTERN = re.compile(r'\s*(?:(-?\()|(\))|(-)?(?:(\w+):)?(?:"([^"]*)"|([^\s()"]+)))', re.UNICODE)
+
+
+# Если условие совпадает с во столько раз большим числом записей, чем уже отобрано,
+# отобранные записи проверяются по одной вместо построения его списка ID
+FILTER_RATIO = 8
+
+
+class QueryError(ValueError):
+    pass
+
+
+# Узлы запроса: ('term', поле или None, значение), ('not', узел), ('and', [узлы]), ('or', [узлы])
+def _tokens(text):
+    pos = 0
+    text = text.strip()
+    while pos < len(text):
+        match = TOKEN_PATTERN.match(text, pos)
+        if match is None or match.end() == pos:
+            raise QueryError(f"Не удалось разобрать запрос с позиции {pos + 1}: {text[pos:]}")
+        pos = match.end()
+        left, right, negate, field, quoted, word = match.groups()
+        if left or right:
+            yield left or right, None
+            continue
+        value = quoted if quoted is not None else word
+        if field is None and not negate and quoted is None and value.upper() in ('OR', 'AND'):
+            yield value.upper(), None
+            continue
+        if field is not None:
+            if field.lower() not in FIELDS:
+                raise QueryError(f"Неизвестное поле: {field}. Доступны: author, tag, character")
+            field = FIELDS[field.lower()]
+        term = ('term', field, value.strip())
+        yield 'TERM', ('not', term) if negate else term
+
+
+# Разбор: OR связывает слабее, чем подряд идущие условия (И); скобки группируют
+def parse(text):
+    tokens = list(_tokens(text))
+    pos = 0
+
+    def peek():
+        return tokens[pos][0] if pos < len(tokens) else None
+
+    def parse_or():
+        nonlocal pos
+        children = [parse_and()]
+        while peek() == 'OR':
+            pos += 1
+            children.append(parse_and())
+        return children[0] if len(children) == 1 else ('or', children)
+
+    def parse_and():
+        nonlocal pos
+        children = []
+        while peek() in ('TERM', '(', '-(', 'AND'):
+            kind, node = tokens[pos]
+            pos += 1
+            if kind == 'AND':
+                continue
+            if kind in ('(', '-('):
+                node = parse_or()
+                if peek() != ')':
+                    raise QueryError("Не закрыта скобка")
+                pos += 1
+                if kind == '-(':
+                    node = ('not', node)
+            children.append(node)
+        if not children:
+            raise QueryError("Пустое условие в запросе")
+        return children[0] if len(children) == 1 else ('and', children)
+
+    if not tokens:
+        raise QueryError("Пустой запрос")
+    node = parse_or()
+    if pos != len(tokens):
+        raise QueryError("Лишняя закрывающая скобка")
+    return node
+
+
+# Операции над отсортированными списками ID
+def intersect(small, large):
+    # Для каждого ID меньшего списка — двоичный поиск в большем, начиная с прошлой позиции
+    if len(small) > len(large):
+        small, large = large, small
+    result = []
+    lo = 0
+    for entry_id in small:
+        lo = bisect_left(large, entry_id, lo)
+        if lo == len(large):
+            break
+        if large[lo] == entry_id:
+            result.append(entry_id)
+    return result
+
+
+def difference(ids, excluded):
+    excluded = set(excluded)
+    return [entry_id for entry_id in ids if entry_id not in excluded]
+
+
+def union(lists):
+    # Множество и сортировка работают в C и быстрее слияния heapq.merge по одному ID
+    if len(lists) == 1:
+        return list(lists[0])
+    return sorted(set().union(*lists))
+
+
+# План и выполнение запроса над индексами базы: find_ids, count_ids, all_ids, get_entries_by_ids
+class QueryPlanner:
+    def __init__(self, db):
+        self.db = db
+
+    def _term_fields(self, field):
+        return (field,) if field is not None else ('author', 'tag', 'character')
+
+    # Оценка размера результата без его построения
+    def estimate(self, node):
+        kind = node[0]
+        if kind == 'term':
+            return sum(self.db.count_ids(field, node[2]) for field in self._term_fields(node[1]))
+        if kind == 'not':
+            return self.db.count() - self.estimate(node[1])
+        if kind == 'and':
+            positive = [self.estimate(child) for child in node[1] if child[0] != 'not']
+            return min(positive) if positive else self.db.count()
+        return sum(self.estimate(child) for child in node[1])
+
+    # Проверка одной записи по условию (та же семантика, что у find_ids)
+    def matches(self, entry, node):
+        kind = node[0]
+        if kind == 'term':
+            value = node[2].lower()
+            for field in self._term_fields(node[1]):
+                if field == 'author':
+                    if any(author.lower() == value for author in entry['authors']):
+                        return True
+                elif any(value in item.lower() for item in entry[field + 's']):
+                    return True
+            return False
+        if kind == 'not':
+            return not self.matches(entry, node[1])
+        if kind == 'and':
+            return all(self.matches(entry, child) for child in node[1])
+        return any(self.matches(entry, child) for child in node[1])
+
+    def _filter(self, ids, node, keep=True):
+        # Записи берутся одним вызовом: для SQLite это запросы пачками, а не по одному на ID
+        return [entry['id'] for entry in self.db.get_entries_by_ids(ids) if self.matches(entry, node) == keep]
+
+    def run(self, node):
+        kind = node[0]
+        if kind == 'term':
+            return union([self.db.find_ids(field, node[2]) for field in self._term_fields(node[1])])
+        if kind == 'not':
+            return difference(self.db.all_ids(), self.run(node[1]))
+        if kind == 'or':
+            return union([self.run(child) for child in node[1]])
+        return self._run_and(node[1])
+
+    def _run_and(self, children):
+        # Оценки считаем один раз: для SQLite каждая — запрос к базе
+        positive = sorted((self.estimate(child), i, child) for i, child in enumerate(children) if child[0] != 'not')
+        negative = sorted((self.estimate(child[1]), i, child[1]) for i, child in enumerate(children)
+                          if child[0] == 'not')
+        if not positive:
+            # Только исключения: без перебора каталога не обойтись
+            ids = self.db.all_ids()
+        else:
+            # Начинаем с самого избирательного условия; пустое пересечение обрывает выполнение
+            ids = self.run(positive[0][2])
+            for estimate, _, child in positive[1:]:
+                if not ids:
+                    return []
+                if estimate > len(ids) * FILTER_RATIO:
+                    ids = self._filter(ids, child)
+                else:
+                    ids = intersect(ids, self.run(child))
+        for estimate, _, child in negative:
+            if not ids:
+                return []
+            if estimate > len(ids) * FILTER_RATIO:
+                ids = self._filter(ids, child, keep=False)
+            else:
+                ids = difference(ids, self.run(child))
+        return ids
+
+    def search(self, text):
+        return self.run(parse(text))
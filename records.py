@@ -0,0 +1,95 @@
+import threading
+from collections.abc import Mapping
+
+FIELDS = ('id', 'file_path', 'authors', 'tags', 'characters', 'file_id', 'phash', 'added_at')
+LIST_FIELDS = frozenset(('authors', 'tags', 'characters'))
+SCALAR_FIELDS = frozenset(FIELDS) - LIST_FIELDS
+
+
+# Словарь значений: строка <-> целый ID. Имя автора, тега или персонажа хранится один раз
+# на весь процесс, записи держат кортежи ID; одинаковые кортежи тоже хранятся один раз
+class Vocabulary:
+    def __init__(self):
+        self.ids = {}  # строка -> ID
+        self.values = []  # ID -> строка
+        self._tuples = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.values)
+
+    def encode(self, values):
+        ids = []
+        for value in values:
+            value_id = self.ids.get(value)
+            if value_id is None:
+                with self._lock:
+                    value_id = self.ids.get(value)
+                    if value_id is None:
+                        value_id = self.ids[value] = len(self.values)
+                        self.values.append(value)
+            ids.append(value_id)
+        ids = tuple(ids)
+        return self._tuples.setdefault(ids, ids)
+
+    def decode(self, ids):
+        values = self.values
+        return [values[value_id] for value_id in ids]
+
+
+vocabulary = Vocabulary()
+
+
+# Запись каталога в памяти: __slots__ вместо словаря, списки — кортежи ID из vocabulary.
+# Снаружи ведёт себя как словарь записи (entry['authors'], entry.get('file_id'), items()),
+# списки при чтении собираются заново, поэтому менять их на месте бесполезно — только присваивать
+class EntryRecord(Mapping):
+    __slots__ = FIELDS + ('extra',)  # extra — неизвестные поля из старых файлов, обычно None
+
+    def __init__(self, data):
+        for key in SCALAR_FIELDS:
+            setattr(self, key, data.get(key))
+        for key in LIST_FIELDS:
+            setattr(self, key, vocabulary.encode(data.get(key) or ()))
+        extra = {key: value for key, value in data.items() if key not in SCALAR_FIELDS and key not in LIST_FIELDS}
+        self.extra = extra or None
+
+    def __getitem__(self, key):
+        if key in LIST_FIELDS:
+            return vocabulary.decode(getattr(self, key))
+        if key in SCALAR_FIELDS:
+            return getattr(self, key)
+        if self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in LIST_FIELDS:
+            setattr(self, key, vocabulary.encode(value))
+        elif key in SCALAR_FIELDS:
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __iter__(self):
+        yield from FIELDS
+        if self.extra is not None:
+            yield from self.extra
+
+    def __len__(self):
+        return len(FIELDS) + (len(self.extra) if self.extra is not None else 0)
+
+    def __repr__(self):
+        return f"EntryRecord({self.to_dict()!r})"
+
+    # Обычный словарь для JSON и журнала; подходит как default= для json.dump
+    def to_dict(self):
+        decode = vocabulary.decode
+        data = {'id': self.id, 'file_path': self.file_path, 'authors': decode(self.authors), 'tags': decode(self.tags),
+                'characters': decode(self.characters), 'file_id': self.file_id, 'phash': self.phash,
+                'added_at': self.added_at}
+        if self.extra is not None:
+            data.update(self.extra)
+        return data
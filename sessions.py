@@ -0,0 +1,246 @@
+import asyncio
+import heapq
+import json
+import sqlite3
+import threading
+import time
+from array import array
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from cursors import Cursor
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+# Состояние пользователей между перезапусками: user_data, состояния диалогов и курсоры просмотра в SQLite.
+# Изменения копятся в памяти и раз в update_interval секунд пишутся одной транзакцией в потоке executor;
+# user_data хранится компактным JSON, ID найденных записей курсора — байтами array('q')
+class SessionPersistence(BasePersistence):
+    def __init__(self, filename='sessions.db', executor=None, update_interval=5):
+        super().__init__(store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True,
+                                                     callback_data=False),
+                         update_interval=update_interval)
+        self.filename = filename
+        self.executor = executor
+        self.touched = {}  # ID пользователя -> время последнего обновления (time.time())
+        self._conversation_keys = {}  # ID пользователя -> {(имя диалога, ключ)}
+        self._users = {}  # ID пользователя -> JSON или None (удалить)
+        self._conversations = {}  # (имя, ключ) -> JSON состояния или None (диалог завершён)
+        self._cursors = {}  # (ID пользователя, вид) -> (курсор, весь ли курсор, время) или None
+        self._flush_task = None
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        with self._lock, self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS user_data ('
+                              'user_id INTEGER PRIMARY KEY, touched REAL NOT NULL, data TEXT NOT NULL)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS conversations ('
+                              'name TEXT NOT NULL, key TEXT NOT NULL, user_id INTEGER, state TEXT NOT NULL, '
+                              'PRIMARY KEY (name, key)) WITHOUT ROWID')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS cursors ('
+                              'user_id INTEGER NOT NULL, kind TEXT NOT NULL, query TEXT, ids BLOB, '
+                              'position INTEGER NOT NULL, messages TEXT, touched REAL NOT NULL, '
+                              'PRIMARY KEY (user_id, kind)) WITHOUT ROWID')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS cursors_touched ON cursors(touched)')
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    async def get_user_data(self):
+        with self._lock:
+            rows = self.conn.execute('SELECT user_id, touched, data FROM user_data').fetchall()
+        self.touched = {user_id: touched for user_id, touched, _ in rows}
+        return {user_id: json.loads(data) for user_id, _, data in rows}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        with self._lock:
+            rows = self.conn.execute('SELECT key, user_id, state FROM conversations WHERE name = ?',
+                                     (name,)).fetchall()
+        conversations = {}
+        for key, user_id, state in rows:
+            key = tuple(json.loads(key))
+            conversations[key] = json.loads(state)
+            self._conversation_keys.setdefault(user_id, set()).add((name, key))
+        return conversations
+
+    async def update_conversation(self, name, key, new_state):
+        # Ключ диалога по умолчанию (чат, пользователь): ID пользователя — последний элемент
+        user_id = key[-1] if key else None
+        if new_state is None:
+            keys = self._conversation_keys.get(user_id, set())
+            keys.discard((name, key))
+            if not keys:
+                self._conversation_keys.pop(user_id, None)
+        else:
+            self._conversation_keys.setdefault(user_id, set()).add((name, key))
+        self._conversations[(name, key)] = None if new_state is None else (user_id, _dumps(new_state))
+        self._schedule_flush()
+
+    async def update_user_data(self, user_id, data):
+        self.touched[user_id] = time.time()
+        self._users[user_id] = _dumps(data)
+        self._schedule_flush()
+
+    async def drop_user_data(self, user_id):
+        self.touched.pop(user_id, None)
+        self._users[user_id] = None
+        self._schedule_flush()
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        if self._flush_task is not None:
+            await self._flush_task
+        await self._write_pending()
+
+    # Application вызывает update_* всех изменённых пользователей разом (asyncio.gather); задача записи
+    # создаётся первым из них и запускается после остальных, поэтому вся пачка уходит одной транзакцией
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._write_pending())
+
+    async def _write_pending(self):
+        while self._users or self._conversations or self._cursors:
+            batch = self._users, self._conversations, self._take_cursors()
+            self._users, self._conversations = {}, {}
+            if self.executor is None:
+                self._write(*batch)
+            else:
+                await self.executor.run(self._write, *batch)
+
+    # Курсор сериализуется в цикле событий, чтобы поток записи не видел его посреди пролистывания
+    def _take_cursors(self):
+        cursors = {}
+        for key, item in self._cursors.items():
+            if item is None:
+                cursors[key] = None
+                continue
+            cursor, full, touched = item
+            messages = _dumps(cursor.messages) if cursor.messages else None
+            if full:
+                ids = cursor.ids.tobytes() if cursor.ids is not None else None
+                cursors[key] = (cursor.kind, cursor.query, ids, cursor.index, messages, touched)
+            else:
+                cursors[key] = (cursor.index, messages, touched)
+        self._cursors = {}
+        return cursors
+
+    def _write(self, users, conversations, cursors):
+        with self._lock, self.conn:
+            for user_id, data in users.items():
+                if data is None:
+                    self.conn.execute('DELETE FROM user_data WHERE user_id = ?', (user_id,))
+                    self.conn.execute('DELETE FROM cursors WHERE user_id = ?', (user_id,))
+                else:
+                    self.conn.execute('INSERT OR REPLACE INTO user_data (user_id, touched, data) VALUES (?, ?, ?)',
+                                      (user_id, self.touched.get(user_id, time.time()), data))
+            for (name, key), item in conversations.items():
+                if item is None:
+                    self.conn.execute('DELETE FROM conversations WHERE name = ? AND key = ?', (name, _dumps(key)))
+                else:
+                    self.conn.execute('INSERT OR REPLACE INTO conversations (name, key, user_id, state) '
+                                      'VALUES (?, ?, ?, ?)', (name, _dumps(key), *item))
+            for (user_id, kind), row in cursors.items():
+                if row is None:
+                    self.conn.execute('DELETE FROM cursors WHERE user_id = ? AND kind = ?', (user_id, kind))
+                elif len(row) == 3:
+                    self.conn.execute('UPDATE cursors SET position = ?, messages = ?, touched = ? '
+                                      'WHERE user_id = ? AND kind = ?', (*row, user_id, kind))
+                else:
+                    self.conn.execute('INSERT OR REPLACE INTO cursors (user_id, kind, query, ids, position, '
+                                      'messages, touched) VALUES (?, ?, ?, ?, ?, ?, ?)', (user_id, *row))
+
+    # Курсоры для CursorStore: новый записывается целиком, при пролистывании — только позиция и время
+    def save_cursor(self, key, cursor):
+        self._cursors[key] = (cursor, True, time.time())
+
+    def touch_cursor(self, key, cursor):
+        item = self._cursors.get(key)
+        self._cursors[key] = (cursor, item is not None and item[1], time.time())
+
+    def drop_cursor(self, key):
+        self._cursors[key] = None
+
+    # Курсор, ещё не записанный на диск, берётся из очереди; иначе читается из SQLite в потоке executor
+    async def load_cursor(self, key, ttl):
+        if key in self._cursors:
+            item = self._cursors[key]
+            return item[0] if item is not None else None
+        if self.executor is None:
+            return self._read_cursor(key, ttl)
+        return await self.executor.run(self._read_cursor, key, ttl)
+
+    def _read_cursor(self, key, ttl):
+        user_id, kind = key
+        with self._lock:
+            row = self.conn.execute('SELECT query, ids, position, messages FROM cursors '
+                                    'WHERE user_id = ? AND kind = ? AND touched > ?',
+                                    (user_id, kind, time.time() - ttl)).fetchone()
+        if row is None:
+            return None
+        query, ids, position, messages = row
+        cursor = Cursor(kind, query)
+        if ids is not None:
+            cursor.ids = array('q')
+            cursor.ids.frombytes(ids)
+        cursor.index = position
+        cursor.messages = json.loads(messages) if messages else None
+        return cursor
+
+    # Курсоры с диска вытесняются так же, как из памяти: по сроку и по числу
+    def sweep_cursors(self, ttl, max_size):
+        with self._lock, self.conn:
+            self.conn.execute('DELETE FROM cursors WHERE touched <= ?', (time.time() - ttl,))
+            self.conn.execute('DELETE FROM cursors WHERE touched <= (SELECT touched FROM cursors '
+                              'ORDER BY touched DESC LIMIT 1 OFFSET ?)', (max_size,))
+
+    # Пользователи, чьи сессии пора вытеснить: без активности дольше ttl и самые старые сверх max_users
+    def idle_users(self, ttl, max_users):
+        cutoff = time.time() - ttl
+        idle = [user_id for user_id, touched in self.touched.items() if touched <= cutoff]
+        extra = len(self.touched) - len(idle) - max_users
+        if extra > 0:
+            active = ((touched, user_id) for user_id, touched in self.touched.items() if touched > cutoff)
+            idle += [user_id for _, user_id in heapq.nsmallest(extra, active)]
+        return idle
+
+    # Диалоги вытесненного пользователя удаляются из хранилища и после перезапуска не загрузятся;
+    # возвращает их (имя, ключ), чтобы диалоги можно было убрать и из памяти обработчиков
+    def drop_conversations(self, user_id):
+        dropped = self._conversation_keys.pop(user_id, set())
+        for name, key in dropped:
+            self._conversations[(name, key)] = None
+        self._schedule_flush()
+        return dropped
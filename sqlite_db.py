@@ -0,0 +1,413 @@
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+
+from author_stats import AuthorStats
+from phash import BKTree
+from suggest import CooccurrenceModel
+
+# Поля записи с нормализованными таблицами значений: поле -> (таблица значений, таблица связей)
+FIELDS = {
+    'authors': ('authors', 'entry_authors'),
+    'tags': ('tags', 'entry_tags'),
+    'characters': ('characters', 'entry_characters'),
+}
+
+# Необязательные столбцы записи (добавляются в старые базы через ALTER TABLE)
+EXTRA_COLUMNS = ('file_id', 'phash', 'added_at')
+
+# Сколько последних позиций entry_at помнить (позиция -> ID) для перехода к соседней записи по ключу
+POSITION_CACHE_SIZE = 4096
+
+# Триграммный индекс работает для подстрок от 3 символов; короче — проверка instr по значениям
+TRIGRAM_MIN = 3
+# Ограничение SQLite на число параметров в одном запросе
+CHUNK_SIZE = 500
+
+
+# База данных фотографий на SQLite с теми же публичными методами, что и PhotoDatabase
+class SQLitePhotoDatabase:
+    def __init__(self, filename='photos.db'):
+        self.filename = filename
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('PRAGMA foreign_keys=ON')
+        self.fts = True
+        self._phash_index = BKTree()  # Перцептивные хэши держим в памяти: 16 символов на запись
+        self._tag_model = CooccurrenceModel()  # Модель подсказок тегов ограничена по памяти
+        self._author_stats = AuthorStats()  # Статистика авторов для /search_author
+        self._positions = OrderedDict()  # Позиция в каталоге -> ID, см. entry_at
+        self._listeners = []  # Вызываются после записи: callback(op, entry, previous)
+        # autosave = False: транзакция фиксируется не на каждую запись, а в flush() (см. CatalogWriter)
+        self.autosave = True
+        self.on_dirty = None
+        self._dirty = False
+        self._create_schema()
+        for entry_id, phash in self.conn.execute('SELECT id, phash FROM entries WHERE phash IS NOT NULL'):
+            self._phash_index.add(phash, entry_id)
+        for entry in self.iter_entries():
+            self._tag_model.add(entry)
+            self._author_stats.add(entry)
+
+    def _create_schema(self):
+        with self._lock, self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS entries ('
+                              'id INTEGER PRIMARY KEY, file_path TEXT NOT NULL)')
+            columns = [row[1] for row in self.conn.execute('PRAGMA table_info(entries)')]
+            for column in EXTRA_COLUMNS:
+                if column not in columns:
+                    self.conn.execute(f'ALTER TABLE entries ADD COLUMN {column} TEXT')
+            for values_table, link_table in FIELDS.values():
+                self.conn.execute(f'CREATE TABLE IF NOT EXISTS {values_table} ('
+                                  'id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE, name_lower TEXT NOT NULL)')
+                self.conn.execute(f'CREATE INDEX IF NOT EXISTS {values_table}_lower ON {values_table}(name_lower)')
+                self.conn.execute(f'CREATE TABLE IF NOT EXISTS {link_table} ('
+                                  'entry_id INTEGER NOT NULL REFERENCES entries(id), '
+                                  'position INTEGER NOT NULL, '
+                                  f'value_id INTEGER NOT NULL REFERENCES {values_table}(id), '
+                                  'PRIMARY KEY (entry_id, position)) WITHOUT ROWID')
+                self.conn.execute(f'CREATE INDEX IF NOT EXISTS {link_table}_value '
+                                  f'ON {link_table}(value_id, entry_id)')
+                try:
+                    self.conn.execute(f'CREATE VIRTUAL TABLE IF NOT EXISTS {values_table}_fts '
+                                      "USING fts5(name_lower, content='', tokenize='trigram')")
+                except sqlite3.OperationalError:
+                    # SQLite собран без FTS5 или без триграммного токенизатора
+                    self.fts = False
+
+    # Совместимость с PhotoDatabase: данные живут в SQLite, загружать нечего
+    def load_data(self):
+        pass
+
+    def save_data(self, filename='photos.json'):
+        with open(filename, 'w') as f:
+            json.dump(self.get_entries(), f, indent=4)
+
+    def close(self):
+        with self._lock:
+            self.conn.commit()
+            self.conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        # Точка сохранения откатывает только эту запись, не трогая накопленные до неё
+        with self._lock:
+            if not self.conn.in_transaction:
+                self.conn.execute('BEGIN')
+            self.conn.execute('SAVEPOINT write')
+            try:
+                yield
+            except Exception:
+                self.conn.execute('ROLLBACK TO write')
+                self.conn.execute('RELEASE write')
+                raise
+            self.conn.execute('RELEASE write')
+            if self.autosave:
+                self.conn.commit()
+            else:
+                self._dirty = True
+        if not self.autosave and self.on_dirty is not None:
+            self.on_dirty()
+
+    def flush(self):
+        with self._lock:
+            if self._dirty:
+                self.conn.commit()
+                self._dirty = False
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    def _notify(self, op, entry, previous=None):
+        for callback in self._listeners:
+            callback(op, entry, previous)
+
+    def _value_id(self, values_table, name):
+        row = self.conn.execute(f'SELECT id FROM {values_table} WHERE name = ?', (name,)).fetchone()
+        if row is not None:
+            return row[0]
+        cursor = self.conn.execute(f'INSERT INTO {values_table} (name, name_lower) VALUES (?, ?)',
+                                   (name, name.lower()))
+        if self.fts:
+            self.conn.execute(f'INSERT INTO {values_table}_fts (rowid, name_lower) VALUES (?, ?)',
+                              (cursor.lastrowid, name.lower()))
+        return cursor.lastrowid
+
+    def _write_values(self, entry_id, field, values):
+        values_table, link_table = FIELDS[field]
+        self.conn.execute(f'DELETE FROM {link_table} WHERE entry_id = ?', (entry_id,))
+        self.conn.executemany(
+            f'INSERT INTO {link_table} (entry_id, position, value_id) VALUES (?, ?, ?)',
+            [(entry_id, position, self._value_id(values_table, value)) for position, value in enumerate(values)]
+        )
+
+    def _insert_entry(self, entry):
+        self.conn.execute('INSERT INTO entries (id, file_path, file_id, phash, added_at) VALUES (?, ?, ?, ?, ?)',
+                          (entry['id'], entry['file_path'], entry.get('file_id'), entry.get('phash'),
+                           entry.get('added_at')))
+        if entry.get('phash'):
+            self._phash_index.add(entry['phash'], entry['id'])
+        self._tag_model.add(entry)
+        self._author_stats.add(entry)
+        for field in FIELDS:
+            self._write_values(entry['id'], field, entry[field])
+
+    def add_entry(self, file_path, authors, tags, characters, file_id=None, phash=None):
+        return self.add_entries([{'file_path': file_path, 'authors': authors, 'tags': tags,
+                                  'characters': characters, 'file_id': file_id, 'phash': phash}])[0]
+
+    # Пакетное добавление: items — словари с аргументами add_entry, одна транзакция на всю пачку
+    def add_entries(self, items):
+        entries = []
+        with self._transaction():
+            next_id = self.conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM entries').fetchone()[0]
+            for item in items:
+                # Сортируем списки по алфавиту
+                entry = {
+                    'id': next_id + len(entries),
+                    'file_path': item['file_path'],
+                    'authors': sorted([author.strip() for author in item['authors']], key=lambda x: x.lower()),
+                    'tags': sorted([tag.strip() for tag in item['tags']], key=lambda x: x.lower()),
+                    'characters': sorted([character.strip() for character in item['characters']],
+                                         key=lambda x: x.lower()),
+                    'file_id': item.get('file_id'),
+                    'phash': item.get('phash'),
+                    'added_at': datetime.now().isoformat(timespec='seconds')
+                }
+                self._insert_entry(entry)
+                entries.append(entry)
+        for entry in entries:
+            self._notify('add', entry)
+        return entries
+
+    def import_entries(self, entries):
+        with self._transaction():
+            for entry in entries:
+                self._insert_entry(entry)
+
+    def update_entry(self, entry_id, new_authors=None, new_tags=None, new_characters=None):
+        with self._transaction():
+            entry = self.get_entry(entry_id)
+            if entry is None:
+                return
+            previous = {key: list(value) if isinstance(value, list) else value for key, value in entry.items()}
+            for field, new_values in (('authors', new_authors), ('tags', new_tags),
+                                      ('characters', new_characters)):
+                if not new_values:
+                    continue
+                new_values = [value.strip() for value in new_values if value.strip()]
+                entry[field] = sorted(list(set(entry[field] + new_values)), key=lambda x: x.lower())
+                self._write_values(entry['id'], field, entry[field])
+            self._tag_model.remove(previous)
+            self._tag_model.add(entry)
+            self._author_stats.remove(previous)
+            self._author_stats.add(entry)
+        self._notify('update', entry, previous)
+        return entry
+
+    def _load_entries(self, ids):
+        entries = {}
+        for start in range(0, len(ids), CHUNK_SIZE):
+            chunk = ids[start:start + CHUNK_SIZE]
+            marks = ','.join('?' * len(chunk))
+            for entry_id, file_path, file_id, phash, added_at in self.conn.execute(
+                    f'SELECT id, file_path, file_id, phash, added_at FROM entries WHERE id IN ({marks})', chunk):
+                entries[entry_id] = {'id': entry_id, 'file_path': file_path,
+                                     'authors': [], 'tags': [], 'characters': [],
+                                     'file_id': file_id, 'phash': phash, 'added_at': added_at}
+            for field, (values_table, link_table) in FIELDS.items():
+                rows = self.conn.execute(
+                    f'SELECT l.entry_id, v.name FROM {link_table} l JOIN {values_table} v ON v.id = l.value_id '
+                    f'WHERE l.entry_id IN ({marks}) ORDER BY l.entry_id, l.position', chunk)
+                for entry_id, name in rows:
+                    entries[entry_id][field].append(name)
+        return [entries[entry_id] for entry_id in sorted(entries)]
+
+    def get_entry(self, entry_id):
+        with self._lock:
+            entries = self._load_entries([int(entry_id)])
+        return entries[0] if entries else None
+
+    # Записи по списку ID в том же порядке; несуществующие ID пропускаются
+    def get_entries_by_ids(self, ids):
+        with self._lock:
+            entries = {entry['id']: entry for entry in self._load_entries(list(ids))}
+        return [entries[entry_id] for entry_id in ids if entry_id in entries]
+
+    def set_file_id(self, entry_id, file_id):
+        with self._transaction():
+            self.conn.execute('UPDATE entries SET file_id = ? WHERE id = ?', (file_id, int(entry_id)))
+
+    def set_phash(self, entry_id, phash):
+        with self._transaction():
+            row = self.conn.execute('SELECT phash FROM entries WHERE id = ?', (int(entry_id),)).fetchone()
+            if row is None:
+                return
+            if row[0]:
+                self._phash_index.remove(row[0], int(entry_id))
+            self.conn.execute('UPDATE entries SET phash = ? WHERE id = ?', (phash, int(entry_id)))
+            if phash:
+                self._phash_index.add(phash, int(entry_id))
+
+    # Похожие изображения: [(расстояние Хэмминга, запись)] по возрастанию расстояния
+    def find_similar(self, phash, max_distance):
+        matches = self._phash_index.search(phash, max_distance)
+        with self._lock:
+            entries = {entry['id']: entry for entry in self._load_entries([entry_id for _, entry_id in matches])}
+        return [(distance, entries[entry_id]) for distance, entry_id in matches if entry_id in entries]
+
+    def _ids_for_values(self, link_table, value_ids):
+        ids = set()
+        for start in range(0, len(value_ids), CHUNK_SIZE):
+            chunk = value_ids[start:start + CHUNK_SIZE]
+            marks = ','.join('?' * len(chunk))
+            ids.update(row[0] for row in self.conn.execute(
+                f'SELECT entry_id FROM {link_table} WHERE value_id IN ({marks})', chunk))
+        return sorted(ids)
+
+    def _matching_value_ids(self, values_table, substring):
+        query = substring.lower()
+        if self.fts and len(query) >= TRIGRAM_MIN:
+            rows = self.conn.execute(
+                f'SELECT v.id FROM {values_table}_fts f JOIN {values_table} v ON v.id = f.rowid '
+                f'WHERE {values_table}_fts MATCH ? AND instr(v.name_lower, ?) > 0',
+                ('"' + query.replace('"', '""') + '"', query))
+        else:
+            rows = self.conn.execute(f'SELECT id FROM {values_table} WHERE instr(name_lower, ?) > 0', (query,))
+        return [row[0] for row in rows]
+
+    def count(self):
+        with self._lock:
+            return self.conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    # Записи не удаляются, а новые получают ID больше прежних, поэтому позиция -> ID не меняется.
+    # Пролистывание идёт на соседнюю позицию: её ID находится по ключу от запомненного соседа
+    # (WHERE id > ?), а OFFSET, стоимость которого растёт с позицией, нужен только для первой записи
+    def entry_at(self, index):
+        with self._lock:
+            positions = self._positions
+            if index in positions:
+                row = (positions[index],)
+            elif index - 1 in positions:
+                row = self.conn.execute('SELECT id FROM entries WHERE id > ? ORDER BY id LIMIT 1',
+                                        (positions[index - 1],)).fetchone()
+            elif index + 1 in positions:
+                row = self.conn.execute('SELECT id FROM entries WHERE id < ? ORDER BY id DESC LIMIT 1',
+                                        (positions[index + 1],)).fetchone()
+            else:
+                row = self.conn.execute('SELECT id FROM entries ORDER BY id LIMIT 1 OFFSET ?', (index,)).fetchone()
+            if row is None or index < 0:
+                raise IndexError(index)
+            positions[index] = row[0]
+            positions.move_to_end(index)
+            if len(positions) > POSITION_CACHE_SIZE:
+                positions.popitem(last=False)
+            return self._load_entries([row[0]])[0]
+
+    # ID записей по полю: автор — точное совпадение, тег и персонаж — подстрока
+    def find_ids(self, field, value):
+        with self._lock:
+            if field == 'author':
+                value_ids = [row[0] for row in self.conn.execute(
+                    'SELECT id FROM authors WHERE name_lower = ?', (value.lower(),))]
+                return self._ids_for_values('entry_authors', value_ids)
+            if field == 'tag':
+                return self._ids_for_values('entry_tags', self._matching_value_ids('tags', value))
+            if field == 'character':
+                return self._ids_for_values('entry_characters', self._matching_value_ids('characters', value))
+        raise ValueError(f"Неизвестное поле: {field}")
+
+    # Сколько ID вернёт find_ids, без построения самого списка (для планирования запросов)
+    def count_ids(self, field, value):
+        if field not in ('author', 'tag', 'character'):
+            raise ValueError(f"Неизвестное поле: {field}")
+        with self._lock:
+            if field == 'author':
+                value_ids = [row[0] for row in self.conn.execute(
+                    'SELECT id FROM authors WHERE name_lower = ?', (value.lower(),))]
+                link_table = 'entry_authors'
+            else:
+                values_table, link_table = FIELDS[field + 's']
+                value_ids = self._matching_value_ids(values_table, value)
+            count = 0
+            for start in range(0, len(value_ids), CHUNK_SIZE):
+                chunk = value_ids[start:start + CHUNK_SIZE]
+                marks = ','.join('?' * len(chunk))
+                count += self.conn.execute(
+                    f'SELECT COUNT(*) FROM {link_table} WHERE value_id IN ({marks})', chunk).fetchone()[0]
+            return count
+
+    def all_ids(self):
+        with self._lock:
+            return [row[0] for row in self.conn.execute('SELECT id FROM entries ORDER BY id')]
+
+    def search_by_author(self, author):
+        with self._lock:
+            return self._load_entries(self.find_ids('author', author))
+
+    def search_by_tag(self, tag):
+        with self._lock:
+            return self._load_entries(self.find_ids('tag', tag))
+
+    def search_by_character(self, character):
+        with self._lock:
+            return self._load_entries(self.find_ids('character', character))
+
+    # Все записи по порядку ID, порциями, без загрузки каталога целиком
+    def iter_entries(self, batch=CHUNK_SIZE):
+        last_id = 0
+        while True:
+            with self._lock:
+                ids = [row[0] for row in self.conn.execute(
+                    'SELECT id FROM entries WHERE id > ? ORDER BY id LIMIT ?', (last_id, batch))]
+                if not ids:
+                    return
+                entries = self._load_entries(ids)
+            yield from entries
+            last_id = ids[-1]
+
+    def suggest_tags(self, authors=(), characters=(), tags=(), k=5):
+        return self._tag_model.suggest(authors, characters, tags, k)
+
+    # Авторы, похожие на запрос с опечатками: [(написание, число записей)]
+    def suggest_authors(self, query, k=5):
+        with self._lock:
+            return self._author_stats.suggest(query, k)
+
+    # Случайные авторы со статистикой; время не зависит от размера каталога
+    def sample_authors(self, k=3, top_tags=3):
+        with self._lock:
+            return [{'author': name, 'count': count, 'last_added': last_added,
+                     'top_tags': self._tag_model.top_tags(('author', key), top_tags)}
+                    for key, name, count, last_added in self._author_stats.sample(k)]
+
+    def get_entries(self):
+        with self._lock:
+            ids = [row[0] for row in self.conn.execute('SELECT id FROM entries ORDER BY id')]
+            return self._load_entries(ids)
+
+    def get_all_authors(self):
+        with self._lock:
+            authors = [row[0] for row in self.conn.execute(
+                'SELECT name FROM authors WHERE id IN (SELECT value_id FROM entry_authors)')]
+        return sorted(authors, key=lambda x: x.lower())
+
+
+# Одноразовый перенос каталога из photos.json в SQLite
+def migrate_from_json(json_path='photos.json', sqlite_path='photos.db'):
+    with open(json_path, 'r') as f:
+        entries = json.load(f)
+    db = SQLitePhotoDatabase(sqlite_path)
+    try:
+        if db.conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]:
+            raise ValueError(f"{sqlite_path} уже содержит записи, миграция отменена")
+        db.import_entries(sorted(entries, key=lambda x: x['id']))
+    finally:
+        db.close()
+    return len(entries)
+
@@ -0,0 +1,287 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from datetime import timedelta
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+MEDIA_GROUP_SIZE = 10  # Больше фотографий в одном альбоме Telegram не принимает
+
+
+# RetryAfter.retry_after — число секунд или timedelta, в зависимости от версии python-telegram-bot
+def _seconds(value):
+    return value.total_seconds() if isinstance(value, timedelta) else float(value)
+
+
+# Подписки на авторов и очередь неотправленных уведомлений; всё хранится в SQLite,
+# поэтому после перезапуска очередь продолжается с того же места
+class SubscriptionStore:
+    def __init__(self, filename='subscriptions.db'):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        with self._lock, self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS subscriptions ('
+                              'chat_id INTEGER NOT NULL, author_key TEXT NOT NULL, author TEXT NOT NULL, '
+                              'PRIMARY KEY (chat_id, author_key)) WITHOUT ROWID')
+            # Индекс по автору: подписчики нового фото находятся одним запросом
+            self.conn.execute('CREATE INDEX IF NOT EXISTS subscriptions_author ON subscriptions(author_key, chat_id)')
+            # Одна строка на чат и запись: фото двух авторов, на которых подписан пользователь, придёт один раз
+            self.conn.execute('CREATE TABLE IF NOT EXISTS pending ('
+                              'chat_id INTEGER NOT NULL, entry_id INTEGER NOT NULL, author TEXT NOT NULL, '
+                              'attempts INTEGER NOT NULL DEFAULT 0, next_attempt REAL NOT NULL DEFAULT 0, '
+                              'PRIMARY KEY (chat_id, entry_id)) WITHOUT ROWID')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS pending_due ON pending(next_attempt)')
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def subscribe(self, chat_id, author):
+        with self._lock, self.conn:
+            cursor = self.conn.execute('INSERT OR IGNORE INTO subscriptions (chat_id, author_key, author) '
+                                       'VALUES (?, ?, ?)', (chat_id, author.lower(), author))
+        return cursor.rowcount > 0
+
+    def unsubscribe(self, chat_id, author):
+        with self._lock, self.conn:
+            cursor = self.conn.execute('DELETE FROM subscriptions WHERE chat_id = ? AND author_key = ?',
+                                       (chat_id, author.lower()))
+        return cursor.rowcount > 0
+
+    # Чат недоступен (бот заблокирован): убираем и подписки, и очередь
+    def remove_chat(self, chat_id):
+        with self._lock, self.conn:
+            self.conn.execute('DELETE FROM subscriptions WHERE chat_id = ?', (chat_id,))
+            self.conn.execute('DELETE FROM pending WHERE chat_id = ?', (chat_id,))
+
+    def authors(self, chat_id):
+        with self._lock:
+            return [row[0] for row in self.conn.execute(
+                'SELECT author FROM subscriptions WHERE chat_id = ? ORDER BY author_key', (chat_id,))]
+
+    def subscribers(self, author):
+        with self._lock:
+            return [row[0] for row in self.conn.execute(
+                'SELECT chat_id FROM subscriptions WHERE author_key = ?', (author.lower(),))]
+
+    # Ставит новую запись в очередь всем подписчикам её авторов; возвращает число чатов
+    def enqueue(self, entry_id, authors):
+        keys = sorted({author.lower() for author in authors if author})
+        if not keys:
+            return 0
+        placeholders = ', '.join('?' * len(keys))
+        with self._lock, self.conn:
+            cursor = self.conn.execute(
+                'INSERT OR IGNORE INTO pending (chat_id, entry_id, author) '
+                f'SELECT chat_id, ?, MIN(author) FROM subscriptions WHERE author_key IN ({placeholders}) '
+                'GROUP BY chat_id', (entry_id, *keys))
+        return cursor.rowcount
+
+    # Чаты, которым пора отправлять, и ближайшее время следующей повторной попытки (или None)
+    def due_chats(self, now):
+        with self._lock:
+            chats = [row[0] for row in self.conn.execute(
+                'SELECT DISTINCT chat_id FROM pending WHERE next_attempt <= ?', (now,))]
+            next_attempt = self.conn.execute('SELECT MIN(next_attempt) FROM pending WHERE next_attempt > ?',
+                                             (now,)).fetchone()[0]
+        return chats, next_attempt
+
+    # Следующая пачка чата: [(ID записи, автор)] в порядке добавления
+    def take(self, chat_id, limit, now):
+        with self._lock:
+            return self.conn.execute('SELECT entry_id, author FROM pending '
+                                     'WHERE chat_id = ? AND next_attempt <= ? ORDER BY entry_id LIMIT ?',
+                                     (chat_id, now, limit)).fetchall()
+
+    def done(self, chat_id, entry_ids):
+        with self._lock, self.conn:
+            self.conn.executemany('DELETE FROM pending WHERE chat_id = ? AND entry_id = ?',
+                                  [(chat_id, entry_id) for entry_id in entry_ids])
+
+    # Неудачная попытка: следующая — через delay(номер попытки) секунд; возвращает эту задержку
+    def retry_later(self, chat_id, entry_ids, delay, now):
+        with self._lock, self.conn:
+            placeholders = ', '.join('?' * len(entry_ids))
+            previous = self.conn.execute(
+                f'SELECT MAX(attempts) FROM pending WHERE chat_id = ? AND entry_id IN ({placeholders})',
+                (chat_id, *entry_ids)).fetchone()[0]
+            attempts = (previous or 0) + 1
+            seconds = delay(attempts)
+            self.conn.executemany('UPDATE pending SET attempts = ?, next_attempt = ? '
+                                  'WHERE chat_id = ? AND entry_id = ?',
+                                  [(attempts, now + seconds, chat_id, entry_id) for entry_id in entry_ids])
+        return seconds
+
+    def pending_count(self):
+        with self._lock:
+            return self.conn.execute('SELECT COUNT(*) FROM pending').fetchone()[0]
+
+
+# Маркерная корзина: в среднем не больше rate единиц в секунду, всплеск до burst.
+# pause() останавливает всех, когда Telegram отвечает «слишком много запросов»
+class RateLimiter:
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self, cost=1):
+        cost = min(cost, self.capacity)
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= cost:
+                self.tokens -= cost
+                return
+            await asyncio.sleep((cost - self.tokens) / self.rate)
+
+
+# Рассылка уведомлений подписчикам. Записи каталога ставятся в очередь SubscriptionStore,
+# через batch_delay секунд очередь разбирают workers задач: каждому чату — альбомом до 10 фото,
+# не чаще раза в chat_interval секунд, всем вместе — не больше global_rate фото в секунду.
+# Строка очереди удаляется только после ответа Telegram, поэтому перезапуск ничего не теряет
+class Notifier:
+    def __init__(self, store, deliver, io, batch_delay=10.0, global_rate=25, chat_interval=1.0, workers=8,
+                 backoff=1.0, max_backoff=600.0):
+        self.store = store
+        self.deliver = deliver  # async deliver(bot, chat_id, [(ID записи, автор)])
+        self.io = io
+        self.batch_delay = batch_delay
+        self.chat_interval = chat_interval
+        self.workers = workers
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        # Всплеск — не больше одного альбома сверх среднего темпа
+        self.limiter = RateLimiter(global_rate, burst=MEDIA_GROUP_SIZE)
+        self.sent = 0  # Отправлено фотографий
+        self.retries = 0
+        self.dropped = 0  # Не доставлено и удалено из очереди (чат недоступен или запрос отклонён)
+        self._bot = None
+        self._loop = None
+        self._event = None
+        self._queue = None
+        self._tasks = []
+        self._active = set()  # Чаты в очереди или в работе: пачки одного чата идут строго по очереди
+        self._chat_next = {}  # chat_id -> время, раньше которого в чат не пишем
+        self._stopping = False
+
+    def start(self, bot):
+        self._bot = bot
+        self._loop = asyncio.get_running_loop()
+        self._event = asyncio.Event()
+        self._queue = asyncio.Queue()
+        self._stopping = False
+        self._tasks = [self._loop.create_task(self._dispatch())]
+        self._tasks += [self._loop.create_task(self._work()) for _ in range(self.workers)]
+        self._event.set()  # Досылаем то, что осталось с прошлого запуска
+
+    # Слушатель записей каталога; может вызываться из любого потока
+    def on_change(self, op, entry, previous):
+        if op == 'add' and self.store.enqueue(entry['id'], entry['authors']):
+            self.wake()
+
+    def wake(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._event.set)
+
+    def _retry_delay(self, attempts):
+        return min(self.max_backoff, self.backoff * 2 ** (attempts - 1))
+
+    async def _dispatch(self):
+        while True:
+            await self._event.wait()
+            # Копим пачку: фото, добавленные за batch_delay, уйдут одним альбомом
+            await asyncio.sleep(self.batch_delay)
+            self._event.clear()
+            now = time.time()
+            chats, next_attempt = await self.io.run(self.store.due_chats, now)
+            for chat_id in chats:
+                if chat_id not in self._active:
+                    self._active.add(chat_id)
+                    self._queue.put_nowait(chat_id)
+            if next_attempt is not None:
+                self._loop.call_later(max(0.0, next_attempt - now), self._event.set)
+            monotonic = time.monotonic()
+            for chat_id in [chat_id for chat_id, until in self._chat_next.items() if until <= monotonic]:
+                del self._chat_next[chat_id]
+
+    async def _work(self):
+        while True:
+            chat_id = await self._queue.get()
+            if chat_id is None:
+                return
+            try:
+                await self._deliver_chat(chat_id)
+            except Exception:
+                logger.exception("Не удалось разослать уведомления в чат %s", chat_id)
+            finally:
+                self._active.discard(chat_id)
+
+    async def _deliver_chat(self, chat_id):
+        while not self._stopping:
+            batch = await self.io.run(self.store.take, chat_id, MEDIA_GROUP_SIZE, time.time())
+            if not batch:
+                return
+            entry_ids = [entry_id for entry_id, _ in batch]
+            wait = self._chat_next.get(chat_id, 0.0) - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            await self.limiter.acquire(len(batch))
+            try:
+                await self.deliver(self._bot, chat_id, batch)
+            except RetryAfter as e:
+                # Превышен лимит Telegram: ждут все, пачка повторяется без счёта попыток
+                self.limiter.pause(_seconds(e.retry_after))
+                self.retries += 1
+                continue
+            except Forbidden:
+                await self.io.run(self.store.remove_chat, chat_id)
+                self.dropped += len(batch)
+                return
+            except BadRequest as e:
+                # Запрос не пройдёт и при повторе (чат не найден, записи нет на диске)
+                logger.warning("Уведомление в чат %s отклонено: %s", chat_id, e)
+                await self.io.run(self.store.done, chat_id, entry_ids)
+                self.dropped += len(batch)
+                continue
+            except NetworkError:
+                # Временная ошибка: экспоненциальная пауза, очередь сохранена в базе
+                delay = await self.io.run(self.store.retry_later, chat_id, entry_ids, self._retry_delay, time.time())
+                self._loop.call_later(delay, self._event.set)
+                self.retries += 1
+                return
+            await self.io.run(self.store.done, chat_id, entry_ids)
+            self.sent += len(batch)
+            self._chat_next[chat_id] = time.monotonic() + self.chat_interval
+
+    # Останавливает рассылку, дав начатым отправкам завершиться: иначе после перезапуска
+    # уже доставленная пачка ушла бы повторно
+    async def stop(self, timeout=30):
+        if not self._tasks:
+            return
+        self._stopping = True
+        dispatcher, workers = self._tasks[0], self._tasks[1:]
+        dispatcher.cancel()
+        for _ in workers:
+            self._queue.put_nowait(None)
+        done, pending = await asyncio.wait(workers, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(dispatcher, *pending, return_exceptions=True)
+        self._tasks = []
+        self._active.clear()
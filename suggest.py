@@ -0,0 +1,81 @@
+import heapq
+import sys
+
+
+# Инкрементальная модель совместной встречаемости: автор -> теги, персонаж -> теги, тег -> теги.
+# Счётчики каждого ключа ограничены capacity (редкие теги отбрасываются), топ-k кэшируется
+class CooccurrenceModel:
+    def __init__(self, top_k=10, capacity=200):
+        self.top_k = top_k
+        self.capacity = capacity
+        self.counts = {}  # ключ -> {тег: число совместных появлений}
+        self.names = {}  # тег в нижнем регистре -> написание при первом появлении
+        self._top = {}  # ключ -> [(число, тег)] по убыванию, сбрасывается при изменении
+
+    def clear(self):
+        self.counts.clear()
+        self.names.clear()
+        self._top.clear()
+
+    @staticmethod
+    def _keys(entry):
+        keys = [('author', author.lower()) for author in entry['authors'] if author]
+        keys += [('character', character.lower()) for character in entry['characters'] if character]
+        return keys
+
+    def _change(self, key, tag, delta):
+        counts = self.counts.setdefault(key, {})
+        value = counts.get(tag, 0) + delta
+        if value > 0:
+            counts[tag] = value
+        else:
+            counts.pop(tag, None)
+            if not counts:
+                del self.counts[key]
+        if len(counts) > self.capacity * 2:
+            # Оставляем capacity самых частых тегов
+            kept = heapq.nlargest(self.capacity, counts.items(), key=lambda item: item[1])
+            self.counts[key] = dict(kept)
+        self._top.pop(key, None)
+
+    def add(self, entry, delta=1):
+        # Ключи хранятся в счётчиках многих авторов и тегов: одна строка на тег вместо копии на каждую запись
+        tags = {sys.intern(tag.lower()): tag for tag in entry['tags'] if tag}
+        for tag, name in tags.items():
+            self.names.setdefault(tag, name)
+        for key in self._keys(entry):
+            for tag in tags:
+                self._change(key, tag, delta)
+        for tag in tags:
+            for other in tags:
+                if other != tag:
+                    self._change(('tag', tag), other, delta)
+
+    def remove(self, entry):
+        self.add(entry, delta=-1)
+
+    def top(self, key):
+        top = self._top.get(key)
+        if top is None:
+            counts = self.counts.get(key, {})
+            top = heapq.nlargest(self.top_k, ((count, tag) for tag, count in counts.items()))
+            self._top[key] = top
+        return top
+
+    # Самые частые теги ключа в исходном написании
+    def top_tags(self, key, n):
+        return [self.names.get(tag, tag) for _, tag in self.top(key)[:n]]
+
+    # Топ-k тегов для уже введённых авторов, персонажей и тегов
+    def suggest(self, authors=(), characters=(), tags=(), k=5):
+        keys = [('author', author.lower()) for author in authors]
+        keys += [('character', character.lower()) for character in characters]
+        keys += [('tag', tag.lower()) for tag in tags]
+        exclude = {tag.lower() for tag in tags}
+        scores = {}
+        for key in keys:
+            for count, tag in self.top(key):
+                if tag not in exclude:
+                    scores[tag] = scores.get(tag, 0) + count
+        best = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:k]
+        return [self.names.get(tag, tag) for tag, _ in best]
@@ -0,0 +1,56 @@
+import asyncio
+import sys
+
+from telegram.ext import BaseUpdateProcessor
+
+
+# Ключ очереди обновления: как у ConversationHandler по умолчанию (per_chat и per_user).
+# Обновления без чата и пользователя ни с чем не упорядочиваются
+def update_key(update):
+    chat = getattr(update, 'effective_chat', None)
+    user = getattr(update, 'effective_user', None)
+    if chat is None and user is None:
+        return None
+    return (chat.id if chat else None, user.id if user else None)
+
+
+# Обновления разных пользователей обрабатываются параллельно (не больше max_concurrent_updates сразу),
+# обновления одного пользователя в одном чате — строго по очереди, в порядке получения,
+# чтобы состояния ConversationHandler и user_data не перемешивались.
+# Ограничение берётся уже после очереди пользователя: пачка сообщений от одного человека
+# ждёт своей очереди, не занимая места других пользователей
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates):
+        # Семафор базового класса берётся до очереди пользователя, поэтому делаем его неограниченным
+        super().__init__(sys.maxsize)
+        if max_concurrent_updates < 1:
+            raise ValueError("max_concurrent_updates должен быть положительным")
+        self.limit = max_concurrent_updates
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        self._queues = {}  # ключ -> [asyncio.Lock, число обновлений в очереди]
+
+    async def do_process_update(self, update, coroutine):
+        key = update_key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+        # asyncio.Lock пропускает ожидающих по очереди (FIFO), поэтому порядок обновлений сохраняется
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = [asyncio.Lock(), 0]
+        queue[1] += 1
+        try:
+            async with queue[0]:
+                async with self._slots:
+                    await coroutine
+        finally:
+            queue[1] -= 1
+            if not queue[1]:
+                del self._queues[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -0,0 +1,212 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageOps
+
+from backup import file_hash
+
+# Варианты изображения: имя -> (наибольшая сторона, качество JPEG).
+# Telegram сам ужимает фотографии до 1280 px, поэтому больше отправлять незачем
+VARIANTS = {
+    'thumb': (320, 80),
+    'telegram': (1280, 87),
+}
+# Временный файл старше этого — остаток прерванной записи; более свежий может дописывать
+# другой процесс (бот рядом с командой main.py), его не трогаем
+TMP_MAX_AGE = 60 * 60
+
+
+# Уменьшенная копия в JPEG; выполняется в пуле процессов. Возвращает размер файла
+def render_variant(source_path, target_path, size, quality):
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    tmp_path = f'{target_path}.{os.getpid()}.tmp'
+    with Image.open(source_path) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size), Image.LANCZOS)
+        image.convert('RGB').save(tmp_path, 'JPEG', quality=quality, optimize=True)
+    os.replace(tmp_path, target_path)
+    return os.path.getsize(target_path)
+
+
+# Кэш вариантов с адресацией по содержимому: <root>/<вариант>/<2 символа хэша>/<хэш>.jpg.
+# Общий объём ограничен max_bytes, вытесняются давно не использованные файлы (время доступа — mtime).
+# Папка читается при первом обращении, а не при создании объекта
+class VariantCache:
+    def __init__(self, root='photos_variants', max_bytes=2 * 1024 * 1024 * 1024, workers=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self.total_bytes = 0
+        self._lock = threading.Lock()
+        self._files = OrderedDict()  # путь варианта -> размер, от давно использованных к недавним
+        self._hashes = {}  # путь оригинала -> (размер, mtime, хэш)
+        self._pending = {}  # путь варианта -> Future создания
+        self._pool = None
+        self._scanned = False
+
+    def _ensure_scanned(self):
+        if self._scanned:
+            return
+        with self._lock:
+            if self._scanned:
+                return
+            evicted = self._scan()
+            self._scanned = True
+        self._remove(evicted)
+
+    # Читает папку кэша; вызывать под блокировкой. Возвращает файлы сверх лимита для удаления
+    def _scan(self):
+        files = []
+        stale = time.time() - TMP_MAX_AGE
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue  # Временный файл другого процесса уже переименован
+                if filename.endswith('.tmp'):
+                    if stat.st_mtime < stale:
+                        self._remove([path])
+                    continue
+                files.append((stat.st_mtime_ns, path, stat.st_size))
+        for _, path, size in sorted(files):
+            self._files[path] = size
+            self.total_bytes += size
+        return self._evict()  # Лимит могли уменьшить с прошлого запуска
+
+    def _executor(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    # cancel — отменить ещё не начатые задания вместо ожидания всей очереди
+    def close(self, cancel=False):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=cancel)
+            self._pool = None
+
+    def _content_hash(self, file_path):
+        stat = os.stat(file_path)
+        with self._lock:
+            cached = self._hashes.get(file_path)
+        if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+            return cached[2]
+        digest = file_hash(file_path)
+        with self._lock:
+            self._hashes[file_path] = (stat.st_size, stat.st_mtime_ns, digest)
+        return digest
+
+    def variant_path(self, file_path, variant):
+        self._ensure_scanned()
+        digest = self._content_hash(file_path)
+        return os.path.join(self.root, variant, digest[:2], digest + '.jpg')
+
+    def _touch(self, path):
+        with self._lock:
+            if path in self._files:
+                self._files.move_to_end(path)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    # Снимает с учёта давно не использованные файлы сверх лимита; вызывать под блокировкой
+    def _evict(self):
+        evicted = []
+        while self.total_bytes > self.max_bytes and len(self._files) > 1:
+            old_path, old_size = self._files.popitem(last=False)
+            self.total_bytes -= old_size
+            evicted.append(old_path)
+        return evicted
+
+    @staticmethod
+    def _remove(paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _register(self, path, size):
+        with self._lock:
+            self.total_bytes += size - self._files.pop(path, 0)
+            self._files[path] = size
+            evicted = self._evict()
+        self._remove(evicted)
+
+    # Запускает создание варианта в пуле процессов (если его ещё нет); возвращает Future или None
+    def submit(self, file_path, variant):
+        path = self.variant_path(file_path, variant)
+        with self._lock:
+            if path in self._files:
+                return None
+            future = self._pending.get(path)
+            if future is not None:
+                return future
+            size, quality = VARIANTS[variant]
+            future = self._pending[path] = self._executor().submit(render_variant, file_path, path, size, quality)
+
+        def done(future):
+            with self._lock:
+                self._pending.pop(path, None)
+            if not future.cancelled() and future.exception() is None:
+                self._register(path, future.result())
+        future.add_done_callback(done)
+        return future
+
+    # Все варианты нового файла — в фоне, при добавлении в каталог
+    def prefetch(self, file_path):
+        if not os.path.exists(file_path):
+            return
+        for variant in VARIANTS:
+            try:
+                self.submit(file_path, variant)
+            except OSError:
+                return
+
+    # Путь к варианту, при необходимости создаёт его и ждёт; None, если изображение не читается.
+    # Блокирующий вызов: из обработчиков — через пул потоков
+    def get(self, file_path, variant):
+        path = self.variant_path(file_path, variant)
+        if os.path.exists(path):
+            self._touch(path)
+            return path
+        future = self.submit(file_path, variant)
+        if future is not None:
+            try:
+                future.result()
+            except (OSError, ValueError):
+                return None
+        return path if os.path.exists(path) else None
+
+    # Вариант для отправки, а если его нельзя сделать — оригинал
+    def read(self, file_path, variant):
+        path = self.get(file_path, variant) or file_path
+        with open(path, 'rb') as f:
+            return f.read()
+
+    # Однократное заполнение кэша для всего каталога: (создано, ошибок)
+    def backfill(self, file_paths, variants=None, progress=None):
+        self._ensure_scanned()
+        futures = []
+        for file_path in file_paths:
+            if not os.path.exists(file_path):
+                continue
+            for variant in variants or VARIANTS:
+                future = self.submit(file_path, variant)
+                if future is not None:
+                    futures.append(future)
+        created = failed = 0
+        for future in futures:
+            try:
+                future.result()
+                created += 1
+            except (OSError, ValueError):
+                failed += 1
+            if progress is not None:
+                progress(created + failed, len(futures))
+        return created, failed